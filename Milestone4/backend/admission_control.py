@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""Admission Control Module
+
+Decides which inference requests the model server takes on, and in what order.
+
+* Token buckets limit each user and each model to a sustained request rate with
+  some burst allowance.
+* Every model queue is a weighted fair queue. Waiting requests are ordered by
+  start-time fair queueing over users, so a user with many queued requests gets
+  one turn per round like everyone else. Weights come from the user's role.
+* Queues have a maximum depth and a per-user cap. Streams have a per-model and
+  a per-user concurrency cap.
+
+A request that does not fit is refused straight away with AdmissionRejected,
+which carries a Retry-After estimate, instead of waiting behind the backlog.
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Admission knobs (Load from env in production); a rate of 0 disables that limit
+USER_RATE_LIMIT_RPS = float(os.environ.get("USER_RATE_LIMIT_RPS", 2))
+USER_RATE_LIMIT_BURST = float(os.environ.get("USER_RATE_LIMIT_BURST", 10))
+MODEL_RATE_LIMIT_RPS = float(os.environ.get("MODEL_RATE_LIMIT_RPS", 0))
+MODEL_RATE_LIMIT_BURST = float(os.environ.get("MODEL_RATE_LIMIT_BURST", 50))
+MODEL_QUEUE_MAX_DEPTH = int(os.environ.get("MODEL_QUEUE_MAX_DEPTH", 64))
+FAIR_QUEUE_MAX_PER_USER = int(os.environ.get("FAIR_QUEUE_MAX_PER_USER", 8))
+MODEL_MAX_STREAMS = int(os.environ.get("MODEL_MAX_STREAMS", 8))
+# Concurrent streams one user may hold across all models (0 = no per-user cap)
+USER_MAX_STREAMS = int(os.environ.get("USER_MAX_STREAMS", 2))
+# Fair-queue weight per role, e.g. "admin=2,user=1"
+FAIR_QUEUE_WEIGHTS = os.environ.get("FAIR_QUEUE_WEIGHTS", "admin=2,user=1")
+
+# Idle buckets are forgotten once there are more than this many
+_MAX_BUCKETS = 10000
+
+
+def parse_weights(spec: str) -> Dict[str, float]:
+    weights = {}
+    for part in spec.split(","):
+        name, _, value = part.partition("=")
+        if name.strip() and value.strip():
+            weights[name.strip()] = max(0.01, float(value))
+    return weights
+
+
+ROLE_WEIGHTS = parse_weights(FAIR_QUEUE_WEIGHTS)
+
+
+def weight_for_role(role: Optional[str]) -> float:
+    return ROLE_WEIGHTS.get(role or "user", ROLE_WEIGHTS.get("user", 1.0))
+
+
+class AdmissionRejected(Exception):
+    """A request was refused; retry_after is a hint in seconds."""
+
+    def __init__(self, message: str, retry_after: float = 1.0, reason: str = "overloaded"):
+        super().__init__(message)
+        self.retry_after = max(0.0, retry_after)
+        self.reason = reason
+
+
+class TokenBucket:
+    """Classic token bucket: ``rate`` tokens per second up to ``burst``."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, now: Optional[float] = None) -> float:
+        """Take one token. Returns 0.0 on success, else the seconds until one is available."""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+    def refund(self) -> None:
+        self.tokens = min(self.burst, self.tokens + 1.0)
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class RateLimiter:
+    """Per-user and per-model token buckets."""
+
+    def __init__(self, user_rate: float = USER_RATE_LIMIT_RPS, user_burst: float = USER_RATE_LIMIT_BURST,
+                 model_rate: float = MODEL_RATE_LIMIT_RPS, model_burst: float = MODEL_RATE_LIMIT_BURST):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.model_rate = model_rate
+        self.model_burst = model_burst
+        self._users: Dict[str, TokenBucket] = {}
+        self._models: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.limited_user = 0
+        self.limited_model = 0
+
+    def _bucket(self, buckets: Dict[str, TokenBucket], key: str, rate: float, burst: float, now: float) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) >= _MAX_BUCKETS:
+                for idle in [k for k, b in buckets.items() if b.is_full(now)]:
+                    del buckets[idle]
+            bucket = buckets[key] = TokenBucket(rate, burst)
+        return bucket
+
+    def check(self, user_key: str, model_name: str) -> None:
+        """Spend one request from the user's and the model's budget, or raise AdmissionRejected."""
+        now = time.monotonic()
+        with self._lock:
+            user_bucket = None
+            if self.user_rate > 0:
+                user_bucket = self._bucket(self._users, user_key, self.user_rate, self.user_burst, now)
+                wait = user_bucket.try_acquire(now)
+                if wait:
+                    self.limited_user += 1
+                    raise AdmissionRejected("Rate limit exceeded, slow down", wait, "user_rate")
+            if self.model_rate > 0:
+                model_bucket = self._bucket(self._models, model_name, self.model_rate, self.model_burst, now)
+                wait = model_bucket.try_acquire(now)
+                if wait:
+                    # The user was not served, so give their token back
+                    if user_bucket is not None:
+                        user_bucket.refund()
+                    self.limited_model += 1
+                    raise AdmissionRejected(f"Model {model_name} is at its request rate limit", wait, "model_rate")
+            self.admitted += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'user_rate_rps': self.user_rate,
+                'user_burst': self.user_burst,
+                'model_rate_rps': self.model_rate,
+                'model_burst': self.model_burst,
+                'admitted': self.admitted,
+                'limited_user': self.limited_user,
+                'limited_model': self.limited_model,
+                'tracked_users': len(self._users)
+            }
+
+
+class FairQueue:
+    """
+    Weighted fair queue (start-time fair queueing) for one asyncio consumer.
+
+    Each put is tagged with start = max(virtual time, the key's last finish tag)
+    and the key's finish tag advances by 1/weight. get returns the smallest start
+    tag, so keys take turns in proportion to their weights whatever their backlog.
+
+    An entry whose caller gave up can be discarded while it waits. It then stops
+    counting toward the depth and the key's share at once, and get skips it.
+    """
+
+    def __init__(self, max_depth: int = MODEL_QUEUE_MAX_DEPTH, max_per_key: int = FAIR_QUEUE_MAX_PER_USER):
+        self.max_depth = max(1, max_depth)
+        self.max_per_key = max(1, max_per_key)
+        # [start tag, sequence, key, item, still queued]
+        self._heap: List[List[Any]] = []
+        # Queued entries, not counting discarded ones still in the heap
+        self._size = 0
+        self._finish: Dict[str, float] = {}
+        self._per_key: Dict[str, int] = {}
+        self._virtual = 0.0
+        self._seq = 0
+        self._ready = asyncio.Event()
+        self.rejected_full = 0
+        self.rejected_key = 0
+        self.discarded = 0
+
+    def qsize(self) -> int:
+        return self._size
+
+    def empty(self) -> bool:
+        return not self._size
+
+    def waiting_keys(self) -> int:
+        return len(self._per_key)
+
+    def check(self, key: str = "", retry_after: float = 1.0) -> None:
+        """Raise AdmissionRejected when the queue or the key's share is full."""
+        if self._size >= self.max_depth:
+            self.rejected_full += 1
+            raise AdmissionRejected("Server is busy, please retry shortly", retry_after, "queue_full")
+        if self._per_key.get(key, 0) >= self.max_per_key:
+            self.rejected_key += 1
+            raise AdmissionRejected("Too many requests in flight for this user", retry_after, "user_queue_full")
+
+    def put_nowait(self, item: Any, key: str = "", weight: float = 1.0, retry_after: float = 1.0) -> List[Any]:
+        """
+        Queue item for key, or raise AdmissionRejected when the queue or the key's share is full.
+
+        Returns the entry's handle for discard().
+        """
+        self.check(key, retry_after)
+        start = max(self._virtual, self._finish.get(key, 0.0))
+        self._finish[key] = start + 1.0 / max(weight, 0.01)
+        self._per_key[key] = self._per_key.get(key, 0) + 1
+        self._seq += 1
+        entry = [start, self._seq, key, item, True]
+        heapq.heappush(self._heap, entry)
+        self._size += 1
+        self._ready.set()
+        return entry
+
+    def _release(self, entry: List[Any]) -> None:
+        entry[4] = False
+        self._size -= 1
+        key = entry[2]
+        remaining = self._per_key[key] - 1
+        if remaining:
+            self._per_key[key] = remaining
+        else:
+            del self._per_key[key]
+        if not self._size:
+            self._ready.clear()
+            self._heap.clear()
+            # Nobody is waiting, so old finish tags can no longer matter
+            self._finish = {k: f for k, f in self._finish.items() if f > self._virtual}
+
+    def discard(self, entry: List[Any]) -> None:
+        """Drop a still-queued entry (its caller went away); a no-op once it was taken."""
+        if entry[4]:
+            self.discarded += 1
+            self._release(entry)
+
+    def get_nowait(self) -> Any:
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            if entry[4]:
+                self._virtual = max(self._virtual, entry[0])
+                self._release(entry)
+                return entry[3]
+        raise asyncio.QueueEmpty
+
+    async def get(self) -> Any:
+        while not self._size:
+            await self._ready.wait()
+        return self.get_nowait()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'queue_size': self._size,
+            'max_depth': self.max_depth,
+            'waiting_users': len(self._per_key),
+            'rejected_full': self.rejected_full,
+            'rejected_user_full': self.rejected_key,
+            'discarded': self.discarded
+        }
+
+
+class StreamSlots:
+    """Caps concurrent streams per model and per user."""
+
+    def __init__(self, max_streams: int = MODEL_MAX_STREAMS, max_per_user: int = USER_MAX_STREAMS):
+        self.max_streams = max(1, max_streams)
+        self.max_per_user = max_per_user
+        self._active: Dict[str, int] = {}
+        self._per_user: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.rejected_user = 0
+
+    def acquire(self, model_name: str, user_key: str = "") -> None:
+        with self._lock:
+            if self.max_per_user > 0 and self._per_user.get(user_key, 0) >= self.max_per_user:
+                self.rejected_user += 1
+                raise AdmissionRejected("Too many concurrent streams for this user", 2.0, "user_streams_full")
+            if self._active.get(model_name, 0) >= self.max_streams:
+                self.rejected += 1
+                raise AdmissionRejected(f"Too many concurrent streams on {model_name}", 2.0, "streams_full")
+            self._active[model_name] = self._active.get(model_name, 0) + 1
+            self._per_user[user_key] = self._per_user.get(user_key, 0) + 1
+
+    def release(self, model_name: str, user_key: str = "") -> None:
+        with self._lock:
+            self._active[model_name] = max(0, self._active.get(model_name, 0) - 1)
+            remaining = self._per_user.get(user_key, 0) - 1
+            if remaining > 0:
+                self._per_user[user_key] = remaining
+            else:
+                self._per_user.pop(user_key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {'max_streams': self.max_streams, 'max_per_user': self.max_per_user, 'active': dict(self._active),
+                    'streaming_users': len(self._per_user), 'rejected': self.rejected,
+                    'rejected_user': self.rejected_user}
@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+"""Batch Scheduler Module
+
+Collects concurrent inference requests for the same model into dynamic batches
+so that one model.generate() call serves many callers. Every request for a model,
+batched or streamed, waits in that model's bounded weighted fair queue (see
+admission_control), so the model's workers are shared fairly across users and a
+full queue refuses new work immediately.
+"""
+
+import os
+import math
+import time
+import asyncio
+import logging
+import functools
+import threading
+import concurrent.futures
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .admission_control import FAIR_QUEUE_MAX_PER_USER, MODEL_QUEUE_MAX_DEPTH, FairQueue
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Batching knobs (Load from env in production)
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", 8))
+BATCH_MAX_DELAY_MS = float(os.environ.get("BATCH_MAX_DELAY_MS", 20))
+
+
+def nearest_rank(ordered: List[float], q: float) -> float:
+    """
+    The q-th percentile (0 < q <= 1) of sorted values by the nearest-rank method:
+    the smallest value with at least q of the values at or below it.
+
+    >>> values = list(range(1, 101))
+    >>> nearest_rank(values, 0.50), nearest_rank(values, 0.95), nearest_rank(values, 0.99)
+    (50, 95, 99)
+    >>> nearest_rank([1, 2, 3], 0.5)
+    2
+    """
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))]
+
+
+class BatchMetrics:
+    """Running per-scheduler batch statistics."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.failed_batches = 0
+        self.max_batch_size = 0
+        self.total_queue_delay = 0.0
+        self.total_batch_time = 0.0
+        self.batch_size_histogram: Dict[int, int] = {}
+        self.last_batch: Dict[str, Any] = {}
+        # Queue waits of recent requests, for percentiles
+        self.recent_queue_delays: deque = deque(maxlen=1024)
+
+    def record(self, size: int, queue_delays: List[float], batch_time: float, failed: bool = False) -> None:
+        with self.lock:
+            self.batches += 1
+            self.requests += size
+            if failed:
+                self.failed_batches += 1
+            self.max_batch_size = max(self.max_batch_size, size)
+            self.total_queue_delay += sum(queue_delays)
+            self.recent_queue_delays.extend(queue_delays)
+            self.total_batch_time += batch_time
+            self.batch_size_histogram[size] = self.batch_size_histogram.get(size, 0) + 1
+            self.last_batch = {
+                'size': size,
+                'batch_time_ms': round(batch_time * 1000, 2),
+                'max_queue_delay_ms': round(max(queue_delays) * 1000, 2) if queue_delays else 0.0,
+                'finished_at': time.time()
+            }
+
+    def avg_batch_time(self) -> float:
+        with self.lock:
+            return self.total_batch_time / self.batches if self.batches else 0.0
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            delays = sorted(self.recent_queue_delays)
+            return {
+                'batches': self.batches,
+                'requests': self.requests,
+                'failed_batches': self.failed_batches,
+                'avg_batch_size': round(self.requests / self.batches, 2) if self.batches else 0.0,
+                'max_batch_size': self.max_batch_size,
+                'avg_queue_delay_ms': round(self.total_queue_delay / self.requests * 1000, 2) if self.requests else 0.0,
+                'p50_queue_delay_ms': round(nearest_rank(delays, 0.50) * 1000, 2) if delays else 0.0,
+                'p95_queue_delay_ms': round(nearest_rank(delays, 0.95) * 1000, 2) if delays else 0.0,
+                'max_recent_queue_delay_ms': round(delays[-1] * 1000, 2) if delays else 0.0,
+                'avg_batch_time_ms': round(self.total_batch_time / self.batches * 1000, 2) if self.batches else 0.0,
+                'batch_size_histogram': dict(sorted(self.batch_size_histogram.items())),
+                'last_batch': dict(self.last_batch)
+            }
+
+
+# Queue group of stream jobs; batch requests are grouped by name
+STREAM = None
+
+
+class ModelQueue:
+    """
+    The fair queue and dispatcher of one model.
+
+    Every request for the model waits in one weighted fair queue (see
+    admission_control), batched or streamed, so the depth limit and each user's
+    share apply per model. Whenever one of the model's ``workers`` is free the
+    dispatcher takes the next request in fair order:
+
+    * A batch request starts a batch of its group (task and options, which fix the
+      generate() kwargs). Requests of the same group join it until
+      ``max_batch_size`` are gathered or ``max_queue_delay_ms`` has passed; other
+      requests met meanwhile are kept, in order, and go next. The batch runs
+      ``batch_fn(items, should_stop)`` once, on ``submit_fn`` (e.g. the model's
+      dedicated executor) when given. ``should_stop`` turns true once every caller
+      in the batch has gone away.
+    * A stream job runs on its own and holds its worker until the stream ends.
+
+    While the workers are busy new arrivals keep queueing, so the next batch
+    grows with the load.
+    """
+
+    def __init__(self, model_name: str, submit_fn: Optional[Callable[..., concurrent.futures.Future]] = None,
+                 workers: int = 1, max_batch_size: int = BATCH_MAX_SIZE,
+                 max_queue_delay_ms: float = BATCH_MAX_DELAY_MS, max_queue_depth: int = MODEL_QUEUE_MAX_DEPTH,
+                 max_per_user: int = FAIR_QUEUE_MAX_PER_USER):
+        self.model_name = model_name
+        self.submit_fn = submit_fn
+        self.workers = max(1, workers)
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_queue_delay = max(0.0, max_queue_delay_ms) / 1000.0
+        self.max_queue_depth = max_queue_depth
+        self.max_per_user = max_per_user
+        # Group name -> batch_fn, and its metrics
+        self.batch_fns: Dict[str, Callable[..., List[Any]]] = {}
+        self.metrics: Dict[str, BatchMetrics] = {}
+        self.streams_started = 0
+        self._queue: Optional[FairQueue] = None
+        # Requests taken off the queue while collecting another group's batch
+        self._carried: deque = deque()
+        self._free: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    def add_group(self, name: str, batch_fn: Callable[..., List[Any]]) -> None:
+        if name not in self.batch_fns:
+            self.batch_fns[name] = batch_fn
+            self.metrics[name] = BatchMetrics()
+
+    def _ensure_worker(self) -> None:
+        if self._worker is None or self._worker.done():
+            self._loop = asyncio.get_running_loop()
+            self._queue = self._queue or FairQueue(self.max_queue_depth, self.max_per_user)
+            self._free = asyncio.Semaphore(self.workers)
+            self._worker = self._loop.create_task(self._run())
+
+    def _submit(self, fn, *args) -> asyncio.Future:
+        if self.submit_fn is None:
+            return self._loop.run_in_executor(None, fn, *args)
+        return asyncio.wrap_future(self.submit_fn(fn, *args))
+
+    def estimated_wait(self) -> float:
+        """Rough seconds until a request queued now would start (used for Retry-After)."""
+        batches = sum(metrics.batches for metrics in self.metrics.values())
+        batch_time = sum(metrics.total_batch_time for metrics in self.metrics.values())
+        batches_ahead = self.queue_size() // self.max_batch_size + 1
+        return max(1.0, batches_ahead * (batch_time / batches if batches else 0.0))
+
+    def check(self, key: str = "") -> None:
+        """Raise AdmissionRejected if a request from key would be refused right now."""
+        if self._queue is not None:
+            self._queue.check(key, self.estimated_wait())
+
+    async def submit(self, group: str, item: Any, key: str = "", weight: float = 1.0) -> Any:
+        """
+        Queue one batch request of group on behalf of key (a user) and wait for its result.
+
+        Raises AdmissionRejected when the queue, or key's share of it, is full.
+        """
+        self._ensure_worker()
+        future = self._loop.create_future()
+        entry = self._queue.put_nowait((group, item, future, time.perf_counter()), key, weight, self.estimated_wait())
+        # A caller that disconnects or times out cancels its future; free its place in the queue
+        future.add_done_callback(lambda f: f.cancelled() and self._queue.discard(entry))
+        return await future
+
+    def submit_stream(self, loop: asyncio.AbstractEventLoop, fn: Callable[[], Any], key: str = "",
+                      weight: float = 1.0) -> concurrent.futures.Future:
+        """
+        Queue a stream job from a worker thread; fn runs once it is key's turn.
+
+        Cancelling the returned future before the job starts takes it off the queue.
+        Raises AdmissionRejected when the queue, or key's share of it, is full.
+        """
+        done = concurrent.futures.Future()
+
+        async def _put():
+            self._ensure_worker()
+            entry = self._queue.put_nowait((STREAM, fn, done, time.perf_counter()), key, weight, self.estimated_wait())
+            # Cancel may come from any thread; the queue is only touched on the loop
+            done.add_done_callback(lambda f: f.cancelled() and loop.call_soon_threadsafe(self._queue.discard, entry))
+        asyncio.run_coroutine_threadsafe(_put(), loop).result()
+        return done
+
+    def queue_size(self) -> int:
+        return (self._queue.qsize() if self._queue else 0) + len(self._carried)
+
+    def queue_stats(self) -> Dict[str, Any]:
+        if self._queue is None:
+            stats = {'queue_size': 0, 'max_depth': self.max_queue_depth, 'waiting_users': 0,
+                     'rejected_full': 0, 'rejected_user_full': 0, 'discarded': 0}
+        else:
+            stats = self._queue.stats()
+        return {**stats, 'queue_size': self.queue_size(), 'workers': self.workers, 'streams_started': self.streams_started}
+
+    async def _next(self) -> Tuple[Any, ...]:
+        if self._carried:
+            return self._carried.popleft()
+        return await self._queue.get()
+
+    async def _collect(self, first: Tuple[Any, ...]) -> List[Tuple[Any, ...]]:
+        group = first[0]
+        batch = [first]
+        for entry in [entry for entry in self._carried if entry[0] == group][:self.max_batch_size - 1]:
+            self._carried.remove(entry)
+            batch.append(entry)
+        deadline = time.perf_counter() + self.max_queue_delay
+        while len(batch) < self.max_batch_size and len(self._carried) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                # Still take whatever is already waiting
+                if self._queue.empty():
+                    break
+                entry = self._queue.get_nowait()
+            else:
+                try:
+                    entry = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            (batch if entry[0] == group else self._carried).append(entry)
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            await self._free.acquire()
+            started = False
+            try:
+                entry = await self._next()
+                if entry[0] is STREAM:
+                    started = self._start_stream(entry)
+                else:
+                    # Drop callers that went away while queued
+                    batch = [e for e in await self._collect(entry) if not e[2].done()]
+                    if batch:
+                        self._loop.create_task(self._run_batch(entry[0], batch))
+                        started = True
+            finally:
+                if not started:
+                    self._free.release()
+
+    def _start_stream(self, entry: Tuple[Any, ...]) -> bool:
+        _, fn, done, _ = entry
+        # False when the stream was withdrawn after it was taken off the queue
+        if not done.set_running_or_notify_cancel():
+            return False
+        job = self._submit(fn)
+        self.streams_started += 1
+
+        def _finished(job):
+            # The worker is free again once the stream's decoding job returns
+            self._free.release()
+            if job.cancelled():
+                done.set_exception(concurrent.futures.CancelledError())
+            elif job.exception() is not None:
+                done.set_exception(job.exception())
+            else:
+                done.set_result(job.result())
+        job.add_done_callback(_finished)
+        return True
+
+    async def _run_batch(self, group: str, batch: List[Tuple[Any, ...]]) -> None:
+        try:
+            items = [entry[1] for entry in batch]
+            futures = [entry[2] for entry in batch]
+            started = time.perf_counter()
+            queue_delays = [started - entry[3] for entry in batch]
+            # Callers cancel their future on disconnect or timeout
+            should_stop = lambda: all(future.done() for future in futures)
+            try:
+                results = await self._submit(self.batch_fns[group], items, should_stop)
+                failed = False
+            except Exception as e:
+                logger.error(f"Batch on {group} failed: {e}")
+                results = [e] * len(items)
+                failed = True
+            self.metrics[group].record(len(items), queue_delays, time.perf_counter() - started, failed)
+
+            for future, result in zip(futures, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        finally:
+            self._free.release()
+
+    async def close(self) -> None:
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+
+class SchedulerRegistry:
+    """
+    Lazily creates one ModelQueue per model, with a batch group per (task, options).
+
+    Options (e.g. deterministic decoding) change the generate() kwargs, so requests
+    with different options are never mixed in one batch, but they share their
+    model's queue. With ``executors`` every batch and stream runs on its model's
+    dedicated executor, one per executor worker at a time.
+    """
+
+    def __init__(self, batch_fns: Dict[str, Callable[..., List[Any]]],
+                 max_batch_size: int = BATCH_MAX_SIZE, max_queue_delay_ms: float = BATCH_MAX_DELAY_MS,
+                 max_queue_depth: int = MODEL_QUEUE_MAX_DEPTH, max_per_user: int = FAIR_QUEUE_MAX_PER_USER,
+                 executors=None):
+        self.batch_fns = batch_fns
+        self.executors = executors
+        self.max_batch_size = max_batch_size
+        self.max_queue_delay_ms = max_queue_delay_ms
+        self.max_queue_depth = max_queue_depth
+        self.max_per_user = max_per_user
+        self._queues: Dict[str, ModelQueue] = {}
+
+    def queue(self, model_name: str) -> ModelQueue:
+        if model_name not in self._queues:
+            self._queues[model_name] = ModelQueue(
+                model_name,
+                functools.partial(self.executors.submit, model_name) if self.executors is not None else None,
+                self.executors.workers_per_model if self.executors is not None else 1,
+                self.max_batch_size,
+                self.max_queue_delay_ms,
+                self.max_queue_depth,
+                self.max_per_user
+            )
+        return self._queues[model_name]
+
+    def get(self, task: str, model_name: str, **options) -> Tuple[ModelQueue, str]:
+        """The model's queue and the batch group name for task with options."""
+        name = ":".join([task, model_name] + [f"{k}={v}" for k, v in sorted(options.items())])
+        model_queue = self.queue(model_name)
+        batch_fn = self.batch_fns[task]
+        model_queue.add_group(
+            name, lambda items, should_stop=None: batch_fn(items, model_name, should_stop=should_stop, **options))
+        return model_queue, name
+
+    async def submit(self, task: str, model_name: str, item: Any, user_key: str = "",
+                     weight: float = 1.0, **options) -> Any:
+        model_queue, group = self.get(task, model_name, **options)
+        return await model_queue.submit(group, item, user_key, weight)
+
+    def stream_submitter(self, model_name: str, user_key: str = "", weight: float = 1.0) -> Callable[..., concurrent.futures.Future]:
+        """
+        A submit function for stream_generate that queues the stream's decoding job
+        in model_name's fair queue. Create it on the event loop; call it from a thread.
+        """
+        model_queue = self.queue(model_name)
+        model_queue.check(user_key)
+        loop = asyncio.get_running_loop()
+        return lambda fn: model_queue.submit_stream(loop, fn, user_key, weight)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            'config': {
+                'max_batch_size': self.max_batch_size,
+                'max_queue_delay_ms': self.max_queue_delay_ms,
+                'max_queue_depth': self.max_queue_depth,
+                'max_per_user': self.max_per_user
+            },
+            'queues': {name: model_queue.queue_stats() for name, model_queue in self._queues.items()},
+            'schedulers': {
+                group: metrics.snapshot()
+                for model_queue in self._queues.values() for group, metrics in model_queue.metrics.items()
+            }
+        }
+
+    async def close(self) -> None:
+        for model_queue in self._queues.values():
+            await model_queue.close()
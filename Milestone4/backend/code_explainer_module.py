@@ -1,58 +1,83 @@
-import torch
 import logging
+from typing import Callable, Iterator, List, Optional, Tuple
 from .model_loader import get_model
+from .generation_utils import GenerationCancelled, generate_batch, stream_generate, clean_model_output, decoding_params
+from .prefix_cache import template_prefix
+from .speculative_decoding import get_draft
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def explain_code(code: str, style: str, model_name: str = "deepseek") -> str:
+# Decoding parameters used for explanations
+EXPLANATION_PARAMS = {
+    'max_new_tokens': 250,
+    'do_sample': True,
+    'temperature': 0.7
+}
+
+def format_explanation_prompt(tokenizer, code: str, style: str, model_name: str) -> str:
+    """Build the model-specific prompt for a code explanation request."""
+    prompt_content = f"Explain this {style} code:\n\n{code}"
+
+    if model_name in ('gemma', 'deepseek'):
+        messages = [{"role": "user", "content": prompt_content}]
+        return tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    elif model_name == 'phi-2':
+        return f"Instruct: {prompt_content}\nOutput:"
+    return prompt_content
+
+def explain_code_batch(requests: List[Tuple[str, str]], model_name: str = "deepseek", deterministic: bool = False,
+                       should_stop: Optional[Callable[[], bool]] = None, speculative: bool = False) -> List[str]:
     """
-    Explain code using the specified model and style.
+    Explain several (code, style) requests with a single model.generate() call.
     """
     model, tokenizer = get_model(model_name)
     if not model or not tokenizer:
-        return "Error: Model not loaded."
+        return ["Error: Model not loaded."] * len(requests)
 
     try:
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        
-        prompt_content = f"Explain this {style} code:\n\n{code}"
-        
-        if model_name == 'gemma':
-            messages = [{"role": "user", "content": prompt_content}]
-            formatted_prompt = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-        elif model_name == 'deepseek':
-            messages = [{"role": "user", "content": prompt_content}]
-            formatted_prompt = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-        elif model_name == 'phi-2':
-            formatted_prompt = f"Instruct: {prompt_content}\nOutput:"
-        else:
-            formatted_prompt = prompt_content
-
-        inputs = tokenizer(formatted_prompt, return_tensors="pt").to(device)
-
-        with torch.no_grad():
-            outputs = model.generate(
-                **inputs, 
-                max_new_tokens=250, 
-                temperature=0.7, 
-                do_sample=True, 
-                pad_token_id=tokenizer.eos_token_id
-            )
-
-        text = tokenizer.decode(outputs[0][inputs.input_ids.shape[1]:], skip_special_tokens=True)
-        
-        # Post-processing
-        if model_name == 'gemma':
-            if "<start_of_turn>model" in text:
-                text = text.split("<start_of_turn>model")[-1].strip()
-        elif model_name == 'phi-2':
-             if "Output:" in text:
-                text = text.split("Output:")[-1].strip()
-                
-        return text.strip()
+        prompts = [format_explanation_prompt(tokenizer, code, style, model_name) for code, style in requests]
+        draft = get_draft(model_name) if speculative else None
+        # Prefix key/values are only reused for unpadded, single-prompt calls
+        prefix = template_prefix(format_explanation_prompt, tokenizer, model_name, requests[0][1]) if len(requests) == 1 and not draft else None
+        texts = generate_batch(model, tokenizer, prompts, should_stop, prefix, draft,
+                               **decoding_params(EXPLANATION_PARAMS, deterministic or speculative))
+        return [clean_model_output(text, model_name) for text in texts]
 
     except Exception as e:
         logger.error(f"Error explaining code: {e}")
-        return f"Error: {str(e)}"
+        return [f"Error: {str(e)}"] * len(requests)
+
+def explain_code(code: str, style: str, model_name: str = "deepseek", deterministic: bool = False,
+                 speculative: bool = False) -> str:
+    """
+    Explain code using the specified model and style.
+    With speculative=True a draft model proposes tokens (greedy decoding).
+    """
+    return explain_code_batch([(code, style)], model_name, deterministic, speculative=speculative)[0]
+
+def stream_explain_code(code: str, style: str, model_name: str = "deepseek", deterministic: bool = False,
+                        submit: Optional[Callable] = None, should_stop: Optional[Callable[[], bool]] = None,
+                        timeout: Optional[float] = None, speculative: bool = False) -> Iterator[str]:
+    """
+    Stream an explanation chunk by chunk as the model decodes it.
+    """
+    model, tokenizer = get_model(model_name)
+    if not model or not tokenizer:
+        # Raised, not yielded: a stream must not pass an error off as output
+        raise RuntimeError("Model not loaded.")
+
+    try:
+        formatted_prompt = format_explanation_prompt(tokenizer, code, style, model_name)
+        draft = get_draft(model_name) if speculative else None
+        prefix = template_prefix(format_explanation_prompt, tokenizer, model_name, style) if not draft else None
+        yield from stream_generate(model, tokenizer, formatted_prompt, submit, should_stop, timeout, prefix, draft,
+                                   **decoding_params(EXPLANATION_PARAMS, deterministic or speculative))
+
+    except GenerationCancelled:
+        raise
+
+    except Exception as e:
+        logger.error(f"Error streaming explanation: {e}")
+        raise
@@ -1,59 +1,84 @@
-import torch
 import logging
+from typing import Callable, Iterator, List, Optional, Tuple
 from .model_loader import get_model
+from .generation_utils import GenerationCancelled, generate_batch, stream_generate, clean_model_output, decoding_params
+from .prefix_cache import template_prefix
+from .speculative_decoding import get_draft
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def generate_code(prompt: str, language: str, model_name: str = "gemma") -> str:
+# Decoding parameters used for code generation
+GENERATION_PARAMS = {
+    'max_new_tokens': 300,
+    'do_sample': True,
+    'temperature': 0.2
+}
+
+def format_generation_prompt(tokenizer, prompt: str, language: str, model_name: str) -> str:
+    """Build the model-specific prompt for a code generation request."""
+    if model_name == 'gemma':
+        messages = [{"role": "user", "content": f"Write {language} code for:\n{prompt}"}]
+        return tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    elif model_name == 'deepseek':
+        messages = [{"role": "user", "content": f"You are an expert coding assistant. Write {language} code for: {prompt}"}]
+        return tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+    elif model_name == 'phi-2':
+        return f"Instruct: Write {language} code for {prompt}\nOutput:"
+    return f"Generate {language} code: {prompt}"
+
+def generate_code_batch(requests: List[Tuple[str, str]], model_name: str = "gemma", deterministic: bool = False,
+                        should_stop: Optional[Callable[[], bool]] = None, speculative: bool = False) -> List[str]:
     """
-    Generate code using the specified model.
+    Generate code for several (prompt, language) requests with a single model.generate() call.
     """
     model, tokenizer = get_model(model_name)
     if not model or not tokenizer:
-        return "Error: Model not loaded. Please check logs."
+        return ["Error: Model not loaded. Please check logs."] * len(requests)
 
     try:
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        
-        if model_name == 'gemma':
-            messages = [{"role": "user", "content": f"Write {language} code for:\n{prompt}"}]
-            formatted_prompt = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-        elif model_name == 'deepseek':
-            messages = [{"role": "user", "content": f"You are an expert coding assistant. Write {language} code for: {prompt}"}]
-            formatted_prompt = tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-        elif model_name == 'phi-2':
-            formatted_prompt = f"Instruct: Write {language} code for {prompt}\nOutput:"
-        else:
-            formatted_prompt = f"Generate {language} code: {prompt}"
-
-        inputs = tokenizer(formatted_prompt, return_tensors="pt").to(device)
-
-        with torch.no_grad():
-            outputs = model.generate(
-                **inputs, 
-                max_new_tokens=300, 
-                do_sample=True, 
-                temperature=0.2,
-                pad_token_id=tokenizer.eos_token_id
-            )
-
-        text = tokenizer.decode(outputs[0][inputs.input_ids.shape[1]:], skip_special_tokens=True)
-        
-        # Post-processing to clean up the output
-        if model_name == 'gemma':
-            # Gemma chat template output usually contains the prompt, we might want to strip it if needed
-            # But apply_chat_template usually handles it. 
-            # Sometimes we need to split by <start_of_turn>model
-            if "<start_of_turn>model" in text:
-                text = text.split("<start_of_turn>model")[-1].strip()
-        elif model_name == 'phi-2':
-             if "Output:" in text:
-                text = text.split("Output:")[-1].strip()
-
-        return text.strip()
+        prompts = [format_generation_prompt(tokenizer, prompt, language, model_name) for prompt, language in requests]
+        draft = get_draft(model_name) if speculative else None
+        # Prefix key/values are only reused for unpadded, single-prompt calls
+        prefix = template_prefix(format_generation_prompt, tokenizer, model_name, requests[0][1]) if len(requests) == 1 and not draft else None
+        texts = generate_batch(model, tokenizer, prompts, should_stop, prefix, draft,
+                               **decoding_params(GENERATION_PARAMS, deterministic or speculative))
+        return [clean_model_output(text, model_name) for text in texts]
 
     except Exception as e:
         logger.error(f"Error generating code: {e}")
-        return f"Error: {str(e)}"
+        return [f"Error: {str(e)}"] * len(requests)
+
+def generate_code(prompt: str, language: str, model_name: str = "gemma", deterministic: bool = False,
+                  speculative: bool = False) -> str:
+    """
+    Generate code using the specified model.
+    With speculative=True a draft model proposes tokens (greedy decoding).
+    """
+    return generate_code_batch([(prompt, language)], model_name, deterministic, speculative=speculative)[0]
+
+def stream_generate_code(prompt: str, language: str, model_name: str = "gemma", deterministic: bool = False,
+                         submit: Optional[Callable] = None, should_stop: Optional[Callable[[], bool]] = None,
+                         timeout: Optional[float] = None, speculative: bool = False) -> Iterator[str]:
+    """
+    Stream generated code chunk by chunk as the model decodes it.
+    """
+    model, tokenizer = get_model(model_name)
+    if not model or not tokenizer:
+        # Raised, not yielded: a stream must not pass an error off as output
+        raise RuntimeError("Model not loaded. Please check logs.")
+
+    try:
+        formatted_prompt = format_generation_prompt(tokenizer, prompt, language, model_name)
+        draft = get_draft(model_name) if speculative else None
+        prefix = template_prefix(format_generation_prompt, tokenizer, model_name, language) if not draft else None
+        yield from stream_generate(model, tokenizer, formatted_prompt, submit, should_stop, timeout, prefix, draft,
+                                   **decoding_params(GENERATION_PARAMS, deterministic or speculative))
+
+    except GenerationCancelled:
+        raise
+
+    except Exception as e:
+        logger.error(f"Error streaming code: {e}")
+        raise
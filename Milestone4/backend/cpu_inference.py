@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""CPU Inference Module
+
+Loads models for CPU-only hosts in a reduced precision and fixes the number
+of threads used for inference.
+
+CPU_INFERENCE_DTYPE selects the precision:
+* int8: fp32 weights with every Linear layer except the output head dynamically
+  quantized to int8. Activations are quantized on the fly per batch. The quantized
+  model is saved under QUANTIZED_MODEL_DIR, so later starts load it instead of
+  quantizing again.
+* bf16: weights loaded directly in bfloat16. This only pays off on CPUs with
+  native bf16 instructions (AVX512-BF16/AMX); elsewhere it is emulated and
+  slow. There is nothing to cache since the checkpoints are already stored in
+  16 bit.
+* fp32: the previous full-precision path.
+* auto (default): bf16 when the CPU supports it natively, int8 otherwise.
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+import warnings
+from typing import Callable
+
+import torch
+import transformers
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# CPU inference knobs (Load from env in production)
+CPU_INFERENCE_DTYPE = os.environ.get("CPU_INFERENCE_DTYPE", "auto").lower()
+# Intra-op threads for inference (0 = torch's default, one per core)
+CPU_INFERENCE_THREADS = int(os.environ.get("CPU_INFERENCE_THREADS", 0))
+# Where quantized models are kept between starts (empty disables the cache)
+QUANTIZED_MODEL_DIR = os.environ.get("QUANTIZED_MODEL_DIR", os.path.expanduser("~/.cache/codegenie/quantized"))
+
+CPU_DTYPES = ('auto', 'int8', 'bf16', 'fp32')
+
+_threads_lock = threading.Lock()
+_threads_configured = False
+
+
+def configure_cpu_threads(threads: int = 0) -> int:
+    """
+    Set torch's intra-op thread count and return it.
+
+    An explicit ``threads`` always applies (serve.py sets one per worker);
+    otherwise CPU_INFERENCE_THREADS is applied the first time only.
+    """
+    global _threads_configured
+    with _threads_lock:
+        if threads > 0 or not _threads_configured:
+            threads = threads or CPU_INFERENCE_THREADS
+            if threads > 0:
+                torch.set_num_threads(threads)
+            _threads_configured = True
+        return torch.get_num_threads()
+
+
+def bf16_supported() -> bool:
+    """Whether the CPU has native bfloat16 matrix instructions."""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except Exception:
+        return False
+
+
+def _quantize_dynamic():
+    try:
+        from torch.ao.quantization import quantize_dynamic
+        return quantize_dynamic
+    except ImportError:
+        return None
+
+
+def resolve_cpu_dtype(requested: str = CPU_INFERENCE_DTYPE) -> str:
+    """Map CPU_INFERENCE_DTYPE to the precision actually used on this host."""
+    if requested not in CPU_DTYPES:
+        logger.warning(f"Unknown CPU_INFERENCE_DTYPE {requested!r}; using fp32")
+        return 'fp32'
+    if requested == 'auto':
+        requested = 'bf16' if bf16_supported() else 'int8'
+    if requested == 'int8' and _quantize_dynamic() is None:
+        logger.warning("Dynamic int8 quantization is not available in this torch build; using fp32")
+        return 'fp32'
+    return requested
+
+
+def quantize_int8(model):
+    """Dynamically quantize every Linear layer of ``model`` except its output head."""
+    quantize_dynamic = _quantize_dynamic()
+    head = model.get_output_embeddings()
+    # The output head stays fp32: it is tied to the embeddings in some models and
+    # its logits decide every token
+    layers = {name for name, module in model.named_modules()
+              if isinstance(module, torch.nn.Linear) and module is not head}
+    with warnings.catch_warnings():
+        # torch.ao.quantization is deprecated in favour of torchao, which is not a dependency
+        warnings.simplefilter("ignore")
+        return quantize_dynamic(model, layers, dtype=torch.qint8)
+
+
+def _is_quantized_linear(module) -> bool:
+    # Quantized Linear layers expose their weight through a method, not a Parameter
+    return hasattr(module, '_packed_params') and callable(getattr(module, 'weight', None))
+
+
+def quantized_weight_bytes(model) -> int:
+    """Bytes of packed int8 weights, which model.parameters() does not include."""
+    total = 0
+    for module in model.modules():
+        if _is_quantized_linear(module):
+            weight = module.weight()
+            total += weight.numel() * weight.element_size()
+    return total
+
+
+def model_precision(model) -> str:
+    """Describe the precision a loaded model runs in, e.g. 'int8' or 'bfloat16'."""
+    if any(_is_quantized_linear(module) for module in model.modules()):
+        return 'int8'
+    parameter = next(model.parameters(), None)
+    return str(parameter.dtype).replace('torch.', '') if parameter is not None else 'unknown'
+
+
+def _artifact_path(model_id: str) -> str:
+    # Pickled modules are only valid for the library versions that wrote them
+    safe_id = re.sub(r'[^A-Za-z0-9_.-]+', '--', model_id.strip('/'))
+    return os.path.join(QUANTIZED_MODEL_DIR, f"{safe_id}-int8-torch{torch.__version__}-transformers{transformers.__version__}.pt")
+
+
+def _load_int8(model_id: str, load_fn: Callable[[torch.dtype], torch.nn.Module]):
+    path = _artifact_path(model_id) if QUANTIZED_MODEL_DIR else None
+    if path and os.path.exists(path):
+        start = time.perf_counter()
+        try:
+            # The file was written by _load_int8 below, into our own cache directory
+            model = torch.load(path, map_location="cpu", weights_only=False)
+            logger.info(f"Loaded int8 {model_id} from {path} in {time.perf_counter() - start:.1f}s")
+            return model.eval()
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable quantized model {path}: {e}")
+
+    model = load_fn(torch.float32)
+    start = time.perf_counter()
+    model = quantize_int8(model).eval()
+    logger.info(f"Quantized {model_id} to int8 in {time.perf_counter() - start:.1f}s")
+    if path:
+        try:
+            os.makedirs(QUANTIZED_MODEL_DIR, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            torch.save(model, tmp_path)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Could not cache quantized {model_id}: {e}")
+    return model
+
+
+def load_cpu_model(model_id: str, load_fn: Callable[[torch.dtype], torch.nn.Module]):
+    """
+    Load ``model_id`` for CPU inference in the configured precision.
+
+    Args:
+        model_id: Hugging Face id, used to name the cached artifact.
+        load_fn: Loads the checkpoint in the given torch dtype (from_pretrained).
+    """
+    threads = configure_cpu_threads()
+    precision = resolve_cpu_dtype()
+    logger.info(f"Loading {model_id} for CPU in {precision} with {threads} threads")
+    if precision == 'int8':
+        return _load_int8(model_id, load_fn)
+    return load_fn(torch.bfloat16 if precision == 'bf16' else torch.float32)
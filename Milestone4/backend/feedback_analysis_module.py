@@ -9,15 +9,15 @@ import io
 import random
 import string
 import hashlib
+from typing import Optional
+
+from .storage import open_blob_store
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-CURRENT_FILE_DIR = os.path.dirname(os.path.abspath(__file__))
-PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_FILE_DIR, '..'))
-STREAMLIT_APP_DIR = os.path.join(PROJECT_ROOT, 'streamlit_app')
-AVATARS_DIR = os.path.join(STREAMLIT_APP_DIR, 'avatars')
+AVATARS_STORE_NAME = 'avatars'
 
 analyzer = SentimentIntensityAnalyzer()
 
@@ -71,10 +71,7 @@ def generate_avatar_image(username: str, email: str = None, size: int = 150) ->
 def save_user_avatar(user_id: str, image_bytes: bytes) -> bool:
     """Save user uploaded avatar."""
     try:
-        os.makedirs(AVATARS_DIR, exist_ok=True)
-        path = os.path.join(AVATARS_DIR, f"{user_id}.png")
-        with open(path, "wb") as f:
-            f.write(image_bytes)
+        open_blob_store(AVATARS_STORE_NAME, suffix='.png').put(user_id, image_bytes)
         return True
     except Exception as e:
         logger.error(f"Failed to save avatar: {e}")
@@ -82,10 +79,10 @@ def save_user_avatar(user_id: str, image_bytes: bytes) -> bool:
 
 def load_user_avatar(user_id: str) -> Optional[Image.Image]:
     """Load user avatar."""
-    path = os.path.join(AVATARS_DIR, f"{user_id}.png")
-    if os.path.exists(path):
+    data = open_blob_store(AVATARS_STORE_NAME, suffix='.png').get(user_id)
+    if data:
         try:
-            return Image.open(path)
+            return Image.open(io.BytesIO(data))
         except:
             pass
     return None
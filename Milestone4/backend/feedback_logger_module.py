@@ -7,28 +7,42 @@ Original file is located at
     https://colab.research.google.com/drive/1u30J_7VeB3qGtlQUiNRcCW-jNnl5JHBo
 """
 
-import json
-import os
 import logging
-import threading
 from datetime import datetime
-from typing import Optional
+from typing import Any, Dict, Iterator, Optional
+
+from .storage import EventLog, open_event_log
+from .write_behind import log_event
+from .pagination import page_event_log
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Resolve to the project's streamlit_app folder so logs are stored in the same place the UI reads from.
-CURRENT_FILE_DIR = os.path.dirname(os.path.abspath(__file__))
-PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_FILE_DIR, '..'))
-STREAMLIT_APP_DIR = os.path.join(PROJECT_ROOT, 'streamlit_app')
-FEEDBACK_FILE = os.path.join(STREAMLIT_APP_DIR, 'feedback_log.json')
-# Use a lock to prevent race conditions when writing to the JSON file
-file_lock = threading.Lock()
+FEEDBACK_LOG_NAME = 'feedback_log'
+
+def get_feedback_log() -> EventLog:
+    """Return the append-only feedback log."""
+    return open_event_log(FEEDBACK_LOG_NAME)
+
+def iter_feedback(reverse: bool = False) -> Iterator[Dict[str, Any]]:
+    """Stream feedback entries oldest first (or newest first)."""
+    try:
+        yield from get_feedback_log().iter_entries(reverse=reverse)
+    except Exception as e:
+        logger.error(f"Failed to read feedback: {e}")
+
+def list_feedback(limit: int = 50, cursor: Optional[str] = None, newest_first: bool = True) -> Dict[str, Any]:
+    """One page of feedback as {'items', 'next_cursor'}."""
+    try:
+        return page_event_log(get_feedback_log(), limit=limit, cursor=cursor, newest_first=newest_first)
+    except Exception as e:
+        logger.error(f"Failed to list feedback: {e}")
+        return {'items': [], 'next_cursor': None, 'error': str(e)}
 
 def log_feedback(user_id: str, query: str, rating: int, comments: str) -> None:
     """
-    Saves user feedback to a local JSON file and logs it to user activity.
+    Appends user feedback to the feedback log and logs it to user activity.
 
     Args:
         user_id: A unique identifier for the user.
@@ -44,49 +58,25 @@ def log_feedback(user_id: str, query: str, rating: int, comments: str) -> None:
         'comments': comments
     }
 
-    with file_lock:
-        try:
-            # Try to read existing data
-            if os.path.exists(FEEDBACK_FILE):
-                with open(FEEDBACK_FILE, 'r', encoding='utf-8') as f:
-                    try:
-                        data = json.load(f)
-                        if not isinstance(data, list):
-                            data = []
-                    except json.JSONDecodeError:
-                        data = []
-            else:
-                data = []
-
-            # Append new entry
-            data.append(feedback_entry)
-
-            # Ensure directory exists and write data back
-            os.makedirs(os.path.dirname(FEEDBACK_FILE), exist_ok=True)
-            with open(FEEDBACK_FILE, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=4)
-            logger.info(f"Successfully logged feedback for user {user_id}")
-            
-            # Also log to user activity if the module is available
-            try:
-                import sys
-                import os as os_module
-                backend_dir = os_module.path.abspath(os_module.path.join(os_module.path.dirname(__file__), '..'))
-                if backend_dir not in sys.path:
-                    sys.path.append(backend_dir)
-                
-                from backend.user_management_module import log_user_activity
-                log_user_activity(
-                    user_id=user_id,
-                    activity_type='feedback',
-                    query=query,
-                    rating=rating,
-                    comments=comments
-                )
-            except Exception as e:
-                logger.warning(f"Could not log to user activity: {e}")
+    try:
+        log_event(FEEDBACK_LOG_NAME, feedback_entry)
+        logger.info(f"Queued feedback for user {user_id}")
+    except (IOError, OSError) as e:
+        logger.error(f"Failed to write feedback to {get_feedback_log().base_path}: {e}")
+        return
+    except Exception as e:
+        logger.error(f"An unexpected error occurred in log_feedback: {e}")
+        return
 
-        except (IOError, OSError) as e:
-            logger.error(f"Failed to write feedback to {FEEDBACK_FILE}: {e}")
-        except Exception as e:
-            logger.error(f"An unexpected error occurred in log_feedback: {e}")
+    # Also log to user activity if the module is available
+    try:
+        from .user_management_module import log_user_activity
+        log_user_activity(
+            user_id=user_id,
+            activity_type='feedback',
+            query=query,
+            rating=rating,
+            comments=comments
+        )
+    except Exception as e:
+        logger.warning(f"Could not log to user activity: {e}")
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+"""Generation Utilities Module
+
+Shared helpers for running (batched) text generation with the loaded models.
+"""
+
+import queue
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import torch
+from transformers import StoppingCriteria, StoppingCriteriaList, TextIteratorStreamer
+
+from .prefix_cache import get_prefix_cache
+from .speculative_decoding import assisted_generate
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class GenerationCancelled(Exception):
+    """Raised by stream_generate when decoding was stopped (client gone or timed out)."""
+
+
+class GenerationFailed(Exception):
+    """Raised by stream_generate when model.generate failed before the stream finished."""
+
+
+class StopOnSignal(StoppingCriteria):
+    """Stops ``model.generate`` as soon as ``should_stop()`` returns True."""
+
+    def __init__(self, should_stop: Callable[[], bool]):
+        self.should_stop = should_stop
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), bool(self.should_stop()), dtype=torch.bool, device=input_ids.device)
+
+
+def _stopping_kwargs(should_stop: Optional[Callable[[], bool]]) -> Dict[str, Any]:
+    return {'stopping_criteria': StoppingCriteriaList([StopOnSignal(should_stop)])} if should_stop else {}
+
+
+def get_device() -> str:
+    """Return the device inference runs on."""
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+def prepare_tokenizer_for_batching(tokenizer) -> None:
+    """Configure a tokenizer so prompts of different lengths can be padded together."""
+    # Decoder-only models must be left padded so every row ends with its prompt
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+
+def decoding_params(base_params: Dict[str, Any], deterministic: bool = False) -> Dict[str, Any]:
+    """
+    Return the generate() kwargs for a request.
+
+    Deterministic requests use greedy decoding so the same input always yields the
+    same output, which makes the answer safe to cache.
+    """
+    params = dict(base_params)
+    if deterministic:
+        params['do_sample'] = False
+        params.pop('temperature', None)
+        params.pop('top_p', None)
+        params.pop('top_k', None)
+    return params
+
+
+def clean_model_output(text: str, model_name: str) -> str:
+    """Strip template leftovers from decoded model output."""
+    if model_name == 'gemma':
+        # Gemma chat template output sometimes repeats the turn marker
+        if "<start_of_turn>model" in text:
+            text = text.split("<start_of_turn>model")[-1].strip()
+    elif model_name == 'phi-2':
+        if "Output:" in text:
+            text = text.split("Output:")[-1].strip()
+    return text.strip()
+
+
+def _prefix_kwargs(model, tokenizer, prefix: Optional[str], input_ids: torch.Tensor) -> Dict[str, Any]:
+    past_key_values = get_prefix_cache().past_key_values(model, tokenizer, prefix, input_ids)
+    return {'past_key_values': past_key_values} if past_key_values is not None else {}
+
+
+def generate_batch(model, tokenizer, prompts: List[str], should_stop: Optional[Callable[[], bool]] = None,
+                   prefix: Optional[str] = None, draft: Optional[Dict[str, Any]] = None,
+                   **generate_kwargs) -> List[str]:
+    """
+    Run one padded ``model.generate()`` call for several formatted prompts.
+
+    Args:
+        model: The causal LM to generate with.
+        tokenizer: Tokenizer belonging to ``model``.
+        prompts: Fully formatted prompts, one per request.
+        should_stop: Optional callable polled after every decoding step; decoding ends when it returns True.
+        prefix: Fixed template text the prompts start with; its cached key/values are
+            reused for single-prompt calls (padded batches always prefill in full).
+        draft: Optional draft model from ``get_draft``; prompts are then decoded
+            one at a time with assisted generation.
+        **generate_kwargs: Decoding parameters passed to ``model.generate``.
+
+    Returns:
+        The decoded continuation for each prompt, in input order.
+    """
+    prepare_tokenizer_for_batching(tokenizer)
+    if draft is not None:
+        # Assisted generation only supports one sequence at a time
+        texts = []
+        for prompt in prompts:
+            inputs = tokenizer(prompt, return_tensors="pt").to(get_device())
+            with torch.no_grad():
+                output = assisted_generate(model, tokenizer, draft, inputs.input_ids,
+                                           attention_mask=inputs.attention_mask,
+                                           pad_token_id=tokenizer.pad_token_id,
+                                           **_stopping_kwargs(should_stop),
+                                           **generate_kwargs)
+            texts.append(tokenizer.decode(output[0][inputs.input_ids.shape[1]:], skip_special_tokens=True))
+        return texts
+
+    inputs = tokenizer(prompts, return_tensors="pt", padding=True).to(get_device())
+
+    with torch.no_grad():
+        outputs = model.generate(
+            **inputs,
+            pad_token_id=tokenizer.pad_token_id,
+            **_prefix_kwargs(model, tokenizer, prefix, inputs.input_ids),
+            **_stopping_kwargs(should_stop),
+            **generate_kwargs
+        )
+
+    # With left padding every prompt ends at the same column
+    prompt_len = inputs.input_ids.shape[1]
+    return [tokenizer.decode(output[prompt_len:], skip_special_tokens=True) for output in outputs]
+
+
+def stream_generate(model, tokenizer, prompt: str, submit: Optional[Callable[..., Any]] = None,
+                    should_stop: Optional[Callable[[], bool]] = None, timeout: Optional[float] = None,
+                    prefix: Optional[str] = None, draft: Optional[Dict[str, Any]] = None,
+                    **generate_kwargs) -> Iterator[str]:
+    """
+    Generate a continuation for one formatted prompt, yielding text as it is decoded.
+
+    ``model.generate`` runs on ``submit`` (an executor's submit, e.g. the model's
+    dedicated executor) and pushes decoded text into a TextIteratorStreamer, which
+    this generator drains. Decoding stops when ``should_stop()`` turns true or the
+    generator is closed. GenerationCancelled is raised when the stream was cut
+    short, and also if no text arrives for ``timeout`` seconds, and
+    GenerationFailed if decoding raised. ``prefix`` is
+    the prompt's fixed template text, whose cached key/values skip its prefill.
+    With ``draft`` the tokens are decoded by assisted generation instead.
+    """
+    prepare_tokenizer_for_batching(tokenizer)
+    inputs = tokenizer(prompt, return_tensors="pt").to(get_device())
+    streamer = TextIteratorStreamer(tokenizer, skip_prompt=True, skip_special_tokens=True, timeout=timeout)
+    closed = False
+    stop = (lambda: closed or should_stop()) if should_stop else (lambda: closed)
+    failures = []
+
+    def _run():
+        try:
+            if stop():
+                # Abandoned while waiting for a worker
+                streamer.end()
+                return
+            with torch.no_grad():
+                if draft is not None:
+                    assisted_generate(model, tokenizer, draft, inputs.input_ids,
+                                      attention_mask=inputs.attention_mask,
+                                      streamer=streamer,
+                                      pad_token_id=tokenizer.pad_token_id,
+                                      stopping_criteria=StoppingCriteriaList([StopOnSignal(stop)]),
+                                      **generate_kwargs)
+                else:
+                    model.generate(
+                        **inputs,
+                        streamer=streamer,
+                        pad_token_id=tokenizer.pad_token_id,
+                        **_prefix_kwargs(model, tokenizer, prefix, inputs.input_ids),
+                        stopping_criteria=StoppingCriteriaList([StopOnSignal(stop)]),
+                        **generate_kwargs
+                    )
+        except Exception as e:
+            logger.error(f"Streaming generation failed: {e}")
+            failures.append(e)
+            # Unblock the consumer
+            streamer.end()
+
+    if submit is not None:
+        submit(_run)
+    else:
+        threading.Thread(target=_run, daemon=True).start()
+    try:
+        for text in streamer:
+            if text:
+                yield text
+    except queue.Empty:
+        raise GenerationCancelled("Generation timed out")
+    finally:
+        # Also reached when the consumer closes the generator early
+        closed = True
+    if should_stop is not None and should_stop():
+        raise GenerationCancelled("Generation was stopped before it finished")
+    if failures:
+        raise GenerationFailed(f"Generation failed: {failures[0]}") from failures[0]
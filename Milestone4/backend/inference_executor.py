@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""Inference Executor Module
+
+Dedicated worker threads for model inference.
+
+Every model gets its own small thread pool, so a long decode on one model never
+holds up another model or the event loop's default executor. A StopSignal
+carries a request's deadline and cancellation flag into ``model.generate`` (see
+generation_utils.StopOnSignal), so abandoned or timed-out requests stop decoding
+instead of running to max_new_tokens.
+"""
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Inference knobs (Load from env in production)
+INFERENCE_WORKERS_PER_MODEL = int(os.environ.get("INFERENCE_WORKERS_PER_MODEL", 1))
+# Longest a request may wait and decode before it is abandoned (0 disables)
+INFERENCE_TIMEOUT_S = float(os.environ.get("INFERENCE_TIMEOUT_S", 120))
+STREAM_TIMEOUT_S = float(os.environ.get("STREAM_TIMEOUT_S", 300))
+
+
+class StopSignal:
+    """Cancellation flag plus optional deadline for one request."""
+
+    def __init__(self, timeout_s: float = 0):
+        self._event = threading.Event()
+        self.deadline = time.monotonic() + timeout_s if timeout_s > 0 else None
+
+    def set(self) -> None:
+        self._event.set()
+
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def remaining(self) -> Optional[float]:
+        return None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+
+    def __call__(self) -> bool:
+        """True once the request should stop."""
+        return self._event.is_set() or self.expired()
+
+
+class InferenceExecutors:
+    """One ThreadPoolExecutor per model name, created on first use."""
+
+    def __init__(self, workers_per_model: int = INFERENCE_WORKERS_PER_MODEL):
+        self.workers_per_model = max(1, workers_per_model)
+        self._executors: Dict[str, ThreadPoolExecutor] = {}
+        self._active: Dict[str, int] = {}
+        self._submitted: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_name: str) -> ThreadPoolExecutor:
+        with self._lock:
+            executor = self._executors.get(model_name)
+            if executor is None:
+                executor = self._executors[model_name] = ThreadPoolExecutor(
+                    max_workers=self.workers_per_model, thread_name_prefix=f"infer-{model_name}")
+            return executor
+
+    def submit(self, model_name: str, fn, *args, **kwargs):
+        """Run fn on model_name's executor, counting queued and running jobs."""
+        with self._lock:
+            self._submitted[model_name] = self._submitted.get(model_name, 0) + 1
+
+        def _tracked():
+            with self._lock:
+                self._active[model_name] = self._active.get(model_name, 0) + 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._active[model_name] -= 1
+                    self._submitted[model_name] -= 1
+
+        return self.get(model_name).submit(_tracked)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'workers_per_model': self.workers_per_model,
+                'models': {
+                    name: {'running': self._active.get(name, 0),
+                           'queued': self._submitted.get(name, 0) - self._active.get(name, 0)}
+                    for name in self._executors
+                }
+            }
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executors, self._executors = list(self._executors.values()), {}
+        for executor in executors:
+            executor.shutdown(wait=False)
+
+
+_executors: Optional[InferenceExecutors] = None
+_executors_lock = threading.Lock()
+
+
+def get_inference_executors() -> InferenceExecutors:
+    """Return the process-wide per-model executors."""
+    global _executors
+    if _executors is None:
+        with _executors_lock:
+            if _executors is None:
+                _executors = InferenceExecutors()
+    return _executors
@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+"""JSON Lines Store Module
+
+Append-only, segmented JSON Lines log used for history, feedback and activity.
+
+Each log is a series of segment files ``<name>.000001.jsonl``, ``<name>.000002.jsonl``...
+Appends go to the newest segment in O(1); fsyncs are batched; a segment is closed
+and a new one started once it passes ``segment_max_bytes``. Every entry has a stable
+position ``(segment, offset)`` that can be read back directly with ``read_at``.
+``rewrite`` renumbers the segments and bumps the log's generation, a counter kept
+in ``<name>.generation``; readers in other processes compare it to notice that
+their positions are stale.
+"""
+
+import os
+import re
+import json
+import glob
+import time
+import atexit
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Durability / rotation knobs (Load from env in production)
+LOG_SEGMENT_MAX_BYTES = int(os.environ.get("LOG_SEGMENT_MAX_BYTES", 64 * 1024 * 1024))
+LOG_FSYNC_EVERY = int(os.environ.get("LOG_FSYNC_EVERY", 32))
+LOG_FSYNC_INTERVAL_S = float(os.environ.get("LOG_FSYNC_INTERVAL_S", 1.0))
+
+# Block size used when scanning a segment backwards
+_REVERSE_BLOCK = 64 * 1024
+
+Position = Tuple[int, int]
+
+
+def _decode(line: bytes, path: str, offset: int) -> Optional[Dict[str, Any]]:
+    try:
+        return json.loads(line)
+    except (json.JSONDecodeError, UnicodeDecodeError):
+        # A torn final line after a crash; skip it rather than failing every reader
+        logger.warning(f"Skipping unreadable line at {path}:{offset}")
+        return None
+
+
+def _fsync_dir(path: str) -> None:
+    """Persist renames and deletions in a directory (not supported on every platform)."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def read_generation(path: str) -> int:
+    """Rewrite counter of the log at path (0 if it was never rewritten)."""
+    try:
+        with open(f"{path}.generation", 'r', encoding='utf-8') as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def bump_generation(path: str) -> int:
+    """Increment and persist the rewrite counter of the log at path."""
+    generation = read_generation(path) + 1
+    tmp_path = f"{path}.generation.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(str(generation))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, f"{path}.generation")
+    return generation
+
+
+class JsonlLog:
+    """Append-only JSON Lines log with segment rotation and batched fsync."""
+
+    def __init__(self, base_path: str, legacy_json_path: Optional[str] = None,
+                 segment_max_bytes: int = LOG_SEGMENT_MAX_BYTES,
+                 fsync_every: int = LOG_FSYNC_EVERY, fsync_interval_s: float = LOG_FSYNC_INTERVAL_S):
+        """
+        Args:
+            base_path: Path prefix for segment files, e.g. ``streamlit_app/user_history``.
+            legacy_json_path: A JSON-array file to import once if the log is empty.
+            segment_max_bytes: Rotate to a new segment after this many bytes.
+            fsync_every: fsync after this many unsynced appends.
+            fsync_interval_s: ...or once the oldest unsynced append is this old.
+        """
+        self.base_path = base_path
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync_every = max(1, fsync_every)
+        self.fsync_interval_s = fsync_interval_s
+        self.lock = threading.RLock()
+        self._file = None
+        self._segment = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        # Called with [(position, entry), ...] after every append; None after a rewrite
+        self._listeners: List[Callable[[Optional[List[Tuple[Position, Dict[str, Any]]]]], None]] = []
+
+        os.makedirs(os.path.dirname(base_path) or '.', exist_ok=True)
+        segments = self.segments()
+        self._segment = segments[-1] if segments else 1
+        if legacy_json_path and not segments:
+            migrate_json_array(legacy_json_path, self)
+
+    # --- Segment helpers ---
+
+    def _segment_path(self, segment: int) -> str:
+        return f"{self.base_path}.{segment:06d}.jsonl"
+
+    def segments(self) -> List[int]:
+        """Return the existing segment numbers, oldest first."""
+        pattern = re.compile(re.escape(os.path.basename(self.base_path)) + r"\.(\d{6})\.jsonl$")
+        numbers = []
+        for path in glob.glob(f"{glob.escape(self.base_path)}.*.jsonl"):
+            match = pattern.search(os.path.basename(path))
+            if match:
+                numbers.append(int(match.group(1)))
+        return sorted(numbers)
+
+    def _open_active(self):
+        if self._file is None:
+            self._file = open(self._segment_path(self._segment), 'ab')
+        if self._file.tell() >= self.segment_max_bytes:
+            self._sync()
+            self._file.close()
+            self._segment += 1
+            self._file = open(self._segment_path(self._segment), 'ab')
+        return self._file
+
+    def _sync(self) -> None:
+        if self._file is not None and self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def generation(self) -> int:
+        """Number of rewrites so far; positions are only comparable within one generation."""
+        return read_generation(self.base_path)
+
+    # --- Writes ---
+
+    def add_listener(self, listener: Callable[[Optional[List[Tuple[Position, Dict[str, Any]]]]], None]) -> None:
+        """Register a callback notified of new entries (or None after a rewrite)."""
+        self._listeners.append(listener)
+
+    def _notify(self, written: Optional[List[Tuple[Position, Dict[str, Any]]]]) -> None:
+        for listener in self._listeners:
+            try:
+                listener(written)
+            except Exception as e:
+                logger.error(f"Log listener failed for {self.base_path}: {e}")
+
+    def append(self, entry: Dict[str, Any]) -> Position:
+        """Append one entry and return its position."""
+        return self.append_many([entry])[0]
+
+    def append_many(self, entries: Iterable[Dict[str, Any]]) -> List[Position]:
+        """Append entries with a single write and return their positions."""
+        entries = list(entries)
+        with self.lock:
+            f = self._open_active()
+            offset = f.tell()
+            positions = []
+            chunks = []
+            for entry in entries:
+                line = (json.dumps(entry, ensure_ascii=False) + "\n").encode('utf-8')
+                positions.append((self._segment, offset))
+                chunks.append(line)
+                offset += len(line)
+            if not chunks:
+                return []
+            f.write(b"".join(chunks))
+            # Hand the data to the OS now; fsync is batched
+            f.flush()
+            self._unsynced += len(chunks)
+            if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval_s:
+                self._sync()
+        self._notify(list(zip(positions, entries)))
+        return positions
+
+    def flush(self) -> None:
+        """fsync any pending appends."""
+        with self.lock:
+            self._sync()
+
+    def close(self) -> None:
+        with self.lock:
+            self._sync()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def rewrite(self, transform: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]) -> int:
+        """
+        Rewrite every entry through transform (return None to drop an entry).
+
+        This is O(n) and meant for rare admin operations. All segments are compacted
+        into a fresh segment sequence, so previously returned positions become invalid;
+        listeners are notified with None.
+
+        The compacted file replaces segment 1 before the other segments are
+        removed, so a crash part way through can leave stale later segments
+        behind (entries repeated) but never loses the log.
+
+        Returns:
+            Number of entries that were changed or dropped.
+        """
+        with self.lock:
+            self.close()
+            old_segments = self.segments()
+            # Bumped before and after the swap, so a reader that saw the new segments
+            # sees a new generation too, even if the process dies in between
+            bump_generation(self.base_path)
+            changed = 0
+            tmp_path = f"{self.base_path}.rewrite.tmp"
+            with open(tmp_path, 'wb') as out:
+                for entry in self.iter_entries():
+                    new_entry = transform(dict(entry))
+                    if new_entry != entry:
+                        changed += 1
+                    if new_entry is not None:
+                        out.write((json.dumps(new_entry, ensure_ascii=False) + "\n").encode('utf-8'))
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(tmp_path, self._segment_path(1))
+            directory = os.path.dirname(self.base_path) or '.'
+            _fsync_dir(directory)
+            for segment in old_segments:
+                if segment != 1:
+                    os.remove(self._segment_path(segment))
+            _fsync_dir(directory)
+            bump_generation(self.base_path)
+            self._segment = 1
+        self._notify(None)
+        return changed
+
+    # --- Reads ---
+
+    def read_at(self, position: Position) -> Optional[Dict[str, Any]]:
+        """Read the entry stored at position."""
+        segment, offset = position
+        path = self._segment_path(segment)
+        try:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                line = f.readline()
+        except OSError:
+            return None
+        return _decode(line, path, offset) if line.strip() else None
+
+    def iter_with_positions(self, reverse: bool = False, before: Optional[Position] = None,
+                            after: Optional[Position] = None) -> Iterator[Tuple[Position, Dict[str, Any]]]:
+        """
+        Stream (position, entry) pairs.
+
+        Args:
+            reverse: Newest first instead of oldest first.
+            before: Only yield entries strictly before this position; useful for cursors.
+            after: Only yield entries strictly after this position.
+        """
+        segments = self.segments()
+        if before is not None:
+            segments = [s for s in segments if s <= before[0]]
+        if after is not None:
+            segments = [s for s in segments if s >= after[0]]
+        for segment in (reversed(segments) if reverse else segments):
+            end = before[1] if before is not None and segment == before[0] else None
+            start = after[1] if after is not None and segment == after[0] else None
+            if reverse:
+                for position, entry in self._iter_segment_reverse(segment, end):
+                    if start is not None and position[1] <= start:
+                        return
+                    yield position, entry
+            else:
+                yield from self._iter_segment(segment, end, start)
+
+    def iter_entries(self, reverse: bool = False) -> Iterator[Dict[str, Any]]:
+        """Stream entries oldest first (or newest first)."""
+        for _, entry in self.iter_with_positions(reverse=reverse):
+            yield entry
+
+    def _iter_segment(self, segment: int, end: Optional[int] = None,
+                      after: Optional[int] = None) -> Iterator[Tuple[Position, Dict[str, Any]]]:
+        path = self._segment_path(segment)
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return
+        with f:
+            if after is not None:
+                # Skip the entry at the cursor itself
+                f.seek(after)
+                f.readline()
+            while True:
+                offset = f.tell()
+                if end is not None and offset >= end:
+                    break
+                line = f.readline()
+                if not line:
+                    break
+                if not line.endswith(b"\n"):
+                    # Partially written tail
+                    break
+                entry = _decode(line, path, offset) if line.strip() else None
+                if entry is not None:
+                    yield (segment, offset), entry
+
+    def _iter_segment_reverse(self, segment: int, end: Optional[int] = None) -> Iterator[Tuple[Position, Dict[str, Any]]]:
+        path = self._segment_path(segment)
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return
+        with f:
+            f.seek(0, os.SEEK_END)
+            pos = f.tell() if end is None else min(end, f.tell())
+            buf = b""
+            # Ignore a partially written tail
+            if end is None and pos:
+                f.seek(pos - 1)
+                if f.read(1) != b"\n":
+                    f.seek(0)
+                    data = f.read(pos)
+                    pos = data.rfind(b"\n") + 1
+            while pos > 0:
+                read = min(_REVERSE_BLOCK, pos)
+                pos -= read
+                f.seek(pos)
+                buf = f.read(read) + buf
+                chunk_end = pos + len(buf)
+                lines = buf.split(b"\n")
+                buf = lines[0]
+                for line in reversed(lines[1:]):
+                    start = chunk_end - len(line)
+                    chunk_end = start - 1
+                    if line.strip():
+                        entry = _decode(line, path, start)
+                        if entry is not None:
+                            yield (segment, start), entry
+            if buf.strip():
+                entry = _decode(buf, path, 0)
+                if entry is not None:
+                    yield (segment, 0), entry
+
+
+def migrate_json_array(json_path: str, log: JsonlLog) -> int:
+    """
+    One-shot import of a legacy JSON-array file into a JSONL log.
+
+    The legacy file is renamed to ``<file>.migrated`` afterwards so it is never
+    imported twice. Returns the number of imported entries.
+    """
+    if not os.path.exists(json_path):
+        return 0
+    try:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.error(f"Could not migrate {json_path}: {e}")
+        return 0
+    if not isinstance(data, list):
+        data = []
+
+    log.append_many([entry for entry in data if isinstance(entry, dict)])
+    log.flush()
+    os.replace(json_path, json_path + '.migrated')
+    logger.info(f"Migrated {len(data)} entries from {json_path} to {log.base_path}")
+    return len(data)
+
+
+# One shared log object per path so every module appends through the same lock
+_logs: Dict[str, JsonlLog] = {}
+_logs_lock = threading.Lock()
+
+
+def open_log(base_path: str, legacy_json_path: Optional[str] = None) -> JsonlLog:
+    """Return the process-wide JsonlLog for base_path."""
+    key = os.path.normpath(os.path.abspath(base_path))
+    with _logs_lock:
+        if key not in _logs:
+            _logs[key] = JsonlLog(key, legacy_json_path)
+        return _logs[key]
+
+
+@atexit.register
+def _close_logs() -> None:
+    with _logs_lock:
+        for log in _logs.values():
+            try:
+                log.close()
+            except Exception:
+                pass
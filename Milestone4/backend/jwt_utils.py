@@ -2,19 +2,36 @@
 """JWT Utilities Module
 
 Handles generation and verification of JSON Web Tokens.
+
+Tokens are signed with JWT_SECRET_KEY. Without it every process start signs with
+a new random key, so tokens cannot be forged but stop working after a restart.
+Forked workers and the router share the key of the supervisor they fork from.
+
+verify_token_cached keeps recently verified tokens in a small LRU keyed by the
+token's SHA-256 digest, so checking the same bearer token on every request costs
+a dictionary lookup instead of a signature check. Entries leave the cache when
+their token expires.
 """
 
 import jwt
 import os
+import time
+import hashlib
+import secrets
 import datetime
+import threading
+from collections import OrderedDict
 from typing import Dict, Any, Optional
 
-# Secret key for signing tokens
-# In production, this should be a strong secret loaded from env
-SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "super-secret-dev-key-change-in-prod")
+# Secret key for signing tokens (Load from env in production)
+# Never a fixed default: anyone who knew it could sign their own admin tokens
+SECRET_KEY_FROM_ENV = bool(os.environ.get("JWT_SECRET_KEY"))
+SECRET_KEY = os.environ.get("JWT_SECRET_KEY") or secrets.token_urlsafe(64)
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 30
-REFRESH_TOKEN_EXPIRE_DAYS = 7
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.environ.get("REFRESH_TOKEN_EXPIRE_DAYS", 7))
+# Verified tokens kept in memory (0 disables the cache)
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 10000))
 
 def create_access_token(data: Dict[str, Any], expires_delta: Optional[datetime.timedelta] = None) -> str:
     """Create a new access token."""
@@ -37,12 +54,97 @@ def create_refresh_token(data: Dict[str, Any]) -> str:
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def verify_token(token: str) -> Optional[Dict[str, Any]]:
-    """Verify and decode a token."""
+def issue_tokens(user_id: str, role: str = "user") -> Dict[str, str]:
+    """Create an access/refresh token pair for a user."""
+    claims = {"sub": user_id, "role": role}
+    return {
+        "access_token": create_access_token(claims),
+        "refresh_token": create_refresh_token(claims),
+        "token_type": "bearer"
+    }
+
+def verify_token(token: str, token_type: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Verify and decode a token (optionally requiring its 'type' claim)."""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
     except jwt.ExpiredSignatureError:
         return None
-    except jwt.JWTError:
+    except jwt.InvalidTokenError:
+        return None
+    if token_type is not None and payload.get("type") != token_type:
+        return None
+    return payload
+
+
+class TokenCache:
+    """LRU of verified token payloads keyed by token digest; expired entries are evicted."""
+
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[bytes, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+    def get(self, digest: bytes) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            payload = self._entries.get(digest)
+            if payload is None:
+                self.misses += 1
+                return None
+            if payload.get("exp", 0) <= time.time():
+                del self._entries[digest]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return payload
+
+    def put(self, digest: bytes, payload: Dict[str, Any]) -> None:
+        if self.max_size <= 0:
+            return
+        now = time.time()
+        with self._lock:
+            self._entries[digest] = payload
+            self._entries.move_to_end(digest)
+            if len(self._entries) > self.max_size:
+                # Drop expired tokens first, then the least recently used
+                for key in [k for k, p in self._entries.items() if p.get("exp", 0) <= now]:
+                    del self._entries[key]
+                    self.expired += 1
+                while len(self._entries) > self.max_size:
+                    self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
+
+
+token_cache = TokenCache()
+
+def verify_token_cached(token: str, token_type: Optional[str] = "access") -> Optional[Dict[str, Any]]:
+    """verify_token with the verified-token cache in front; only valid tokens are cached."""
+    digest = hashlib.sha256(token.encode("utf-8")).digest()
+    payload = token_cache.get(digest)
+    if payload is None:
+        payload = verify_token(token)
+        if payload is None:
+            return None
+        token_cache.put(digest, payload)
+    if token_type is not None and payload.get("type") != token_type:
         return None
+    return payload
@@ -0,0 +1,446 @@
+# -*- coding: utf-8 -*-
+"""Materialized Views Module
+
+Aggregates kept up to date as events are logged, so read paths such as the admin
+dashboard don't rescan the logs.
+
+A view follows one or more event logs. It remembers the position of the last
+entry it has applied (its watermark) in each log. When a log notifies it, and
+before every read, it applies only the entries after the watermark. Watermarks
+are only meaningful within one generation of a log; when another process has
+rewritten a log since, the view is rebuilt instead. The view
+state is saved to a JSON snapshot in the data directory, so a restart only
+replays the tail of the logs. ``rebuild()`` recomputes a view from scratch.
+"""
+
+import os
+import json
+import time
+import heapq
+import base64
+import atexit
+import logging
+import threading
+from array import array
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .jsonl_store import Position
+from .pagination import clamp_limit, cursor_position, position_cursor
+from .storage import EVENT_LOG_BACKEND, atomic_write_bytes, data_path, open_event_log
+from .write_behind import flush_events
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Snapshot knobs (Load from env in production)
+VIEW_SNAPSHOT_INTERVAL_S = float(os.environ.get("VIEW_SNAPSHOT_INTERVAL_S", 30))
+
+# Number of newest feedback entries the dashboard shows
+RECENT_FEEDBACK_SIZE = 5
+
+
+def encode_array(values: array) -> str:
+    """Pack a typed array into a JSON-safe string for snapshots."""
+    return base64.b64encode(values.tobytes()).decode('ascii')
+
+
+def decode_array(typecode: str, data: str) -> array:
+    values = array(typecode)
+    values.frombytes(base64.b64decode(data))
+    return values
+
+
+class MaterializedView:
+    """
+    Base class for incrementally maintained views over event logs.
+
+    Subclasses define ``initial_state``, ``apply`` and, when their state holds
+    values that are not JSON-serializable, ``encode_state``/``decode_state``. Bump
+    ``version`` whenever the state layout changes; older snapshots are then rebuilt.
+    Large views can save less often by overriding ``snapshot_interval_s``.
+    """
+
+    version = 1
+    snapshot_interval_s = VIEW_SNAPSHOT_INTERVAL_S
+
+    def __init__(self, name: str, log_names: Iterable[str]):
+        self.name = name
+        self.log_names = list(log_names)
+        self.lock = threading.RLock()
+        self._rebuild_lock = threading.Lock()
+        self.state: Dict[str, Any] = self.initial_state()
+        self.watermarks: Dict[str, Optional[Position]] = {log_name: None for log_name in self.log_names}
+        # Generation of each log the watermarks belong to
+        self.generations: Dict[str, int] = {log_name: 0 for log_name in self.log_names}
+        self.applied = 0
+        self.rebuilds = 0
+        self._dirty = False
+        self._last_snapshot = time.monotonic()
+        self.snapshot_path = data_path(f"{name}.view.json")
+
+        if not self._load_snapshot():
+            self.rebuild()
+        for log_name in self.log_names:
+            open_event_log(log_name).add_listener(lambda written, log_name=log_name: self._on_log_event(log_name, written))
+        self.refresh()
+
+    # --- Subclass hooks ---
+
+    def initial_state(self) -> Dict[str, Any]:
+        raise NotImplementedError
+
+    def apply(self, state: Dict[str, Any], log_name: str, position: Position, entry: Dict[str, Any]) -> None:
+        """Fold one log entry into state."""
+        raise NotImplementedError
+
+    def encode_state(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        return state
+
+    def decode_state(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        return data
+
+    # --- Maintenance ---
+
+    def _on_log_event(self, log_name: str, written: Optional[List[Tuple[Position, Dict[str, Any]]]]) -> None:
+        if written is None:
+            # The log was rewritten and every position changed
+            self.rebuild()
+        else:
+            self._catch_up(log_name)
+
+    def _tail(self, log_name: str, watermark: Optional[Position]) -> Optional[List[Tuple[Position, Dict[str, Any]]]]:
+        """Entries after watermark, oldest first; None when the watermark is gone."""
+        if watermark is None:
+            return list(open_event_log(log_name).iter_with_positions())
+        newer = []
+        for position, entry in open_event_log(log_name).iter_with_positions(reverse=True):
+            if tuple(position) <= watermark:
+                newer.reverse()
+                return newer
+            newer.append((tuple(position), entry))
+        # Reached the start of the log without meeting the watermark: the log shrank
+        return None
+
+    def _catch_up(self, log_name: str) -> int:
+        generation = open_event_log(log_name).generation()
+        with self.lock:
+            watermark = self.watermarks.get(log_name)
+            stale = generation != self.generations.get(log_name)
+        if stale:
+            # Rewritten by another process: positions were renumbered
+            logger.warning(f"{log_name} was rewritten; rebuilding view {self.name}")
+            self.rebuild()
+            return 0
+        # Read without holding the view lock so loggers never wait on a scan
+        newer = self._tail(log_name, watermark)
+        if newer is None:
+            logger.warning(f"View {self.name} lost its place in {log_name}; rebuilding")
+            self.rebuild()
+            return 0
+        applied = 0
+        with self.lock:
+            for position, entry in newer:
+                current = self.watermarks.get(log_name)
+                if current is not None and position <= current:
+                    continue
+                self.apply(self.state, log_name, position, entry)
+                self.watermarks[log_name] = position
+                applied += 1
+            self.applied += applied
+            self._dirty = self._dirty or applied > 0
+        if applied and time.monotonic() - self._last_snapshot >= self.snapshot_interval_s:
+            self.save_snapshot()
+        return applied
+
+    def refresh(self) -> int:
+        """Apply entries other writers added since the last update. Returns how many."""
+        return sum(self._catch_up(log_name) for log_name in self.log_names)
+
+    def rebuild(self) -> None:
+        """Recompute the view from the full logs."""
+        with self._rebuild_lock:
+            state = self.initial_state()
+            watermarks: Dict[str, Optional[Position]] = {}
+            generations: Dict[str, int] = {}
+            for log_name in self.log_names:
+                log = open_event_log(log_name)
+                # Read first: a rewrite during the scan then shows up as a newer generation
+                generations[log_name] = log.generation()
+                watermarks[log_name] = None
+                for position, entry in log.iter_with_positions():
+                    self.apply(state, log_name, tuple(position), entry)
+                    watermarks[log_name] = tuple(position)
+            with self.lock:
+                self.state = state
+                self.watermarks = watermarks
+                self.generations = generations
+                self.rebuilds += 1
+                self._dirty = True
+            logger.info(f"Rebuilt view {self.name}")
+        self.save_snapshot()
+
+    # --- Snapshots ---
+
+    def _load_snapshot(self) -> bool:
+        if not os.path.exists(self.snapshot_path):
+            return False
+        try:
+            with open(self.snapshot_path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            if snapshot.get('version') != self.version or snapshot.get('backend') != EVENT_LOG_BACKEND:
+                return False
+            if sorted(snapshot.get('watermarks', {})) != sorted(self.log_names):
+                return False
+            if sorted(snapshot.get('generations', {})) != sorted(self.log_names):
+                return False
+            state = self.decode_state(snapshot['state'])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Ignoring unreadable snapshot {self.snapshot_path}: {e}")
+            return False
+        self.state = state
+        self.watermarks = {name: tuple(pos) if pos is not None else None
+                           for name, pos in snapshot['watermarks'].items()}
+        self.generations = dict(snapshot['generations'])
+        return True
+
+    def save_snapshot(self) -> None:
+        with self.lock:
+            if not self._dirty:
+                return
+            snapshot = {
+                'version': self.version,
+                'backend': EVENT_LOG_BACKEND,
+                'watermarks': {name: list(pos) if pos is not None else None for name, pos in self.watermarks.items()},
+                'generations': dict(self.generations),
+                'state': self.encode_state(self.state),
+                'saved_at': time.time()
+            }
+            payload = json.dumps(snapshot, ensure_ascii=False).encode('utf-8')
+            self._dirty = False
+            self._last_snapshot = time.monotonic()
+        try:
+            atomic_write_bytes(self.snapshot_path, payload)
+        except OSError as e:
+            logger.error(f"Failed to save snapshot {self.snapshot_path}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'applied': self.applied,
+                'rebuilds': self.rebuilds,
+                'watermarks': {name: list(pos) if pos is not None else None for name, pos in self.watermarks.items()},
+                'generations': dict(self.generations)
+            }
+
+
+class DashboardAggregates(MaterializedView):
+    """Totals, ratings, active users, top languages and the newest feedback for the admin dashboard."""
+
+    def __init__(self, history_log: str = 'user_history', feedback_log: str = 'feedback_log'):
+        self.history_log = history_log
+        self.feedback_log = feedback_log
+        super().__init__('dashboard_aggregates', [history_log, feedback_log])
+
+    def initial_state(self) -> Dict[str, Any]:
+        return {
+            'total_queries': 0,
+            'active_users': set(),
+            'languages': Counter(),
+            'total_feedback': 0,
+            'rating_sum': 0.0,
+            'rating_count': 0,
+            # Min-heap of (timestamp, sequence, entry) holding the newest feedback
+            'recent_feedback': [],
+            'sequence': 0
+        }
+
+    def apply(self, state: Dict[str, Any], log_name: str, position: Position, entry: Dict[str, Any]) -> None:
+        if log_name == self.history_log:
+            state['total_queries'] += 1
+            if 'user_id' in entry:
+                state['active_users'].add(entry['user_id'])
+            state['languages'][entry.get('language', 'Unknown')] += 1
+        elif log_name == self.feedback_log:
+            state['total_feedback'] += 1
+            if isinstance(entry.get('rating'), (int, float)):
+                state['rating_sum'] += entry['rating']
+                state['rating_count'] += 1
+            state['sequence'] += 1
+            item = (entry.get('timestamp', ''), state['sequence'], entry)
+            if len(state['recent_feedback']) < RECENT_FEEDBACK_SIZE:
+                heapq.heappush(state['recent_feedback'], item)
+            elif item[:2] > state['recent_feedback'][0][:2]:
+                heapq.heapreplace(state['recent_feedback'], item)
+
+    def encode_state(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            **state,
+            'active_users': sorted(state['active_users']),
+            'languages': dict(state['languages']),
+            'recent_feedback': [list(item) for item in state['recent_feedback']]
+        }
+
+    def decode_state(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        recent = [tuple(item) for item in data['recent_feedback']]
+        heapq.heapify(recent)
+        return {
+            **data,
+            'active_users': set(data['active_users']),
+            'languages': Counter(data['languages']),
+            'recent_feedback': recent
+        }
+
+    def summary(self) -> Dict[str, Any]:
+        """The dashboard numbers, in O(1) with respect to log size."""
+        self.refresh()
+        with self.lock:
+            state = self.state
+            return {
+                'total_queries': state['total_queries'],
+                'total_feedback': state['total_feedback'],
+                'average_rating': round(state['rating_sum'] / state['rating_count'], 2) if state['rating_count'] else 0.0,
+                'active_users': len(state['active_users']),
+                'top_languages': dict(state['languages'].most_common(5)),
+                'recent_feedback': [dict(item[2]) for item in sorted(state['recent_feedback'], reverse=True)]
+            }
+
+
+class UserActivityIndex(MaterializedView):
+    """
+    Per-user offsets into the activity log plus rolling counters.
+
+    A user's latest N entries are read straight from their positions, and the
+    profile numbers come from counters, so neither scans the global log.
+    """
+
+    def __init__(self, activity_log: str = 'user_activity'):
+        self.activity_log = activity_log
+        super().__init__('user_activity_index', [activity_log])
+
+    def initial_state(self) -> Dict[str, Any]:
+        # user_id -> {'positions': array of segment/offset pairs, 'queries', 'feedbacks', 'rating_sum', 'rating_count'}
+        return {'users': {}}
+
+    def apply(self, state: Dict[str, Any], log_name: str, position: Position, entry: Dict[str, Any]) -> None:
+        user_id = entry.get('user_id')
+        if user_id is None:
+            return
+        user = state['users'].get(user_id)
+        if user is None:
+            user = state['users'][user_id] = {'positions': array('q'), 'queries': 0, 'feedbacks': 0,
+                                              'rating_sum': 0.0, 'rating_count': 0}
+        user['positions'].extend(position)
+        if entry.get('activity_type') == 'query':
+            user['queries'] += 1
+        elif entry.get('activity_type') == 'feedback':
+            user['feedbacks'] += 1
+            rating = entry.get('rating')
+            if isinstance(rating, (int, float)) and rating > 0:
+                user['rating_sum'] += rating
+                user['rating_count'] += 1
+
+    def encode_state(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        return {'users': {user_id: {**user, 'positions': encode_array(user['positions'])}
+                          for user_id, user in state['users'].items()}}
+
+    def decode_state(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        return {'users': {user_id: {**user, 'positions': decode_array('q', user['positions'])}
+                          for user_id, user in data['users'].items()}}
+
+    def _positions(self, user_id: str, limit: Optional[int] = None) -> List[Position]:
+        self.refresh()
+        with self.lock:
+            user = self.state['users'].get(user_id)
+            if user is None:
+                return []
+            flat = user['positions']
+            count = len(flat) // 2
+            start = 0 if limit is None else max(0, count - limit)
+            return [(flat[2 * i], flat[2 * i + 1]) for i in range(start, count)]
+
+    def entries(self, user_id: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """The user's activity oldest first; only the newest ``limit`` entries when given."""
+        log = open_event_log(self.activity_log)
+        entries = (log.read_at(position) for position in self._positions(user_id, limit))
+        return [entry for entry in entries if entry is not None]
+
+    def page(self, user_id: str, limit: int = 50, cursor: Optional[str] = None,
+             newest_first: bool = True) -> Dict[str, Any]:
+        """One page of a user's activity as {'items', 'next_cursor'}, reading only that page."""
+        limit = clamp_limit(limit)
+        position = cursor_position(cursor, newest_first)
+        self.refresh()
+        with self.lock:
+            user = self.state['users'].get(user_id)
+            flat = user['positions'] if user is not None else array('q')
+            count = len(flat) // 2
+            # Binary search for the number of positions before (or up to) the cursor
+            lo, hi = 0, count
+            while position is not None and lo < hi:
+                mid = (lo + hi) // 2
+                pair = (flat[2 * mid], flat[2 * mid + 1])
+                if pair < position or (not newest_first and pair == position):
+                    lo = mid + 1
+                else:
+                    hi = mid
+            if newest_first:
+                end = lo if position is not None else count
+                indexes = range(end - 1, max(end - limit - 1, 0) - 1, -1)
+            else:
+                start = lo if position is not None else 0
+                indexes = range(start, min(start + limit + 1, count))
+            positions = [(flat[2 * i], flat[2 * i + 1]) for i in indexes]
+
+        next_cursor = position_cursor(positions[limit - 1], newest_first) if len(positions) > limit else None
+        log = open_event_log(self.activity_log)
+        entries = (log.read_at(p) for p in positions[:limit])
+        return {'items': [entry for entry in entries if entry is not None], 'next_cursor': next_cursor}
+
+    def counters(self, user_id: str) -> Dict[str, Any]:
+        self.refresh()
+        with self.lock:
+            user = self.state['users'].get(user_id)
+            if user is None:
+                return {'queries': 0, 'feedbacks': 0, 'average_rating': 0.0}
+            return {
+                'queries': user['queries'],
+                'feedbacks': user['feedbacks'],
+                'average_rating': round(user['rating_sum'] / user['rating_count'], 2) if user['rating_count'] else 0.0
+            }
+
+
+_views: Dict[str, MaterializedView] = {}
+_views_lock = threading.Lock()
+
+
+def get_view(name: str, factory) -> MaterializedView:
+    """Return the process-wide view called name, creating it with factory on first use."""
+    with _views_lock:
+        if name not in _views:
+            _views[name] = factory()
+        return _views[name]
+
+
+def get_dashboard_aggregates() -> DashboardAggregates:
+    """Return the process-wide dashboard view, loading its snapshot on first use."""
+    return get_view('dashboard_aggregates', DashboardAggregates)
+
+
+def get_user_activity_index() -> UserActivityIndex:
+    """Return the process-wide per-user activity index."""
+    return get_view('user_activity_index', UserActivityIndex)
+
+
+@atexit.register
+def _save_snapshots() -> None:
+    # Let queued events reach the logs (and the views) first
+    flush_events(timeout=5.0)
+    with _views_lock:
+        views = list(_views.values())
+    for view in views:
+        try:
+            view.save_snapshot()
+        except Exception as e:
+            logger.error(f"Failed to save view {view.name}: {e}")
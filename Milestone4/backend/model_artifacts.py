@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""Model Artifacts Module
+
+Local cache of ready-to-load model artifacts for fast cold starts.
+
+The first load of a model goes through the Hugging Face hub (or its cache) as
+before. Afterwards the artifact directory is written, holding:
+* the tokenizer, with the patched Gemma chat template,
+* config.json and generation_config.json,
+* weights-<dtype>.pt: the state dict in torch's zip format, in the dtype used at
+  inference time.
+
+Later starts build the model on the meta device and load that file with
+``torch.load(mmap=True)``. The tensors are assigned in place, so the weights are
+paged in from the file as they are used, with no deserialization or dtype
+conversion. Pages are shared through the page cache between worker processes
+(see serve.py).
+
+Artifacts record the torch and transformers versions they were written with,
+and are rebuilt when either changes.
+"""
+
+import os
+import json
+import time
+import shutil
+import logging
+from typing import Any, Dict, Optional
+
+import torch
+import transformers
+from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer, GenerationConfig
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Artifact cache location (Load from env in production; empty disables the cache)
+MODEL_ARTIFACT_DIR = os.environ.get("MODEL_ARTIFACT_DIR", os.path.expanduser("~/.cache/codegenie/artifacts"))
+
+ARTIFACT_FORMAT = 1
+MANIFEST_FILE = "codegenie_artifact.json"
+
+
+def _artifact_dir(model_id: str) -> str:
+    return os.path.join(MODEL_ARTIFACT_DIR, model_id.strip('/').replace('/', '--'))
+
+
+def _weights_file(path: str, dtype: torch.dtype) -> str:
+    return os.path.join(path, f"weights-{str(dtype).replace('torch.', '')}.pt")
+
+
+def _manifest(model_id: str) -> Dict[str, Any]:
+    return {'format': ARTIFACT_FORMAT, 'model_id': model_id,
+            'torch': torch.__version__, 'transformers': transformers.__version__}
+
+
+def has_artifact(model_id: str) -> bool:
+    """Whether a current artifact (tokenizer and config) exists for model_id."""
+    if not MODEL_ARTIFACT_DIR:
+        return False
+    try:
+        with open(os.path.join(_artifact_dir(model_id), MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f) == _manifest(model_id)
+    except (OSError, ValueError):
+        return False
+
+
+def load_tokenizer(model_id: str, hf_token: Optional[str], report: Dict[str, Any]):
+    """Load the tokenizer from its artifact, or from the hub."""
+    start = time.perf_counter()
+    tokenizer = None
+    if has_artifact(model_id):
+        try:
+            tokenizer = AutoTokenizer.from_pretrained(_artifact_dir(model_id))
+            report['tokenizer_source'] = 'artifact'
+        except Exception as e:
+            logger.warning(f"Ignoring tokenizer artifact of {model_id}: {e}")
+    if tokenizer is None:
+        tokenizer = AutoTokenizer.from_pretrained(model_id, token=hf_token, trust_remote_code=True)
+        report['tokenizer_source'] = 'hub'
+    report['tokenizer_s'] = round(time.perf_counter() - start, 3)
+    return tokenizer
+
+
+def _load_mmap(model_id: str, dtype: torch.dtype):
+    path = _artifact_dir(model_id)
+    config = AutoConfig.from_pretrained(path)
+    with torch.device("meta"):
+        model = AutoModelForCausalLM.from_config(config, dtype=dtype)
+    state = torch.load(_weights_file(path, dtype), map_location="cpu", mmap=True, weights_only=True)
+    model.load_state_dict(state['state_dict'], assign=True)
+    # Non-persistent buffers (e.g. rotary frequencies) are not part of the state dict
+    for name, buffer in state['buffers'].items():
+        module_name, _, attr = name.rpartition('.')
+        model.get_submodule(module_name)._buffers[attr] = buffer
+    if any(t.is_meta for t in list(model.parameters()) + list(model.buffers())):
+        raise ValueError("artifact does not cover every weight")
+    if os.path.exists(os.path.join(path, "generation_config.json")):
+        model.generation_config = GenerationConfig.from_pretrained(path)
+    return model.eval()
+
+
+def _write_atomic(path: str, write) -> None:
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path, ignore_errors=True)
+        elif os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def save_artifact(model_id: str, model, tokenizer) -> None:
+    """Write the tokenizer, config and weights of a freshly loaded model."""
+    path = _artifact_dir(model_id)
+    if not has_artifact(model_id):
+        def _write_dir(tmp_path):
+            tokenizer.save_pretrained(tmp_path)
+            model.config.save_pretrained(tmp_path)
+            if getattr(model, 'generation_config', None) is not None:
+                model.generation_config.save_pretrained(tmp_path)
+            with open(os.path.join(tmp_path, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+                json.dump(_manifest(model_id), f)
+        os.makedirs(MODEL_ARTIFACT_DIR, exist_ok=True)
+        shutil.rmtree(path, ignore_errors=True)
+        _write_atomic(path, _write_dir)
+
+    dtype = next(model.parameters()).dtype
+    persistent = set(model.state_dict())
+    state = {
+        'state_dict': model.state_dict(),
+        'buffers': {name: buffer for name, buffer in model.named_buffers() if name not in persistent}
+    }
+    _write_atomic(_weights_file(path, dtype), lambda tmp_path: torch.save(state, tmp_path))
+
+
+def load_weights(model_id: str, dtype: torch.dtype, hf_token: Optional[str], tokenizer, report: Dict[str, Any]):
+    """
+    Load the model for CPU inference in ``dtype``.
+
+    Memory-maps the artifact when there is one, otherwise loads from the hub and
+    writes the artifact for the next start.
+    """
+    start = time.perf_counter()
+    if has_artifact(model_id) and os.path.exists(_weights_file(_artifact_dir(model_id), dtype)):
+        try:
+            model = _load_mmap(model_id, dtype)
+            report['weights_source'] = 'artifact (mmap)'
+            report['weights_s'] = round(time.perf_counter() - start, 3)
+            return model
+        except Exception as e:
+            logger.warning(f"Ignoring weights artifact of {model_id}: {e}")
+
+    model = AutoModelForCausalLM.from_pretrained(
+        model_id,
+        token=hf_token,
+        dtype=dtype,
+        trust_remote_code=True
+    ).to("cpu")
+    report['weights_source'] = 'hub'
+    report['weights_s'] = round(time.perf_counter() - start, 3)
+    if MODEL_ARTIFACT_DIR:
+        start = time.perf_counter()
+        try:
+            save_artifact(model_id, model, tokenizer)
+            report['artifact_write_s'] = round(time.perf_counter() - start, 3)
+        except Exception as e:
+            logger.warning(f"Could not write artifact for {model_id}: {e}")
+    return model
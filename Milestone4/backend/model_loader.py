@@ -1,9 +1,15 @@
-import streamlit as st
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, AutoModel, BitsAndBytesConfig
+from transformers import AutoModelForCausalLM, BitsAndBytesConfig
 import os
+import gc
+import time
+import threading
+from collections import OrderedDict
 from dotenv import load_dotenv
 
+from .cpu_inference import load_cpu_model, model_precision, quantized_weight_bytes
+from .model_artifacts import load_tokenizer, load_weights
+
 load_dotenv()
 
 # Models Configuration
@@ -13,78 +19,321 @@ MODELS_CONFIG = {
     "phi-2": "microsoft/phi-2"
 }
 
-@st.cache_resource
-def load_models():
-    models = {}
-    tokenizers = {}
-    
+# Model each task uses when a request does not name one (the UI's defaults)
+DEFAULT_MODELS = {'generate': 'gemma', 'explain': 'deepseek'}
+
+# Memory budget for resident models in GB (0 = unlimited)
+MODEL_MEMORY_BUDGET_GB = float(os.getenv("MODEL_MEMORY_BUDGET_GB", 0))
+# Models that are never evicted, e.g. "gemma,deepseek"
+PINNED_MODELS = [m.strip() for m in os.getenv("PINNED_MODELS", "").split(",") if m.strip()]
+# Evict unpinned models that have not been used for this many seconds (0 = never)
+MODEL_IDLE_TIMEOUT_S = float(os.getenv("MODEL_IDLE_TIMEOUT_S", 0))
+# After a failed load, requests for the model fail fast for this many seconds before it is retried
+MODEL_LOAD_RETRY_S = float(os.getenv("MODEL_LOAD_RETRY_S", 30))
+# Models loaded when the server starts (defaults to the pinned ones plus the default models)
+_DEFAULT_WARMUP = ",".join(dict.fromkeys(PINNED_MODELS + list(DEFAULT_MODELS.values())))
+WARMUP_MODELS = [m.strip() for m in os.getenv("WARMUP_MODELS", _DEFAULT_WARMUP).split(",") if m.strip()]
+
+GEMMA_CHAT_TEMPLATE = (
+    "{% for message in messages %}"
+    "{% if message['role'] == 'user' %}"
+    "<start_of_turn>user\n{{ message['content'] }}<end_of_turn>\n"
+    "{% elif message['role'] == 'model' %}"
+    "<start_of_turn>model\n{{ message['content'] }}<end_of_turn>\n"
+    "{% endif %}"
+    "{% endfor %}"
+    "{% if add_generation_prompt %}"
+    "<start_of_turn>model\n"
+    "{% endif %}"
+)
+
+def _load_single_model(name):
+    """
+    Load one entry of MODELS_CONFIG and return (model, tokenizer, cold start report).
+
+    The tokenizer, and on CPU the weights, come from the local artifact cache when
+    it has them (see model_artifacts.py).
+    """
+    model_id = MODELS_CONFIG[name]
+    start = time.perf_counter()
+    report = {}
     hf_token = os.getenv("HF_TOKEN")
     if not hf_token:
         print("HF_TOKEN not found in environment variables.")
-        # In a real app, we might want to fail gracefully or log this
-        # return None, None
 
     device = "cuda" if torch.cuda.is_available() else "cpu"
-    print(f"Loading models on {device}...")
+    print(f"Loading {name} ({model_id}) on {device}...")
+
+    tokenizer = load_tokenizer(model_id, hf_token, report)
+
+    # Apply specific chat template for Gemma (also stored in the artifact)
+    if name == "gemma":
+        tokenizer.chat_template = GEMMA_CHAT_TEMPLATE
 
-    # Quantization Config (4-bit)
+    # Load Model
+    model_start = time.perf_counter()
     if device == "cuda":
+        # Quantization Config (4-bit)
         qconf = BitsAndBytesConfig(
             load_in_4bit=True,
             bnb_4bit_compute_dtype=torch.bfloat16,
             bnb_4bit_quant_type="nf4"
         )
+        model = AutoModelForCausalLM.from_pretrained(
+            model_id,
+            token=hf_token,
+            quantization_config=qconf,
+            device_map="auto",
+            trust_remote_code=True
+        )
+        report['weights_source'] = 'hub'
     else:
-        qconf = None
-
-    for name, model_id in MODELS_CONFIG.items():
-        try:
-            print(f"Loading {name} ({model_id})...")
-            tokenizer = AutoTokenizer.from_pretrained(model_id, token=hf_token, trust_remote_code=True)
-            
-            # Apply specific chat template for Gemma
-            if name == "gemma":
-                tokenizer.chat_template = (
-                    "{% for message in messages %}"
-                    "{% if message['role'] == 'user' %}"
-                    "<start_of_turn>user\n{{ message['content'] }}<end_of_turn>\n"
-                    "{% elif message['role'] == 'model' %}"
-                    "<start_of_turn>model\n{{ message['content'] }}<end_of_turn>\n"
-                    "{% endif %}"
-                    "{% endfor %}"
-                    "{% if add_generation_prompt %}"
-                    "<start_of_turn>model\n"
-                    "{% endif %}"
-                )
+        # Reduced precision (int8 or bf16) on CPU-only hosts, see cpu_inference.py
+        model = load_cpu_model(model_id, lambda dtype: load_weights(model_id, dtype, hf_token, tokenizer, report))
+
+    report['model_s'] = round(time.perf_counter() - model_start, 3)
+    report['total_s'] = round(time.perf_counter() - start, 3)
+    print(f"Cold start {name}: tokenizer {report['tokenizer_s']}s ({report['tokenizer_source']}), "
+          f"model {report['model_s']}s ({report.get('weights_source', 'cached int8')}), total {report['total_s']}s")
+    return model, tokenizer, report
+
+def _model_footprint(model) -> int:
+    """Best-effort size of a model's weights in bytes."""
+    try:
+        size = int(model.get_memory_footprint())
+    except Exception:
+        size = sum(p.numel() * p.element_size() for p in model.parameters())
+    # Dynamically quantized layers keep their int8 weights outside parameters()
+    return size + quantized_weight_bytes(model)
+
+
+class ModelRegistry:
+    """
+    Loads models the first time they are requested and keeps them under a memory budget.
+
+    Resident models are tracked in least-recently-used order. When loading a model
+    would exceed the budget, unpinned models are evicted oldest first. Pinned models
+    are never evicted.
+
+    A failed load is remembered for retry_s seconds, during which get() returns
+    (None, None) at once instead of trying again.
+    """
+
+    def __init__(self, memory_budget_bytes: int = 0, pinned=None, idle_timeout_s: float = 0,
+                 retry_s: float = MODEL_LOAD_RETRY_S):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.idle_timeout_s = idle_timeout_s
+        self.retry_s = retry_s
+        self.pinned = set(pinned or [])
+        self.lock = threading.RLock()
+        # name -> {'model', 'tokenizer', 'bytes', 'precision', 'cold_start', 'last_used', 'loaded_at'}, oldest first
+        self._entries = OrderedDict()
+        # Remembered sizes let us make room before loading a model again
+        self._known_sizes = {}
+        self._load_locks = {}
+        # name -> {'error', 'failures', 'failed_at'} of the last failed load
+        self._failures = {}
+        self.loads = 0
+        self.evictions = 0
+
+    def _used_bytes(self) -> int:
+        return sum(entry['bytes'] for entry in self._entries.values())
+
+    def _evict(self, name: str) -> None:
+        entry = self._entries.pop(name, None)
+        if entry is None:
+            return
+        self.evictions += 1
+        print(f"Evicting {name} ({entry['bytes'] / 1e9:.2f} GB)")
+        del entry
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def _evict_idle(self) -> None:
+        if not self.idle_timeout_s:
+            return
+        now = time.time()
+        for name in list(self._entries):
+            if name not in self.pinned and now - self._entries[name]['last_used'] > self.idle_timeout_s:
+                self._evict(name)
+
+    def _make_room(self, needed_bytes: int, keep: str) -> None:
+        if not self.memory_budget_bytes:
+            return
+        for name in list(self._entries):
+            if self._used_bytes() + needed_bytes <= self.memory_budget_bytes:
+                break
+            if name != keep and name not in self.pinned:
+                self._evict(name)
+        if self._used_bytes() + needed_bytes > self.memory_budget_bytes:
+            print(f"Warning: model memory budget exceeded ({(self._used_bytes() + needed_bytes) / 1e9:.2f} GB)")
 
-            # Load Model
-            if device == "cuda":
-                model = AutoModelForCausalLM.from_pretrained(
-                    model_id, 
-                    token=hf_token,
-                    quantization_config=qconf,
-                    device_map="auto",
-                    trust_remote_code=True
+    def _touch(self, name: str):
+        entry = self._entries.get(name)
+        if entry is not None:
+            entry['last_used'] = time.time()
+            self._entries.move_to_end(name)
+        return entry
+
+    def retry_after(self, name: str) -> float:
+        """Seconds until a model whose last load failed is tried again (0 if it is not backing off)."""
+        with self.lock:
+            failure = self._failures.get(name)
+            if failure is None:
+                return 0.0
+            return max(0.0, failure['failed_at'] + self.retry_s - time.time())
+
+    def get(self, name: str, retry_failed: bool = False):
+        """
+        Return (model, tokenizer) for name, loading it on first use.
+
+        retry_failed loads again even while a failed load is backing off.
+        """
+        if name not in MODELS_CONFIG:
+            return None, None
+
+        with self.lock:
+            self._evict_idle()
+            entry = self._touch(name)
+            if entry is not None:
+                return entry['model'], entry['tokenizer']
+            if not retry_failed and self.retry_after(name) > 0:
+                return None, None
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        # Loading can take minutes; only callers of this model wait for it
+        with load_lock:
+            with self.lock:
+                entry = self._touch(name)
+                if entry is not None:
+                    return entry['model'], entry['tokenizer']
+                # The load we waited for may just have failed
+                if not retry_failed and self.retry_after(name) > 0:
+                    return None, None
+                self._make_room(self._known_sizes.get(name, 0), keep=name)
+
+            try:
+                model, tokenizer, report = _load_single_model(name)
+            except Exception as e:
+                print(f"❌ Failed to load {name}: {e}")
+                with self.lock:
+                    failures = self._failures.get(name, {}).get('failures', 0) + 1
+                    self._failures[name] = {'error': str(e), 'failures': failures, 'failed_at': time.time()}
+                return None, None
+
+            size = _model_footprint(model)
+            with self.lock:
+                self._known_sizes[name] = size
+                self._failures.pop(name, None)
+                self.loads += 1
+                self._entries[name] = {
+                    'model': model,
+                    'tokenizer': tokenizer,
+                    'bytes': size,
+                    'precision': model_precision(model),
+                    'cold_start': report,
+                    'loaded_at': time.time(),
+                    'last_used': time.time()
+                }
+                # The real size is only known after loading
+                self._make_room(0, keep=name)
+            print(f"✅ {name} loaded successfully ({size / 1e9:.2f} GB).")
+            return model, tokenizer
+
+    def pin(self, name: str) -> bool:
+        """Keep a model resident (loading it if needed)."""
+        if name not in MODELS_CONFIG:
+            return False
+        with self.lock:
+            self.pinned.add(name)
+        model, _ = self.get(name, retry_failed=True)
+        return model is not None
+
+    def unpin(self, name: str) -> bool:
+        with self.lock:
+            if name not in self.pinned:
+                return False
+            self.pinned.discard(name)
+            return True
+
+    def unload(self, name: str) -> bool:
+        """Drop a resident model (and its pin) from memory."""
+        with self.lock:
+            self.pinned.discard(name)
+            if name not in self._entries:
+                return False
+            self._evict(name)
+            return True
+
+    def unload_all(self) -> None:
+        with self.lock:
+            for name in list(self._entries):
+                self._evict(name)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'memory_budget_bytes': self.memory_budget_bytes,
+                'used_bytes': self._used_bytes(),
+                'loads': self.loads,
+                'evictions': self.evictions,
+                'models': {
+                    name: {
+                        'loaded': name in self._entries,
+                        'pinned': name in self.pinned,
+                        'bytes': self._entries[name]['bytes'] if name in self._entries else self._known_sizes.get(name),
+                        'precision': self._entries[name]['precision'] if name in self._entries else None,
+                        'cold_start': self._entries[name]['cold_start'] if name in self._entries else None,
+                        'last_used': self._entries[name]['last_used'] if name in self._entries else None,
+                        'load_failure': {**self._failures[name], 'retry_in_s': round(self.retry_after(name), 1)}
+                        if name in self._failures else None
+                    }
+                    for name in MODELS_CONFIG
+                }
+            }
+
+
+# Process-local registry shared by every thread of the server
+_registry = None
+_registry_lock = threading.Lock()
+
+def get_registry() -> ModelRegistry:
+    global _registry
+    if _registry is None:
+        with _registry_lock:
+            if _registry is None:
+                _registry = ModelRegistry(
+                    memory_budget_bytes=int(MODEL_MEMORY_BUDGET_GB * 1e9),
+                    pinned=PINNED_MODELS,
+                    idle_timeout_s=MODEL_IDLE_TIMEOUT_S,
+                    retry_s=MODEL_LOAD_RETRY_S
                 )
-            else:
-                model = AutoModelForCausalLM.from_pretrained(
-                    model_id, 
-                    token=hf_token,
-                    trust_remote_code=True
-                ).to(device)
+    return _registry
+
+def warmup_models(names=None):
+    """Load the given models (WARMUP_MODELS by default) and report which ones succeeded."""
+    registry = get_registry()
+    # An explicit load also retries models whose last load failed
+    return {name: registry.get(name, retry_failed=True)[0] is not None for name in (names if names is not None else WARMUP_MODELS)}
 
+def unload_model(name: str) -> bool:
+    return get_registry().unload(name)
+
+def unload_all_models() -> None:
+    get_registry().unload_all()
+
+def load_models(names=None):
+    """Load the given models (all of MODELS_CONFIG by default) and return (models, tokenizers)."""
+    models = {}
+    tokenizers = {}
+    registry = get_registry()
+    for name in (names if names is not None else MODELS_CONFIG):
+        model, tokenizer = registry.get(name)
+        if model is not None:
             models[name] = model
             tokenizers[name] = tokenizer
-            print(f"✅ {name} loaded successfully.")
-            
-        except Exception as e:
-            print(f"❌ Failed to load {name}: {e}")
-            # st.error(f"Failed to load {name}: {e}")
-
     return models, tokenizers
 
 def get_model(model_name):
-    models, tokenizers = load_models()
-    if models and model_name in models:
-        return models[model_name], tokenizers[model_name]
-    return None, None
+    return get_registry().get(model_name)
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+"""Model Router Module
+
+Front process for the multi-worker model server (see serve.py).
+
+Inference requests are routed by model:
+* Models loaded before the workers were forked have their weights shared by
+  every worker, so any worker can serve them.
+* Any other model is kept on a fixed subset of SERVE_WORKERS_PER_MODEL workers,
+  so it is only loaded into those processes.
+Among eligible workers the one with the fewest requests in flight is chosen
+(ties go to the one that has served the fewest).
+A worker that refuses connections is skipped for a short while, and the request
+goes to the next eligible worker. Once a request has reached a worker it is never
+sent again: if that worker fails mid-request the client gets a 502, so a
+generation never runs twice.
+
+The per-user and per-model rate limits are enforced here, once for all workers
+(the workers run with theirs turned off), so adding workers does not multiply a
+user's allowance. The client address is passed on as X-Forwarded-For so the
+workers' fair queues still tell anonymous users apart.
+
+Login and token refresh always go to the first worker, so login throttling state
+lives in one place. Stats endpoints are fanned out to every worker, and cache or
+model admin calls are broadcast; these answer 502 with every worker's result
+when the workers do not all succeed. /healthz is answered by the router itself and
+/readyz only succeeds once every worker is ready.
+"""
+
+import os
+import time
+import json
+import math
+import zlib
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+from .jwt_utils import verify_token_cached
+from .model_loader import DEFAULT_MODELS
+from .admission_control import AdmissionRejected, RateLimiter
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Router knobs (Load from env in production)
+SERVE_WORKERS_PER_MODEL = int(os.environ.get("SERVE_WORKERS_PER_MODEL", 1))
+ROUTER_UNHEALTHY_BACKOFF_S = float(os.environ.get("ROUTER_UNHEALTHY_BACKOFF_S", 2))
+
+INFERENCE_PATHS = {'/generate': 'generate', '/explain': 'explain',
+                   '/generate/stream': 'generate', '/explain/stream': 'explain'}
+FAN_OUT_PATHS = {'/metrics', '/models', '/cache/stats'}
+# Request/response headers passed through the router
+FORWARD_REQUEST_HEADERS = ('authorization', 'content-type', 'accept')
+FORWARD_RESPONSE_HEADERS = ('content-type', 'retry-after', 'www-authenticate', 'cache-control')
+
+
+class WorkerPool:
+    """Workers of the model server and the requests each has in flight."""
+
+    def __init__(self, urls: List[str], shared_models: Optional[List[str]] = None,
+                 workers_per_model: int = SERVE_WORKERS_PER_MODEL):
+        self.urls = list(urls)
+        self.shared_models = set(shared_models or [])
+        self.workers_per_model = max(1, min(workers_per_model, len(self.urls)))
+        self.in_flight = [0] * len(self.urls)
+        self.routed = [0] * len(self.urls)
+        self.unhealthy_until = [0.0] * len(self.urls)
+
+    def eligible(self, model_name: str) -> List[int]:
+        """Workers allowed to serve model_name."""
+        if model_name in self.shared_models:
+            return list(range(len(self.urls)))
+        start = zlib.crc32(model_name.encode('utf-8')) % len(self.urls)
+        return [(start + i) % len(self.urls) for i in range(self.workers_per_model)]
+
+    def candidates(self, model_name: str) -> List[int]:
+        """Eligible workers, healthy and least loaded first."""
+        now = time.monotonic()
+        return sorted(self.eligible(model_name),
+                      key=lambda i: (self.unhealthy_until[i] > now, self.in_flight[i], self.routed[i]))
+
+    def mark_unhealthy(self, index: int) -> None:
+        self.unhealthy_until[index] = time.monotonic() + ROUTER_UNHEALTHY_BACKOFF_S
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            'shared_models': sorted(self.shared_models),
+            'workers_per_model': self.workers_per_model,
+            'workers': {
+                url: {'in_flight': self.in_flight[i], 'routed': self.routed[i],
+                      'healthy': self.unhealthy_until[i] <= now}
+                for i, url in enumerate(self.urls)
+            }
+        }
+
+
+def _forward_headers(request: Request) -> Dict[str, str]:
+    return {name: request.headers[name] for name in FORWARD_REQUEST_HEADERS if name in request.headers}
+
+
+def _response_headers(response: httpx.Response) -> Dict[str, str]:
+    return {name: response.headers[name] for name in FORWARD_RESPONSE_HEADERS if name in response.headers}
+
+
+def _user_key(request: Request) -> str:
+    """Rate-limit key, as the workers derive it: the token's subject, else the client address."""
+    scheme, _, token = request.headers.get('authorization', '').partition(' ')
+    payload = verify_token_cached(token) if scheme.lower() == 'bearer' and token else None
+    if payload and payload.get('sub'):
+        return payload['sub']
+    return request.client.host if request.client else "anonymous"
+
+
+def _model_for(path: str, body: bytes) -> str:
+    task = INFERENCE_PATHS[path]
+    try:
+        model_name = json.loads(body or b'{}').get('model')
+    except (ValueError, AttributeError):
+        model_name = None
+    return model_name if isinstance(model_name, str) and model_name else DEFAULT_MODELS[task]
+
+
+def create_router_app(worker_urls: List[str], shared_models: Optional[List[str]] = None) -> FastAPI:
+    """FastAPI app that proxies the model server API onto worker_urls."""
+    pool = WorkerPool(worker_urls, shared_models)
+    rate_limiter = RateLimiter()
+    app = FastAPI()
+    state: Dict[str, httpx.AsyncClient] = {}
+
+    @app.on_event("startup")
+    async def _open_client():
+        # Inference can take minutes; the workers enforce their own timeouts
+        state['client'] = httpx.AsyncClient(timeout=httpx.Timeout(None, connect=5.0))
+
+    @app.on_event("shutdown")
+    async def _close_client():
+        await state['client'].aclose()
+
+    async def _send(index: int, request: Request, path: str, body: bytes, stream: bool = False) -> httpx.Response:
+        client = state['client']
+        headers = _forward_headers(request)
+        if request.client:
+            headers['x-forwarded-for'] = request.client.host
+        upstream = client.build_request(request.method, pool.urls[index] + path, content=body,
+                                        headers=headers, params=request.query_params)
+        return await client.send(upstream, stream=stream)
+
+    async def _proxy(request: Request, path: str, body: bytes, indices: List[int], stream: bool = False) -> Response:
+        for index in indices:
+            pool.in_flight[index] += 1
+            released = False
+            try:
+                response = await _send(index, request, path, body, stream)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                # Nothing reached the worker, so another one may take the request
+                pool.in_flight[index] -= 1
+                pool.mark_unhealthy(index)
+                logger.warning(f"Worker {pool.urls[index]} unavailable: {e}")
+                continue
+            except httpx.TransportError as e:
+                # The worker may already be running the request; retrying could run it twice
+                pool.in_flight[index] -= 1
+                pool.mark_unhealthy(index)
+                logger.warning(f"Worker {pool.urls[index]} failed mid-request: {e}")
+                return JSONResponse({"detail": "The model server worker failed while handling the request"},
+                                    status_code=502)
+            pool.routed[index] += 1
+            if not stream:
+                pool.in_flight[index] -= 1
+                return Response(response.content, status_code=response.status_code, headers=_response_headers(response))
+
+            async def _relay(response=response, index=index):
+                try:
+                    async for chunk in response.aiter_raw():
+                        yield chunk
+                finally:
+                    # Closing the upstream stream lets the worker notice the disconnect
+                    await response.aclose()
+                    pool.in_flight[index] -= 1
+
+            return StreamingResponse(_relay(), status_code=response.status_code, headers=_response_headers(response))
+        return JSONResponse({"detail": "No model server worker is available"}, status_code=503,
+                            headers={"Retry-After": "1"})
+
+    async def _fan_out(request: Request, path: str, body: bytes, indices: List[int]) -> Response:
+        """
+        Send the request to every worker in indices and return all their answers.
+
+        The status is the workers' common status when they agree, else 502, so a
+        broadcast that reached only some workers is not reported as a success.
+        """
+        async def _one(index):
+            try:
+                response = await _send(index, request, path, body)
+                return pool.urls[index], response.status_code, response.json()
+            except (httpx.HTTPError, ValueError) as e:
+                return pool.urls[index], None, {"error": str(e)}
+        results = await asyncio.gather(*[_one(i) for i in indices])
+        payload: Dict[str, Any] = {"workers": {url: result for url, _, result in results}}
+        failed = [url for url, status, _ in results if status is None or status >= 400]
+        if failed:
+            payload["failed"] = failed
+        if path == '/metrics':
+            payload["router"] = {**pool.stats(), 'rate_limits': rate_limiter.stats()}
+        statuses = {status for _, status, _ in results}
+        status_code = statuses.pop() if len(statuses) == 1 and None not in statuses else 502
+        return JSONResponse(payload, status_code=status_code)
+
+    @app.get("/healthz")
+    async def healthz():
+        return {"status": "ok"}
+
+    @app.get("/readyz")
+    async def readyz(request: Request):
+        async def _one(index):
+            try:
+                response = await _send(index, request, "/readyz", b"")
+                return pool.urls[index], response.status_code == 200, response.json()
+            except (httpx.HTTPError, ValueError) as e:
+                return pool.urls[index], False, {"ready": False, "error": str(e)}
+        results = await asyncio.gather(*[_one(i) for i in range(len(pool.urls))])
+        ready = all(ok for _, ok, _ in results)
+        return JSONResponse({"ready": ready, "workers": {url: report for url, _, report in results}},
+                            status_code=200 if ready else 503)
+
+    @app.api_route("/{path:path}", methods=["GET", "POST"])
+    async def route(path: str, request: Request):
+        path = "/" + path
+        body = await request.body()
+        if path in INFERENCE_PATHS:
+            model_name = _model_for(path, body)
+            try:
+                rate_limiter.check(_user_key(request), model_name)
+            except AdmissionRejected as e:
+                return JSONResponse({"detail": str(e)}, status_code=429,
+                                    headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))})
+            return await _proxy(request, path, body, pool.candidates(model_name), stream=path.endswith('/stream'))
+        if request.method == "GET" and path in FAN_OUT_PATHS:
+            return await _fan_out(request, path, body, list(range(len(pool.urls))))
+        parts = path.strip("/").split("/")
+        if parts[0] == "models" and len(parts) == 3 and parts[2] in ("load", "pin"):
+            # Only the workers that serve this model should hold it
+            return await _fan_out(request, path, body, pool.eligible(parts[1]))
+        if path == "/cache/clear" or (parts[0] == "models" and len(parts) == 3):
+            return await _fan_out(request, path, body, list(range(len(pool.urls))))
+        return await _proxy(request, path, body, [0])
+
+    return app
@@ -1,49 +1,425 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from pydantic import BaseModel
+from starlette.concurrency import iterate_in_threadpool
 import uvicorn
+import json
 import os
+import asyncio
+import math
 import sys
 
-# Ensure backend modules can be imported
-sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+# Ensure the backend package can be imported
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')))
 
-from code_generator_module import generate_code
-from code_explainer_module import explain_code
-from model_loader import load_models
+from backend.code_generator_module import generate_code_batch, stream_generate_code, GENERATION_PARAMS
+from backend.code_explainer_module import explain_code_batch, stream_explain_code, EXPLANATION_PARAMS
+from backend.generation_utils import decoding_params
+from backend.model_loader import DEFAULT_MODELS, WARMUP_MODELS, get_registry, warmup_models, unload_model, unload_all_models
+from backend.batch_scheduler import SchedulerRegistry
+from backend.response_cache import ResponseCache, make_cache_key
+from backend.semantic_cache import SemanticCache
+from backend.prefix_cache import get_prefix_cache
+from backend.readiness import Readiness
+from backend.speculative_decoding import speculative_stats
+from backend.jwt_utils import SECRET_KEY_FROM_ENV, issue_tokens, token_cache, verify_token, verify_token_cached
+from backend.user_management_module import get_user_by_id, verify_user_password
+from backend.admission_control import AdmissionRejected, RateLimiter, StreamSlots, weight_for_role
+from backend.inference_executor import INFERENCE_TIMEOUT_S, STREAM_TIMEOUT_S, StopSignal, get_inference_executors
+
+# Require a bearer access token on /generate and /explain, and an admin one on the
+# cache, model and metrics routes (Load from env in production)
+API_AUTH_ENABLED = os.environ.get("API_AUTH_ENABLED", "true").lower() in ("1", "true", "yes")
+# How often a waiting request checks whether its client is still connected
+DISCONNECT_POLL_S = 0.5
 
 app = FastAPI()
+bearer_scheme = HTTPBearer(auto_error=False)
+
+# Inference runs on per-model worker threads, never on the event loop
+executors = get_inference_executors()
+
+# One weighted fair queue per model, shared by its batches and its streams
+schedulers = SchedulerRegistry({
+    'generate': generate_code_batch,
+    'explain': explain_code_batch
+}, executors=executors)
+
+# Per-user/per-model token buckets and per-model/per-user stream caps
+rate_limiter = RateLimiter()
+stream_slots = StreamSlots()
+
+# Answers for repeated deterministic requests
+response_cache = ResponseCache()
+# Answers for paraphrased generation prompts
+semantic_cache = SemanticCache()
+
+# Background loading and warmup of WARMUP_MODELS, reported by /readyz
+readiness = Readiness(WARMUP_MODELS, {'semantic_encoder': semantic_cache.encoder.load} if semantic_cache.enabled else {})
 
 class CodeRequest(BaseModel):
     prompt: str
     language: str
-    model: str = "gemma"
+    model: str = DEFAULT_MODELS['generate']
+    # Greedy decoding; only deterministic answers are cached
+    deterministic: bool = False
+    # Skip cache lookups and always run the model
+    bypass_cache: bool = False
+    # Draft tokens with DRAFT_MODEL and verify them with this model (implies greedy decoding)
+    speculative: bool = False
 
 class ExplainRequest(BaseModel):
     code: str
     style: str
-    model: str = "deepseek"
+    model: str = DEFAULT_MODELS['explain']
+    deterministic: bool = False
+    bypass_cache: bool = False
+    speculative: bool = False
+
+class TokenRequest(BaseModel):
+    username: str
+    password: str
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
+
+async def require_user(credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme)) -> dict:
+    """Claims of the request's bearer access token; 401 when it is missing, invalid or expired."""
+    if not API_AUTH_ENABLED:
+        return {}
+    if credentials is None:
+        raise HTTPException(status_code=401, detail="Not authenticated", headers={"WWW-Authenticate": "Bearer"})
+    payload = verify_token_cached(credentials.credentials)
+    if payload is None:
+        raise HTTPException(status_code=401, detail="Invalid or expired token", headers={"WWW-Authenticate": "Bearer"})
+    return payload
+
+async def require_admin(user: dict = Depends(require_user)) -> dict:
+    """Claims of an admin's access token; 403 for other users."""
+    if API_AUTH_ENABLED and user.get("role") != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return user
+
+def _too_many_requests(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(status_code=429, detail=str(e),
+                         headers={"Retry-After": str(max(1, math.ceil(e.retry_after)))})
+
+def _require_model(model_name: str):
+    """503 while model_name is backing off after a failed load, instead of queueing for another attempt."""
+    retry_after = get_registry().retry_after(model_name)
+    if retry_after > 0:
+        raise HTTPException(status_code=503, detail=f"Model {model_name} failed to load; retrying later",
+                            headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+def _admit(user: dict, http_request: Request, model_name: str):
+    """Charge the request to the caller's and the model's rate limits; returns (fair-queue key, weight)."""
+    _require_model(model_name)
+    user_key = user.get("sub") or (http_request.client.host if http_request.client else "anonymous")
+    try:
+        rate_limiter.check(user_key, model_name)
+    except AdmissionRejected as e:
+        raise _too_many_requests(e)
+    return user_key, weight_for_role(user.get("role"))
+
+def _stream_slot(model_name: str, user_key: str):
+    """Reserve a stream slot on model_name for user_key; returns the callback that frees it."""
+    try:
+        stream_slots.acquire(model_name, user_key)
+    except AdmissionRejected as e:
+        raise _too_many_requests(e)
+    return lambda: stream_slots.release(model_name, user_key)
+
+def _stream_submitter(model_name: str, user_key: str, weight: float):
+    """
+    Submit function that runs a stream's decoding job through model_name's fair
+    queue, and a callback that withdraws the job if it is still queued.
+    """
+    try:
+        submit = schedulers.stream_submitter(model_name, user_key, weight)
+    except AdmissionRejected as e:
+        raise _too_many_requests(e)
+    jobs = []
+
+    def _submit(fn):
+        jobs.append(submit(fn))
+        return jobs[-1]
+    return _submit, lambda: [job.cancel() for job in jobs]
+
+def _on_stream_close(*callbacks):
+    def _close():
+        for callback in callbacks:
+            callback()
+    return _close
+
+async def _await_inference(http_request: Request, awaitable):
+    """
+    Await a queued inference, giving up when the client disconnects or INFERENCE_TIMEOUT_S passes.
+
+    Giving up cancels the request's future, so it is dropped from the queue, and a
+    batch whose callers have all gone away stops decoding.
+    """
+    task = asyncio.ensure_future(awaitable)
+    signal = StopSignal(INFERENCE_TIMEOUT_S)
+    try:
+        while True:
+            remaining = signal.remaining()
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_S if remaining is None else min(DISCONNECT_POLL_S, remaining))
+            if done:
+                return task.result()
+            if signal.expired():
+                raise HTTPException(status_code=504, detail="Inference timed out")
+            if await http_request.is_disconnected():
+                raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        task.cancel()
+
+async def _sse_stream(events, signal: StopSignal, on_close=None):
+    """
+    Serve blocking SSE events from a worker thread.
+
+    However the stream ends, including a client disconnect, decoding is told to
+    stop and on_close runs.
+    """
+    try:
+        async for event in iterate_in_threadpool(events):
+            yield event
+    finally:
+        signal.set()
+        if on_close is not None:
+            on_close()
 
 @app.on_event("startup")
 async def startup_event():
     print("Starting up model server...")
-    # Pre-load models on startup
-    load_models()
+    if API_AUTH_ENABLED and not SECRET_KEY_FROM_ENV:
+        print("WARNING: JWT_SECRET_KEY is not set; tokens are signed with a random key and stop working on restart")
+    # Only WARMUP_MODELS are loaded up front, in the background so /healthz and
+    # /readyz answer meanwhile; the rest load on first use
+    readiness.start(executors.submit)
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness: the server process is up and its event loop responds."""
+    return {"status": "ok"}
+
+@app.get("/readyz")
+async def readyz():
+    """Readiness: 200 once warmup has finished and every WARMUP_MODELS entry is loaded, 503 (with progress) otherwise."""
+    report = readiness.snapshot()
+    return JSONResponse(report, status_code=200 if report['ready'] else 503)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await schedulers.close()
+    executors.shutdown()
+    unload_all_models()
+
+def _cache_key(task, model_name, text, variant, base_params, deterministic):
+    """Return the response cache key for a request, or None if it is not cacheable."""
+    if not deterministic:
+        return None
+    return make_cache_key(task, model_name, text, variant, decoding_params(base_params, deterministic))
+
+def _is_cacheable(result) -> bool:
+    return isinstance(result, str) and bool(result) and not result.startswith("Error")
+
+@app.post("/auth/token")
+def login_for_tokens(request: TokenRequest):
+    res = verify_user_password(request.username, request.password)
+    if not res['success']:
+        if 'retry_after' in res:
+            raise HTTPException(status_code=429, detail=res['error'],
+                                headers={"Retry-After": str(max(1, math.ceil(res['retry_after'])))})
+        raise HTTPException(status_code=401, detail="Invalid username or password")
+    return {**issue_tokens(res['user_id'], res['role']), "user_id": res['user_id'], "role": res['role']}
+
+@app.post("/auth/refresh")
+def refresh_tokens(request: RefreshRequest):
+    payload = verify_token(request.refresh_token, "refresh")
+    # Re-read the user so deleted accounts and role changes take effect on refresh
+    user = get_user_by_id(payload.get("sub", "")) if payload else None
+    if user is None:
+        raise HTTPException(status_code=401, detail="Invalid or expired refresh token")
+    role = user.get('role', 'user')
+    return {**issue_tokens(user['user_id'], role), "user_id": user['user_id'], "role": role}
 
 @app.post("/generate")
-async def generate(request: CodeRequest):
+async def generate(request: CodeRequest, http_request: Request, user: dict = Depends(require_user)):
+    user_key, weight = _admit(user, http_request, request.model)
+    loop = asyncio.get_running_loop()
+    key = _cache_key('generate', request.model, request.prompt, request.language, GENERATION_PARAMS,
+                     request.deterministic or request.speculative)
+    if key and not request.bypass_cache:
+        cached = response_cache.get(key)
+        if cached is not None:
+            return {"code": cached, "cached": True}
+    vector = await loop.run_in_executor(None, semantic_cache.embed, request.prompt)
+    if not request.bypass_cache:
+        hit = semantic_cache.lookup('generate', request.model, request.language, vector)
+        if hit is not None:
+            return {"code": hit[0], "cached": True, "similarity": round(hit[1], 4)}
     try:
-        result = generate_code(request.prompt, request.language, request.model)
-        return {"code": result}
+        result = await _await_inference(http_request, schedulers.submit(
+            'generate', request.model, (request.prompt, request.language),
+            user_key=user_key, weight=weight, deterministic=request.deterministic, speculative=request.speculative))
+    except AdmissionRejected as e:
+        raise _too_many_requests(e)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if _is_cacheable(result):
+        if key:
+            response_cache.set(key, result)
+        semantic_cache.add('generate', request.model, request.language, vector, result)
+    return {"code": result}
 
 @app.post("/explain")
-async def explain(request: ExplainRequest):
+async def explain(request: ExplainRequest, http_request: Request, user: dict = Depends(require_user)):
+    user_key, weight = _admit(user, http_request, request.model)
+    key = _cache_key('explain', request.model, request.code, request.style, EXPLANATION_PARAMS,
+                     request.deterministic or request.speculative)
+    cached = response_cache.get(key) if key and not request.bypass_cache else None
+    if cached is not None:
+        return {"explanation": cached, "cached": True}
     try:
-        result = explain_code(request.code, request.style, request.model)
-        return {"explanation": result}
+        result = await _await_inference(http_request, schedulers.submit(
+            'explain', request.model, (request.code, request.style),
+            user_key=user_key, weight=weight, deterministic=request.deterministic, speculative=request.speculative))
+    except AdmissionRejected as e:
+        raise _too_many_requests(e)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    if key and _is_cacheable(result):
+        response_cache.set(key, result)
+    return {"explanation": result}
+
+def _sse_events(chunks):
+    """
+    Wrap text chunks as server-sent events.
+
+    A complete stream ends with a 'done' event; a failed one ends with an 'error'
+    event instead, so clients can tell the two apart.
+    """
+    try:
+        for chunk in chunks:
+            yield f"data: {json.dumps({'token': chunk})}\n\n"
+    except Exception as e:
+        yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+        return
+    yield "event: done\ndata: {}\n\n"
+
+def _cached_chunks(key, make_chunks, bypass_cache=False, semantic=None):
+    """
+    Serve a stream from the caches, or record it there once it completes.
+
+    semantic is an optional (task, model, variant, text) tuple enabling the
+    semantic tier for this stream.
+    """
+    if key and not bypass_cache:
+        cached = response_cache.get(key)
+        if cached is not None:
+            yield cached
+            return
+    vector = semantic_cache.embed(semantic[3]) if semantic else None
+    if vector is not None and not bypass_cache:
+        hit = semantic_cache.lookup(semantic[0], semantic[1], semantic[2], vector)
+        if hit is not None:
+            yield hit[0]
+            return
+    parts = []
+    for chunk in make_chunks():
+        parts.append(chunk)
+        yield chunk
+    result = "".join(parts).strip()
+    if _is_cacheable(result):
+        if key:
+            response_cache.set(key, result)
+        if vector is not None:
+            semantic_cache.add(semantic[0], semantic[1], semantic[2], vector, result)
+
+@app.post("/generate/stream")
+async def generate_stream(request: CodeRequest, http_request: Request, user: dict = Depends(require_user)):
+    user_key, weight = _admit(user, http_request, request.model)
+    submit, withdraw = _stream_submitter(request.model, user_key, weight)
+    release = _on_stream_close(withdraw, _stream_slot(request.model, user_key))
+    key = _cache_key('generate', request.model, request.prompt, request.language, GENERATION_PARAMS,
+                     request.deterministic or request.speculative)
+    signal = StopSignal(STREAM_TIMEOUT_S)
+    chunks = _cached_chunks(key, lambda: stream_generate_code(
+        request.prompt, request.language, request.model, request.deterministic,
+        submit, signal, signal.remaining(), request.speculative),
+        request.bypass_cache, ('generate', request.model, request.language, request.prompt))
+    return StreamingResponse(_sse_stream(_sse_events(chunks), signal, release), media_type="text/event-stream")
+
+@app.post("/explain/stream")
+async def explain_stream(request: ExplainRequest, http_request: Request, user: dict = Depends(require_user)):
+    user_key, weight = _admit(user, http_request, request.model)
+    submit, withdraw = _stream_submitter(request.model, user_key, weight)
+    release = _on_stream_close(withdraw, _stream_slot(request.model, user_key))
+    key = _cache_key('explain', request.model, request.code, request.style, EXPLANATION_PARAMS,
+                     request.deterministic or request.speculative)
+    signal = StopSignal(STREAM_TIMEOUT_S)
+    chunks = _cached_chunks(key, lambda: stream_explain_code(
+        request.code, request.style, request.model, request.deterministic,
+        submit, signal, signal.remaining(), request.speculative),
+        request.bypass_cache)
+    return StreamingResponse(_sse_stream(_sse_events(chunks), signal, release), media_type="text/event-stream")
+
+@app.get("/cache/stats")
+async def cache_stats(admin: dict = Depends(require_admin)):
+    return {"exact": response_cache.stats(), "semantic": semantic_cache.stats(), "prefix": get_prefix_cache().stats()}
+
+@app.post("/cache/clear")
+async def cache_clear(admin: dict = Depends(require_admin)):
+    response_cache.clear()
+    semantic_cache.clear()
+    get_prefix_cache().clear()
+    return {"success": True, "message": "Response cache cleared."}
+
+@app.get("/models")
+async def list_models(admin: dict = Depends(require_admin)):
+    return get_registry().stats()
+
+@app.post("/models/{name}/load")
+def load_model(name: str, admin: dict = Depends(require_admin)):
+    if not warmup_models([name]).get(name):
+        raise HTTPException(status_code=404, detail=f"Model {name} could not be loaded")
+    return {"success": True, "message": f"Model {name} loaded."}
+
+@app.post("/models/{name}/unload")
+async def unload(name: str, admin: dict = Depends(require_admin)):
+    if not unload_model(name):
+        raise HTTPException(status_code=404, detail=f"Model {name} is not loaded")
+    return {"success": True, "message": f"Model {name} unloaded."}
+
+@app.post("/models/{name}/pin")
+def pin_model(name: str, admin: dict = Depends(require_admin)):
+    if not get_registry().pin(name):
+        raise HTTPException(status_code=404, detail=f"Model {name} could not be pinned")
+    return {"success": True, "message": f"Model {name} pinned."}
+
+@app.post("/models/{name}/unpin")
+async def unpin_model(name: str, admin: dict = Depends(require_admin)):
+    if not get_registry().unpin(name):
+        raise HTTPException(status_code=404, detail=f"Model {name} is not pinned")
+    return {"success": True, "message": f"Model {name} unpinned."}
+
+@app.get("/metrics")
+async def metrics(admin: dict = Depends(require_admin)):
+    return {
+        "batching": schedulers.metrics(),
+        "inference": executors.stats(),
+        "speculative": speculative_stats.stats(),
+        "models": get_registry().stats(),
+        "response_cache": response_cache.stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "auth": {"enabled": API_AUTH_ENABLED, "token_cache": token_cache.stats()},
+        "admission": {"rate_limits": rate_limiter.stats(), "streams": stream_slots.stats()}
+    }
 
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
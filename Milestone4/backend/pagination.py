@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""Pagination Module
+
+Opaque cursors and keyset pagination over event logs.
+
+A page is ``{'items': [...], 'next_cursor': str or None}``. The cursor records
+the sort key of the last item returned, so fetching the next page costs the same
+whatever the page number. Pass ``next_cursor`` back unchanged to continue.
+"""
+
+import json
+import base64
+import binascii
+from typing import Any, Callable, Dict, Optional
+
+# Largest page a caller may ask for
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(data: Dict[str, Any]) -> str:
+    payload = json.dumps(data, separators=(',', ':'), sort_keys=True).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    """Decode a cursor produced by encode_cursor; raises ValueError when it is malformed."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (binascii.Error, UnicodeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if not isinstance(data, dict):
+        raise ValueError("Invalid cursor")
+    return data
+
+
+def clamp_limit(limit: int) -> int:
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+
+def position_cursor(position, newest_first: bool) -> str:
+    """Cursor that continues after a log position."""
+    return encode_cursor({'o': 'desc' if newest_first else 'asc', 'p': list(position)})
+
+
+def cursor_position(cursor: Optional[str], newest_first: bool):
+    """The log position stored in a position cursor (None for the first page)."""
+    if not cursor:
+        return None
+    data = decode_cursor(cursor)
+    if data.get('o') != ('desc' if newest_first else 'asc') or not isinstance(data.get('p'), list) or len(data['p']) != 2:
+        raise ValueError("Cursor does not match this listing")
+    return tuple(data['p'])
+
+
+def page_event_log(log, limit: int = 50, cursor: Optional[str] = None, newest_first: bool = True,
+                   predicate: Optional[Callable[[Dict[str, Any]], bool]] = None) -> Dict[str, Any]:
+    """
+    One page of an event log in append order (newest first by default).
+
+    Args:
+        log: An EventLog.
+        limit: Page size.
+        cursor: ``next_cursor`` from the previous page, or None for the first page.
+        newest_first: Sort direction; a cursor only continues in the direction it was made for.
+        predicate: Optional entry filter. Filtered pages scan until they fill up.
+    """
+    limit = clamp_limit(limit)
+    position = cursor_position(cursor, newest_first)
+
+    entries = log.iter_with_positions(reverse=newest_first,
+                                      before=position if newest_first else None,
+                                      after=None if newest_first else position)
+    items = []
+    last = None
+    next_cursor = None
+    for entry_position, entry in entries:
+        if predicate is not None and not predicate(entry):
+            continue
+        if len(items) == limit:
+            next_cursor = position_cursor(last, newest_first)
+            break
+        items.append(entry)
+        last = entry_position
+    return {'items': items, 'next_cursor': next_cursor}
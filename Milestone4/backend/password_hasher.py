@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""Password Hasher Module
+
+PBKDF2 hashing and verification off the caller's thread.
+
+Hashes run on a small bounded worker pool. When every worker is busy and the
+wait queue is full, callers get a "busy" answer right away instead of piling up.
+Each identity (username or user id) may have one verification in flight. Repeated
+failures lock that identity out for a while, and no hashing is done during the
+lockout. Recently verified credentials are remembered for a short TTL, so
+re-authenticating the same session does not pay for PBKDF2 again.
+
+The iteration count is configurable. Every hash records the count it was made
+with, so changing PBKDF2_ITERATIONS does not invalidate existing passwords.
+"""
+
+import os
+import hmac
+import time
+import hashlib
+import binascii
+import logging
+import threading
+from collections import OrderedDict, deque
+from concurrent import futures
+from typing import Any, Deque, Dict, Optional
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Password hashing knobs (Load from env in production)
+PBKDF2_ITERATIONS = int(os.environ.get("PBKDF2_ITERATIONS", 100_000))
+# Count used by hashes stored before iterations were recorded per user
+LEGACY_PBKDF2_ITERATIONS = 100_000
+PBKDF2_WORKERS = int(os.environ.get("PBKDF2_WORKERS", min(4, os.cpu_count() or 1)))
+# Hashes allowed to wait for a worker before new requests are turned away
+PBKDF2_QUEUE_LIMIT = int(os.environ.get("PBKDF2_QUEUE_LIMIT", 32))
+PBKDF2_TIMEOUT_S = float(os.environ.get("PBKDF2_TIMEOUT_S", 10))
+# Failed logins per identity within the window before it is locked out
+LOGIN_MAX_FAILURES = int(os.environ.get("LOGIN_MAX_FAILURES", 5))
+LOGIN_FAILURE_WINDOW_S = float(os.environ.get("LOGIN_FAILURE_WINDOW_S", 300))
+LOGIN_LOCKOUT_S = float(os.environ.get("LOGIN_LOCKOUT_S", 60))
+# Verified-credential cache (0 disables it)
+LOGIN_CACHE_TTL_S = float(os.environ.get("LOGIN_CACHE_TTL_S", 300))
+LOGIN_CACHE_SIZE = int(os.environ.get("LOGIN_CACHE_SIZE", 1024))
+
+
+class HasherBusy(Exception):
+    """Raised when the worker pool is saturated or a hash took too long."""
+
+
+class LoginThrottled(Exception):
+    """Raised when an identity is locked out or already has a login in flight."""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _pbkdf2(password: str, salt: bytes, iterations: int) -> bytes:
+    return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+
+
+class PasswordHasher:
+    """Bounded PBKDF2 worker pool with per-identity throttling and a verified-credential cache."""
+
+    def __init__(self, workers: int = PBKDF2_WORKERS, queue_limit: int = PBKDF2_QUEUE_LIMIT,
+                 iterations: int = PBKDF2_ITERATIONS):
+        self.workers = max(1, workers)
+        self.iterations = max(1, iterations)
+        self._executor = futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pbkdf2")
+        self._slots = threading.BoundedSemaphore(self.workers + max(0, queue_limit))
+        self._lock = threading.Lock()
+        self._in_flight: set = set()
+        self._failures: Dict[str, Deque[float]] = {}
+        self._locked_until: Dict[str, float] = {}
+        # Cache keys are HMACs under a per-process secret, never the password itself
+        self._cache_secret = os.urandom(32)
+        self._cache: "OrderedDict[bytes, float]" = OrderedDict()
+        self.hashes = 0
+        self.hash_time = 0.0
+        self.rejected = 0
+        self.throttled = 0
+        self.cache_hits = 0
+
+    # --- Hashing ---
+
+    def _run(self, password: str, salt: bytes, iterations: int) -> bytes:
+        if not self._slots.acquire(timeout=0.05):
+            with self._lock:
+                self.rejected += 1
+            raise HasherBusy("Too many logins in progress, please try again")
+        start = time.perf_counter()
+        try:
+            future = self._executor.submit(_pbkdf2, password, salt, iterations)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            digest = future.result(timeout=PBKDF2_TIMEOUT_S)
+        except futures.TimeoutError:
+            raise HasherBusy("Password check timed out, please try again")
+        with self._lock:
+            self.hashes += 1
+            self.hash_time += time.perf_counter() - start
+        return digest
+
+    def hash_password(self, password: str, salt: Optional[bytes] = None,
+                      iterations: Optional[int] = None) -> Dict[str, Any]:
+        """Return {'salt', 'hash', 'iterations'} with hex salt and hash."""
+        if salt is None:
+            salt = os.urandom(16)
+        iterations = iterations or self.iterations
+        digest = self._run(password, salt, iterations)
+        return {'salt': binascii.hexlify(salt).decode('ascii'),
+                'hash': binascii.hexlify(digest).decode('ascii'),
+                'iterations': iterations}
+
+    def _cache_key(self, identity: str, salt_hex: str, hash_hex: str, password: str) -> bytes:
+        message = '\0'.join((identity, salt_hex, hash_hex, password)).encode('utf-8')
+        return hmac.new(self._cache_secret, message, hashlib.sha256).digest()
+
+    def verify(self, identity: str, password: str, salt_hex: str, hash_hex: str,
+               iterations: Optional[int] = None) -> bool:
+        """
+        Check password against a stored salt/hash for identity.
+
+        Raises LoginThrottled while identity is locked out or already being
+        verified, and HasherBusy when the pool cannot take the work.
+        """
+        identity = identity.casefold()
+        now = time.monotonic()
+        with self._lock:
+            retry_after = self._locked_until.get(identity, 0.0) - now
+            if retry_after > 0:
+                self.throttled += 1
+                raise LoginThrottled(f"Too many failed attempts, try again in {int(retry_after) + 1}s", retry_after)
+            if identity in self._in_flight:
+                self.throttled += 1
+                raise LoginThrottled("A login for this account is already in progress", 1.0)
+            self._in_flight.add(identity)
+
+        try:
+            key = self._cache_key(identity, salt_hex, hash_hex, password) if LOGIN_CACHE_TTL_S > 0 else None
+            if key is not None:
+                with self._lock:
+                    expires = self._cache.get(key)
+                    if expires is not None and expires > now:
+                        self.cache_hits += 1
+                        return True
+
+            salt = binascii.unhexlify(salt_hex.encode('ascii'))
+            attempt = self._run(password, salt, iterations or LEGACY_PBKDF2_ITERATIONS)
+            ok = hmac.compare_digest(binascii.hexlify(attempt).decode('ascii'), hash_hex)
+            self._record(identity, ok, key)
+            return ok
+        finally:
+            with self._lock:
+                self._in_flight.discard(identity)
+
+    def _record(self, identity: str, ok: bool, key: Optional[bytes]) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if ok:
+                self._failures.pop(identity, None)
+                self._locked_until.pop(identity, None)
+                if key is not None:
+                    self._cache[key] = now + LOGIN_CACHE_TTL_S
+                    self._cache.move_to_end(key)
+                    while len(self._cache) > LOGIN_CACHE_SIZE:
+                        self._cache.popitem(last=False)
+                return
+            failures = self._failures.setdefault(identity, deque())
+            failures.append(now)
+            while failures and failures[0] < now - LOGIN_FAILURE_WINDOW_S:
+                failures.popleft()
+            if len(failures) >= LOGIN_MAX_FAILURES:
+                failures.clear()
+                self._locked_until[identity] = now + LOGIN_LOCKOUT_S
+                logger.warning(f"Login for '{identity}' locked for {LOGIN_LOCKOUT_S:.0f}s after repeated failures")
+
+    def forget(self, identity: str) -> None:
+        """Drop throttling state for identity (e.g. after a password reset)."""
+        with self._lock:
+            self._failures.pop(identity.casefold(), None)
+            self._locked_until.pop(identity.casefold(), None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'iterations': self.iterations,
+                'workers': self.workers,
+                'hashes': self.hashes,
+                'avg_hash_ms': round(1000 * self.hash_time / self.hashes, 2) if self.hashes else 0.0,
+                'rejected_busy': self.rejected,
+                'throttled': self.throttled,
+                'cache_hits': self.cache_hits,
+                'locked_identities': sum(1 for t in self._locked_until.values() if t > time.monotonic())
+            }
+
+
+_hasher: Optional[PasswordHasher] = None
+_hasher_lock = threading.Lock()
+
+
+def get_password_hasher() -> PasswordHasher:
+    """Return the process-wide password hasher, starting its pool on first use."""
+    global _hasher
+    if _hasher is None:
+        with _hasher_lock:
+            if _hasher is None:
+                _hasher = PasswordHasher()
+    return _hasher
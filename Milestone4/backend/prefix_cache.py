@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""Prefix Cache Module
+
+Reuses the attention key/value cache of fixed prompt prefixes.
+
+Every prompt for a given model and language (or explanation style) starts with
+the same template text: the chat-template scaffolding and the instruction, e.g.
+"Write python code for:". The past_key_values of that prefix are computed once,
+kept in a bounded LRU, and a copy is handed to ``model.generate`` so prefill
+only runs over the request-specific suffix.
+
+A cached prefix is only used when the full prompt tokenizes to the same leading
+token ids, so the output never changes because of the cache. The last token of
+the prefix is left out of the cached ids because it may merge with the text
+that follows it.
+"""
+
+import os
+import copy
+import time
+import weakref
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import torch
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Prefix cache configuration (Load from env in production)
+PREFIX_CACHE_ENABLED = os.environ.get("PREFIX_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+PREFIX_CACHE_SIZE = int(os.environ.get("PREFIX_CACHE_SIZE", 64))
+# Prefixes shorter than this many tokens are not worth caching
+PREFIX_CACHE_MIN_TOKENS = int(os.environ.get("PREFIX_CACHE_MIN_TOKENS", 4))
+
+# Replaces the user text when a prompt template is formatted to find its prefix
+PROMPT_SENTINEL = "\x00CODEGENIE_PROMPT\x00"
+
+
+def template_prefix(format_prompt, tokenizer, model_name: str, variant: str) -> str:
+    """
+    Return the fixed text a formatted prompt starts with for (model, variant).
+
+    ``format_prompt(tokenizer, text, variant, model_name)`` is one of the prompt
+    builders, e.g. format_generation_prompt.
+    """
+    formatted = format_prompt(tokenizer, PROMPT_SENTINEL, variant, model_name)
+    index = formatted.find(PROMPT_SENTINEL)
+    return formatted[:index] if index > 0 else ""
+
+
+class PrefixCache:
+    """
+    Bounded LRU of prefix past_key_values, keyed by (model, prefix text).
+
+    Entries hold a weak reference to their model, so a model unloaded by the
+    registry never has its cache applied to a model loaded in its place.
+    """
+
+    def __init__(self, max_entries: int = PREFIX_CACHE_SIZE, enabled: bool = PREFIX_CACHE_ENABLED,
+                 min_tokens: int = PREFIX_CACHE_MIN_TOKENS):
+        self.max_entries = max(1, max_entries)
+        self.enabled = enabled
+        self.min_tokens = max(1, min_tokens)
+        self.lock = threading.Lock()
+        # (id(model), prefix) -> {'model': weakref, 'ids': [...], 'cache': past_key_values}
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.builds = 0
+        self.evictions = 0
+        self.tokens_reused = 0
+        self._build_time_s = 0.0
+
+    def _get(self, model, prefix: str) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            key = (id(model), prefix)
+            entry = self._entries.get(key)
+            if entry is not None and entry['model']() is not model:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _build(self, model, tokenizer, prefix: str) -> Dict[str, Any]:
+        start = time.perf_counter()
+        ids = tokenizer(prefix, return_tensors="pt").input_ids[:, :-1]
+        entry = {'model': weakref.ref(model), 'ids': ids[0].tolist(), 'cache': None}
+        if ids.shape[1] >= self.min_tokens:
+            with torch.no_grad():
+                entry['cache'] = model(input_ids=ids.to(model.device), use_cache=True).past_key_values
+        with self.lock:
+            self._entries[(id(model), prefix)] = entry
+            self.builds += 1
+            self._build_time_s += time.perf_counter() - start
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return entry
+
+    def past_key_values(self, model, tokenizer, prefix: Optional[str], input_ids: torch.Tensor):
+        """
+        Return a private copy of the cached past_key_values for a single prompt.
+
+        Returns None (plain prefill) when caching is off, the prefix is too short,
+        or ``input_ids`` does not start with the prefix tokens.
+        """
+        if not self.enabled or not prefix or input_ids.shape[0] != 1:
+            return None
+        try:
+            entry = self._get(model, prefix) or self._build(model, tokenizer, prefix)
+        except Exception as e:
+            logger.warning(f"Could not compute prefix cache: {e}")
+            return None
+        length = len(entry['ids'])
+        if entry['cache'] is None or input_ids.shape[1] <= length or input_ids[0, :length].tolist() != entry['ids']:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+            self.tokens_reused += length
+        # generate() appends to the cache it is given
+        return copy.deepcopy(entry['cache'])
+
+    def clear(self) -> None:
+        with self.lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'tokens_reused': self.tokens_reused,
+                'builds': self.builds,
+                'avg_build_ms': round(self._build_time_s * 1000 / self.builds, 2) if self.builds else 0.0,
+                'evictions': self.evictions
+            }
+
+
+_prefix_cache: Optional[PrefixCache] = None
+_prefix_cache_lock = threading.Lock()
+
+
+def get_prefix_cache() -> PrefixCache:
+    """Return the process-wide prefix cache."""
+    global _prefix_cache
+    if _prefix_cache is None:
+        with _prefix_cache_lock:
+            if _prefix_cache is None:
+                _prefix_cache = PrefixCache()
+    return _prefix_cache
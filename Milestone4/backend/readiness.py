@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""Readiness Module
+
+Background warmup for the model server and the state behind /readyz.
+
+When the server starts, a background thread loads each WARMUP_MODELS entry and
+then runs a short greedy generation and explanation with it. The warmup runs on
+the model's own inference executor, so the thread that serves the first real
+request has already initialized its kernels and built the prefix cache entries
+for the default language and style. Helper components (e.g. the semantic cache
+encoder) are loaded first.
+
+The server reports ready once every warmup step has finished and while every
+warmed model is still loaded. A warmed model that was evicted later (memory
+budget, idle timeout, /models/{name}/unload) makes the server not ready until a
+background reload has warmed it again. A model that failed to load does not keep
+the server out of rotation; requests for it get a quick 503 until
+MODEL_LOAD_RETRY_S has passed, then it is retried on use. The status is then
+"degraded".
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from .model_loader import MODELS_CONFIG, get_model, get_registry
+from .generation_utils import generate_batch
+from .code_generator_module import format_generation_prompt
+from .code_explainer_module import format_explanation_prompt
+from .prefix_cache import template_prefix
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Warmup knobs (Load from env in production)
+WARMUP_MAX_NEW_TOKENS = int(os.environ.get("WARMUP_MAX_NEW_TOKENS", 4))
+
+# Representative requests; the variants match the UI defaults so their prefixes get cached
+WARMUP_REQUESTS = [
+    ('generate', format_generation_prompt, "print hello world", "Python"),
+    ('explain', format_explanation_prompt, "print('hello world')", "Beginner-Friendly"),
+]
+
+
+def warm_model(name: str) -> Dict[str, float]:
+    """Run the warmup requests on a loaded model and return their durations."""
+    model, tokenizer = get_model(name)
+    if not model or not tokenizer:
+        raise RuntimeError("Model not loaded")
+    timings = {}
+    for task, format_prompt, text, variant in WARMUP_REQUESTS:
+        start = time.perf_counter()
+        prompt = format_prompt(tokenizer, text, variant, name)
+        generate_batch(model, tokenizer, [prompt], None, template_prefix(format_prompt, tokenizer, name, variant),
+                       max_new_tokens=WARMUP_MAX_NEW_TOKENS, do_sample=False)
+        timings[f'{task}_s'] = round(time.perf_counter() - start, 3)
+    return timings
+
+
+class Readiness:
+    """Warmup progress of the components and models the server needs before taking traffic."""
+
+    def __init__(self, models: List[str], components: Optional[Dict[str, Callable[[], Any]]] = None):
+        self.models = list(models)
+        self.components = dict(components or {})
+        self.lock = threading.Lock()
+        # step name -> {'state': pending|loading|warming|ready|failed, ...timings or error}
+        self._steps: Dict[str, Dict[str, Any]] = {name: {'state': 'pending'} for name in list(self.components) + self.models}
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+        self._submit: Optional[Callable[..., Any]] = None
+        self._reload_thread: Optional[threading.Thread] = None
+
+    def _set(self, name: str, state: str, **info) -> None:
+        with self.lock:
+            self._steps[name] = {**self._steps.get(name, {}), 'state': state, **info}
+
+    def start(self, submit: Callable[..., Any]) -> None:
+        """
+        Warm up in a background thread.
+
+        ``submit(model_name, fn, *args)`` runs fn on the model's inference executor
+        and returns a concurrent.futures.Future (InferenceExecutors.submit).
+        """
+        if self._thread is None:
+            self._submit = submit
+            self._thread = threading.Thread(target=self._run, args=(submit,), name="warmup", daemon=True)
+            self._thread.start()
+
+    def _warm_models(self, names: List[str], submit) -> None:
+        for name in names:
+            self._set(name, 'loading')
+            start = time.perf_counter()
+            try:
+                model, _ = get_model(name)
+                if model is None:
+                    raise RuntimeError("Model could not be loaded")
+                self._set(name, 'warming', load_s=round(time.perf_counter() - start, 3))
+                timings = submit(name, warm_model, name).result()
+                self._set(name, 'ready', warmup=timings)
+                logger.info(f"{name} is warm ({timings})")
+            except Exception as e:
+                logger.error(f"Warmup of {name} failed: {e}")
+                self._set(name, 'failed', error=str(e))
+
+    def _reload(self, names: List[str]) -> None:
+        """Warm evicted models again in the background (at most one reload at a time)."""
+        with self.lock:
+            if self._reload_thread is not None and self._reload_thread.is_alive():
+                return
+            for name in names:
+                self._steps[name] = {**self._steps[name], 'state': 'pending'}
+            self._reload_thread = threading.Thread(target=self._warm_models, args=(names, self._submit),
+                                                   name="warmup-reload", daemon=True)
+            self._reload_thread.start()
+        logger.info(f"Reloading evicted warmup models: {names}")
+
+    def _run(self, submit) -> None:
+        for name, load in self.components.items():
+            self._set(name, 'loading')
+            start = time.perf_counter()
+            try:
+                ok = load()
+                self._set(name, 'ready' if ok is not False else 'failed', load_s=round(time.perf_counter() - start, 3))
+            except Exception as e:
+                self._set(name, 'failed', error=str(e))
+
+        self._warm_models(self.models, submit)
+
+        with self.lock:
+            self.finished_at = time.time()
+        logger.info(f"Warmup finished in {self.finished_at - self.started_at:.1f}s")
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Readiness report: overall status plus per-model loaded/warm state."""
+        loaded = get_registry().stats()['models']
+        with self.lock:
+            steps = {name: dict(step) for name, step in self._steps.items()}
+            finished = self.finished_at is not None
+            failed = [name for name, step in steps.items() if step['state'] == 'failed']
+            warmup_s = round((self.finished_at or time.time()) - self.started_at, 3)
+
+        # Warmed models that have since been evicted; a reload is started for them
+        cold = [name for name in self.models if steps[name]['state'] == 'ready' and not loaded[name]['loaded']]
+        if finished and cold and self._submit is not None:
+            self._reload(cold)
+        reloading = [name for name in self.models if steps[name]['state'] in ('pending', 'loading', 'warming')]
+
+        models = {}
+        for name in MODELS_CONFIG:
+            step = steps.get(name, {'state': 'loaded' if loaded[name]['loaded'] else 'not loaded'})
+            # An evicted model is cold again even if it was warmed up
+            models[name] = {**step, 'loaded': loaded[name]['loaded'], 'warm': step['state'] == 'ready' and loaded[name]['loaded'],
+                            'required': name in self.models}
+        ready = finished and not cold and not reloading
+        if not finished:
+            status = 'starting'
+        elif not ready:
+            status = 'reloading'
+        else:
+            status = 'degraded' if failed else 'ready'
+        return {
+            'ready': ready,
+            'status': status,
+            'warmup_s': warmup_s,
+            'components': {name: steps[name] for name in self.components},
+            'models': models
+        }
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+"""Response Cache Module
+
+Caches model answers for repeated requests so they never reach the model.
+Entries live in a bounded in-memory LRU with an optional on-disk tier.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Cache configuration (Load from env in production)
+RESPONSE_CACHE_SIZE = int(os.environ.get("RESPONSE_CACHE_SIZE", 1024))
+RESPONSE_CACHE_TTL_S = float(os.environ.get("RESPONSE_CACHE_TTL_S", 24 * 3600))
+# Directory for the on-disk tier; empty disables it
+RESPONSE_CACHE_DIR = os.environ.get("RESPONSE_CACHE_DIR", "")
+
+
+def normalize_prompt(text: str) -> str:
+    """Normalize a natural-language prompt: collapse whitespace and ignore case."""
+    return " ".join((text or "").split()).casefold()
+
+
+def normalize_code(code: str) -> str:
+    """Normalize source code without touching indentation."""
+    lines = [line.rstrip() for line in (code or "").replace("\r\n", "\n").split("\n")]
+    return "\n".join(lines).strip("\n")
+
+
+def make_cache_key(task: str, model_name: str, text: str, variant: str, params: Dict[str, Any]) -> str:
+    """
+    Build a cache key for one request.
+
+    Args:
+        task: 'generate' or 'explain'.
+        model_name: Model that answers the request.
+        text: The prompt (generate) or code (explain).
+        variant: Language (generate) or explanation style (explain).
+        params: Decoding parameters the answer was produced with.
+    """
+    normalized = normalize_prompt(text) if task == 'generate' else normalize_code(text)
+    payload = json.dumps({
+        'task': task,
+        'model': model_name,
+        'text': normalized,
+        'variant': normalize_prompt(variant),
+        'params': params
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Thread-safe LRU + TTL cache of model responses with an optional disk tier."""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_SIZE, ttl_s: float = RESPONSE_CACHE_TTL_S,
+                 disk_dir: str = RESPONSE_CACHE_DIR):
+        self.max_entries = max(1, max_entries)
+        self.ttl_s = ttl_s
+        self.disk_dir = disk_dir
+        self.lock = threading.Lock()
+        # key -> (value, expires_at), oldest first
+        self._memory = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.evictions = 0
+        self.expirations = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    def _expires_at(self) -> float:
+        return time.time() + self.ttl_s if self.ttl_s else float('inf')
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._disk_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.warning(f"Dropping unreadable cache file {path}: {e}")
+            entry = None
+        if entry is None or (entry.get('expires_at') and entry['expires_at'] < time.time()):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry
+
+    def _write_disk(self, key: str, value: str, expires_at: float) -> None:
+        path = self._disk_path(key)
+        tmp_path = f"{path}.tmp.{threading.get_ident()}"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'value': value, 'expires_at': None if expires_at == float('inf') else expires_at}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write cache file {path}: {e}")
+
+    def _store(self, key: str, value: str, expires_at: float) -> None:
+        self._memory[key] = (value, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached value for key, or None."""
+        with self.lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at >= time.time():
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._memory[key]
+                self.expirations += 1
+
+        if self.disk_dir:
+            disk_entry = self._read_disk(key)
+            if disk_entry is not None:
+                expires_at = disk_entry.get('expires_at') or float('inf')
+                with self.lock:
+                    self._store(key, disk_entry['value'], expires_at)
+                    self.hits += 1
+                    self.disk_hits += 1
+                return disk_entry['value']
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, value: str) -> None:
+        expires_at = self._expires_at()
+        with self.lock:
+            self._store(key, value, expires_at)
+            self.sets += 1
+        if self.disk_dir:
+            self._write_disk(key, value, expires_at)
+
+    def clear(self) -> None:
+        with self.lock:
+            self._memory.clear()
+        if self.disk_dir:
+            for name in os.listdir(self.disk_dir):
+                if name.endswith('.json'):
+                    try:
+                        os.remove(os.path.join(self.disk_dir, name))
+                    except OSError:
+                        pass
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._memory),
+                'max_entries': self.max_entries,
+                'ttl_s': self.ttl_s,
+                'disk_tier': bool(self.disk_dir),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'sets': self.sets,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+"""Search Index Module
+
+Inverted full-text index over the history and feedback logs for admin search.
+
+Text is split into lower-cased word tokens. Every indexed entry becomes a
+document that holds only its log position. Postings are compact arrays of
+(document, weighted term frequency). Matching entries are read back from the log
+only for the page being returned. The index is a materialized view, so it
+updates as events are logged and is saved to a snapshot between restarts.
+
+Query syntax (all clauses must match):
+    word        documents containing the token
+    word*       tokens starting with "word"
+    "a phrase"  the exact phrase (case/whitespace-insensitive)
+The last bare word of a query is treated as a prefix so search-as-you-type works.
+"""
+
+import os
+import re
+import math
+import bisect
+import logging
+from array import array
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .jsonl_store import Position
+from .materialized_views import MaterializedView, decode_array, encode_array, get_view
+from .storage import open_event_log
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Search index knobs (Load from env in production)
+SEARCH_INDEX_SNAPSHOT_INTERVAL_S = float(os.environ.get("SEARCH_INDEX_SNAPSHOT_INTERVAL_S", 300))
+# Most vocabulary terms a single prefix clause may expand to
+SEARCH_MAX_PREFIX_TERMS = int(os.environ.get("SEARCH_MAX_PREFIX_TERMS", 256))
+# Most candidates checked against the log text for a phrase query
+SEARCH_MAX_PHRASE_CHECKS = int(os.environ.get("SEARCH_MAX_PHRASE_CHECKS", 5000))
+
+# Indexed fields per log and their weight in ranking
+INDEXED_FIELDS = {
+    'user_history': {'query': 3, 'generated_code': 1},
+    'feedback_log': {'comments': 2, 'query': 2}
+}
+
+# BM25 parameters
+_K1 = 1.2
+_B = 0.75
+
+_TOKEN_RE = re.compile(r"[^\W_]+", re.UNICODE)
+_CLAUSE_RE = re.compile(r'"([^"]*)"?|(\S+)')
+
+
+def tokenize(text: Any) -> List[str]:
+    """Split text into lower-cased word tokens (underscores and punctuation separate words)."""
+    return _TOKEN_RE.findall(str(text or '').casefold())
+
+
+def _normalize_text(text: Any) -> str:
+    return " ".join(str(text or '').casefold().split())
+
+
+def parse_query(query: str) -> List[Tuple[str, Any]]:
+    """
+    Parse a query into clauses: ('term', token), ('prefix', token) or ('phrase', (text, tokens)).
+    """
+    clauses: List[Tuple[str, Any]] = []
+    raw = (query or '').strip()
+    for match in _CLAUSE_RE.finditer(raw):
+        phrase, word = match.group(1), match.group(2)
+        if phrase is not None:
+            tokens = tokenize(phrase)
+            if len(tokens) > 1:
+                clauses.append(('phrase', (_normalize_text(phrase), tokens)))
+            elif tokens:
+                clauses.append(('term', tokens[0]))
+            continue
+        is_prefix = word.endswith('*')
+        tokens = tokenize(word)
+        for i, token in enumerate(tokens):
+            last = i == len(tokens) - 1
+            clauses.append(('prefix' if is_prefix and last else 'term', token))
+    # Search-as-you-type: the final bare word may still be incomplete
+    if clauses and clauses[-1][0] == 'term' and not raw.endswith((' ', '"')):
+        clauses[-1] = ('prefix', clauses[-1][1])
+    return clauses
+
+
+class SearchIndex(MaterializedView):
+    """Inverted index over INDEXED_FIELDS of the history and feedback logs."""
+
+    version = 1
+    snapshot_interval_s = SEARCH_INDEX_SNAPSHOT_INTERVAL_S
+
+    def __init__(self, fields: Optional[Dict[str, Dict[str, int]]] = None):
+        self.fields = fields or INDEXED_FIELDS
+        self.kinds = list(self.fields)
+        self._vocabulary: Optional[List[str]] = None
+        super().__init__('search_index', self.kinds)
+
+    def initial_state(self) -> Dict[str, Any]:
+        return {
+            # Per document: log (index into self.kinds), position and weighted length
+            'doc_log': array('B'),
+            'doc_segment': array('q'),
+            'doc_offset': array('q'),
+            'doc_length': array('I'),
+            'total_length': 0,
+            # term -> (document ids, weighted term frequencies), ids ascending
+            'postings': {}
+        }
+
+    def apply(self, state: Dict[str, Any], log_name: str, position: Position, entry: Dict[str, Any]) -> None:
+        counts: Dict[str, int] = {}
+        for field, weight in self.fields.get(log_name, {}).items():
+            for token in tokenize(entry.get(field)):
+                counts[token] = counts.get(token, 0) + weight
+        doc_id = len(state['doc_log'])
+        length = sum(counts.values())
+        state['doc_log'].append(self.kinds.index(log_name))
+        state['doc_segment'].append(position[0])
+        state['doc_offset'].append(position[1])
+        state['doc_length'].append(length)
+        state['total_length'] += length
+        postings = state['postings']
+        for token, tf in counts.items():
+            if token not in postings:
+                postings[token] = (array('I'), array('H'))
+                if state is self.state:
+                    self._vocabulary = None
+            ids, tfs = postings[token]
+            ids.append(doc_id)
+            tfs.append(min(tf, 0xFFFF))
+
+    def rebuild(self) -> None:
+        super().rebuild()
+        with self.lock:
+            self._vocabulary = None
+
+    def encode_state(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'doc_log': encode_array(state['doc_log']),
+            'doc_segment': encode_array(state['doc_segment']),
+            'doc_offset': encode_array(state['doc_offset']),
+            'doc_length': encode_array(state['doc_length']),
+            'total_length': state['total_length'],
+            'postings': {term: [encode_array(ids), encode_array(tfs)] for term, (ids, tfs) in state['postings'].items()}
+        }
+
+    def decode_state(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'doc_log': decode_array('B', data['doc_log']),
+            'doc_segment': decode_array('q', data['doc_segment']),
+            'doc_offset': decode_array('q', data['doc_offset']),
+            'doc_length': decode_array('I', data['doc_length']),
+            'total_length': data['total_length'],
+            'postings': {term: (decode_array('I', ids), decode_array('H', tfs))
+                         for term, (ids, tfs) in data['postings'].items()}
+        }
+
+    # --- Querying ---
+
+    def _prefix_terms(self, prefix: str) -> List[str]:
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self.state['postings'])
+        vocabulary = self._vocabulary
+        start = bisect.bisect_left(vocabulary, prefix)
+        terms = []
+        for i in range(start, min(len(vocabulary), start + SEARCH_MAX_PREFIX_TERMS)):
+            if not vocabulary[i].startswith(prefix):
+                break
+            terms.append(vocabulary[i])
+        return terms
+
+    def _clause_scores(self, terms: Iterable[str]) -> Dict[int, float]:
+        """BM25 contribution of a clause (summed over its terms) for every matching document."""
+        state = self.state
+        total_docs = len(state['doc_log'])
+        avg_length = state['total_length'] / total_docs if total_docs else 1.0
+        lengths = state['doc_length']
+        scores: Dict[int, float] = {}
+        for term in terms:
+            ids, tfs = state['postings'].get(term, ((), ()))
+            if not ids:
+                continue
+            idf = math.log(1 + (total_docs - len(ids) + 0.5) / (len(ids) + 0.5))
+            for doc_id, tf in zip(ids, tfs):
+                norm = _K1 * (1 - _B + _B * lengths[doc_id] / avg_length) if avg_length else _K1
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (_K1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query: str, kinds: Optional[Iterable[str]] = None,
+               offset: int = 0, limit: int = 20) -> Dict[str, Any]:
+        """
+        Ranked search over the indexed logs.
+
+        Args:
+            query: Query text (see module docstring for syntax).
+            kinds: Log names to search (default: all indexed logs).
+            offset: Number of ranked results to skip.
+            limit: Page size.
+
+        Returns:
+            {'items': [(log_name, entry, score), ...], 'total': int, 'has_more': bool}.
+            For phrase queries 'total' counts candidates that contain every phrase
+            word and may overstate the exact matches.
+        """
+        clauses = parse_query(query)
+        empty = {'items': [], 'total': 0, 'has_more': False}
+        if not clauses:
+            return empty
+        self.refresh()
+        wanted = {self.kinds.index(kind) for kind in (kinds or self.kinds) if kind in self.kinds}
+        phrases = []
+
+        with self.lock:
+            candidates: Optional[Dict[int, float]] = None
+            # Most selective clauses first so the intersection shrinks quickly
+            expanded = []
+            for kind, value in clauses:
+                if kind == 'phrase':
+                    phrases.append(value[0])
+                    expanded.extend([t] for t in value[1])
+                elif kind == 'prefix':
+                    expanded.append(self._prefix_terms(value))
+                else:
+                    expanded.append([value])
+            postings = self.state['postings']
+            expanded.sort(key=lambda terms: sum(len(postings.get(t, ((), ()))[0]) for t in terms))
+            for terms in expanded:
+                scores = self._clause_scores(terms)
+                if candidates is None:
+                    candidates = scores
+                else:
+                    candidates = {doc_id: score + scores[doc_id] for doc_id, score in candidates.items() if doc_id in scores}
+                if not candidates:
+                    return empty
+            doc_log = self.state['doc_log']
+            ranked = sorted(((score, doc_id) for doc_id, score in candidates.items() if doc_log[doc_id] in wanted),
+                            reverse=True)
+            docs = {doc_id: (self.kinds[doc_log[doc_id]], (self.state['doc_segment'][doc_id], self.state['doc_offset'][doc_id]))
+                    for _, doc_id in (ranked if phrases else ranked[offset:offset + limit + 1])}
+
+        # Read entries outside the lock, only as many as the page needs
+        items = []
+        skipped = 0
+        has_more = False
+        for checked, (score, doc_id) in enumerate(ranked if phrases else ranked[offset:offset + limit + 1]):
+            if phrases and checked >= SEARCH_MAX_PHRASE_CHECKS:
+                break
+            log_name, position = docs[doc_id]
+            entry = open_event_log(log_name).read_at(position)
+            if entry is None:
+                continue
+            if phrases:
+                texts = [_normalize_text(entry.get(field)) for field in self.fields[log_name]]
+                if not all(any(phrase in text for text in texts) for phrase in phrases):
+                    continue
+                if skipped < offset:
+                    skipped += 1
+                    continue
+            if len(items) == limit:
+                has_more = True
+                break
+            items.append((log_name, entry, round(score, 4)))
+        return {'items': items, 'total': len(ranked), 'has_more': has_more}
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                **super().stats(),
+                'documents': len(self.state['doc_log']),
+                'terms': len(self.state['postings'])
+            }
+
+
+def get_search_index() -> SearchIndex:
+    """Return the process-wide search index, loading its snapshot on first use."""
+    return get_view('search_index', SearchIndex)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""Semantic Cache Module
+
+Answers paraphrased generation prompts from previously generated code.
+Prompts are embedded with a small local sentence encoder and compared against
+an in-memory vector index of answered prompts for the same language and model.
+"""
+
+import os
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import torch
+from transformers import AutoTokenizer, AutoModel
+
+from .response_cache import normalize_prompt
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Semantic cache configuration (Load from env in production)
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+SEMANTIC_CACHE_ENCODER = os.environ.get("SEMANTIC_CACHE_ENCODER", "sentence-transformers/all-MiniLM-L6-v2")
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.92))
+SEMANTIC_CACHE_SIZE = int(os.environ.get("SEMANTIC_CACHE_SIZE", 2048))
+
+
+class PromptEncoder:
+    """Lazily loaded mean-pooled sentence encoder producing unit-length vectors."""
+
+    def __init__(self, model_id: str = SEMANTIC_CACHE_ENCODER):
+        self.model_id = model_id
+        self.lock = threading.Lock()
+        self._tokenizer = None
+        self._model = None
+        self.failed = False
+
+    def load(self) -> bool:
+        with self.lock:
+            if self._model is not None or self.failed:
+                return not self.failed
+            try:
+                self._tokenizer = AutoTokenizer.from_pretrained(self.model_id)
+                self._model = AutoModel.from_pretrained(self.model_id).to("cpu").eval()
+                logger.info(f"Semantic cache encoder {self.model_id} loaded")
+            except Exception as e:
+                logger.warning(f"Semantic cache disabled, could not load {self.model_id}: {e}")
+                self.failed = True
+            return not self.failed
+
+    def encode(self, text: str) -> Optional[torch.Tensor]:
+        if not self.load():
+            return None
+        inputs = self._tokenizer(text, return_tensors="pt", truncation=True, max_length=256)
+        with torch.no_grad():
+            hidden = self._model(**inputs).last_hidden_state[0]
+        mask = inputs['attention_mask'][0].unsqueeze(-1).to(hidden.dtype)
+        vector = (hidden * mask).sum(dim=0) / mask.sum().clamp(min=1)
+        return torch.nn.functional.normalize(vector, dim=0)
+
+
+class SemanticCache:
+    """
+    Bounded nearest-neighbour cache of answered prompts.
+
+    Entries are partitioned by (task, model, variant) so an answer is only reused
+    for the same language and model. Eviction is least-recently-used across all
+    partitions.
+    """
+
+    def __init__(self, encoder: Optional[PromptEncoder] = None, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 max_entries: int = SEMANTIC_CACHE_SIZE, enabled: bool = SEMANTIC_CACHE_ENABLED):
+        self.encoder = encoder or PromptEncoder()
+        self.threshold = threshold
+        self.max_entries = max(1, max_entries)
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        # entry id -> {'partition', 'vector', 'answer'}, oldest first
+        self._entries = OrderedDict()
+        # partition -> {'ids': [...], 'matrix': Tensor or None}
+        self._partitions: Dict[Tuple[str, str, str], Dict[str, Any]] = {}
+        self._next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._hit_similarity_sum = 0.0
+
+    @staticmethod
+    def _partition(task: str, model_name: str, variant: str) -> Tuple[str, str, str]:
+        return task, model_name, normalize_prompt(variant)
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        partition = self._partitions[entry['partition']]
+        partition['ids'].remove(entry_id)
+        partition['matrix'] = None
+        if not partition['ids']:
+            del self._partitions[entry['partition']]
+
+    def _matrix(self, partition: Dict[str, Any]) -> torch.Tensor:
+        if partition['matrix'] is None:
+            partition['matrix'] = torch.stack([self._entries[i]['vector'] for i in partition['ids']])
+        return partition['matrix']
+
+    def embed(self, text: str) -> Optional[torch.Tensor]:
+        """Embed a prompt, or return None when the semantic tier is unavailable."""
+        if not self.enabled:
+            return None
+        return self.encoder.encode(normalize_prompt(text))
+
+    def lookup(self, task: str, model_name: str, variant: str, vector: Optional[torch.Tensor]) -> Optional[Tuple[str, float]]:
+        """Return (answer, similarity) for the closest cached prompt above the threshold."""
+        if vector is None:
+            return None
+
+        with self.lock:
+            partition = self._partitions.get(self._partition(task, model_name, variant))
+            if partition:
+                scores = self._matrix(partition) @ vector
+                best = int(torch.argmax(scores))
+                similarity = float(scores[best])
+                if similarity >= self.threshold:
+                    entry_id = partition['ids'][best]
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    self._hit_similarity_sum += similarity
+                    return self._entries[entry_id]['answer'], similarity
+            self.misses += 1
+        return None
+
+    def add(self, task: str, model_name: str, variant: str, vector: Optional[torch.Tensor], answer: str) -> None:
+        if vector is None:
+            return
+
+        key = self._partition(task, model_name, variant)
+        with self.lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = {'partition': key, 'vector': vector, 'answer': answer}
+            partition = self._partitions.setdefault(key, {'ids': [], 'matrix': None})
+            partition['ids'].append(entry_id)
+            partition['matrix'] = None
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self._entries.clear()
+            self._partitions.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'enabled': self.enabled and not self.encoder.failed,
+                'encoder': self.encoder.model_id,
+                'threshold': self.threshold,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'partitions': len(self._partitions),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+                'avg_hit_similarity': round(self._hit_similarity_sum / self.hits, 4) if self.hits else 0.0,
+                'evictions': self.evictions
+            }
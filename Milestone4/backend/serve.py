@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+"""Multi-Worker Model Server
+
+Runs the model server as several worker processes behind one router
+(model_router.py). With MODEL_SERVER_WORKERS=1 it is a plain single uvicorn
+process.
+
+Weights are shared by forking after load. The supervisor process loads
+SERVE_PRELOAD_MODELS and the prompt encoder once, freezes the garbage collector
+so that collections do not write to the loaded objects, and then forks the
+workers and the router. Tensor storage is never written during inference, so
+its pages stay shared copy-on-write. Memory therefore grows by each worker's
+activations and caches, not by another copy of the weights. Preloaded models are
+pinned so no worker evicts and reloads a private copy. A worker that dies is
+forked again from the supervisor and still shares its weights.
+
+CUDA cannot be used across fork, so on GPU hosts the server runs as a single
+process.
+
+Usage:
+    MODEL_SERVER_WORKERS=4 python -m backend.serve
+"""
+
+import os
+import gc
+import sys
+import time
+import signal
+import logging
+
+# Ensure the backend package can be imported
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')))
+
+import uvicorn
+import torch
+
+from backend.model_loader import WARMUP_MODELS, get_registry
+from backend.cpu_inference import CPU_INFERENCE_THREADS, configure_cpu_threads
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Serving knobs (Load from env in production)
+MODEL_SERVER_HOST = os.environ.get("MODEL_SERVER_HOST", "0.0.0.0")
+MODEL_SERVER_PORT = int(os.environ.get("MODEL_SERVER_PORT", 8000))
+MODEL_SERVER_WORKERS = int(os.environ.get("MODEL_SERVER_WORKERS", 1))
+# Workers listen on 127.0.0.1 from this port upwards
+WORKER_BASE_PORT = int(os.environ.get("WORKER_BASE_PORT", 8100))
+# Models loaded before forking, shared by every worker (defaults to WARMUP_MODELS)
+SERVE_PRELOAD_MODELS = [m.strip() for m in os.environ.get("SERVE_PRELOAD_MODELS", ",".join(WARMUP_MODELS)).split(",") if m.strip()]
+# Intra-op threads per worker (default: CPU_INFERENCE_THREADS or all cores, split evenly between workers)
+SERVE_THREADS_PER_WORKER = int(os.environ.get("SERVE_THREADS_PER_WORKER", 0))
+
+
+def _worker_url(index: int) -> str:
+    return f"http://127.0.0.1:{WORKER_BASE_PORT + index}"
+
+
+def _run_worker(index: int, threads: int) -> None:
+    configure_cpu_threads(threads)
+    from backend import model_server
+    from backend.admission_control import RateLimiter
+    # The router enforces the rate limits for all workers together
+    model_server.rate_limiter = RateLimiter(user_rate=0, model_rate=0)
+    # Trust the router's X-Forwarded-For, so requests keep their client's address
+    uvicorn.run(model_server.app, host="127.0.0.1", port=WORKER_BASE_PORT + index, log_level="warning",
+                proxy_headers=True, forwarded_allow_ips="127.0.0.1")
+
+
+def _run_router(workers: int, shared_models) -> None:
+    from backend.model_router import create_router_app
+    app = create_router_app([_worker_url(i) for i in range(workers)], shared_models)
+    uvicorn.run(app, host=MODEL_SERVER_HOST, port=MODEL_SERVER_PORT)
+
+
+def _fork(target, *args) -> int:
+    pid = os.fork()
+    if pid == 0:
+        # Child: default signal handling, run, and never return into the supervisor loop
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        code = 0
+        try:
+            target(*args)
+        except Exception as e:
+            logger.error(f"Server process failed: {e}")
+            code = 1
+        finally:
+            os._exit(code)
+    return pid
+
+
+def _preload() -> list:
+    """Load and pin the shared models (plus the prompt encoder) in the supervisor."""
+    from backend.model_server import semantic_cache
+    registry = get_registry()
+    shared = [name for name in SERVE_PRELOAD_MODELS if registry.pin(name)]
+    if semantic_cache.enabled:
+        semantic_cache.encoder.load()
+    for model, _ in (registry.get(name) for name in shared):
+        model.eval()
+    gc.collect()
+    # Keep the collector from touching (and so un-sharing) everything loaded so far
+    gc.freeze()
+    return shared
+
+
+def main() -> None:
+    workers = MODEL_SERVER_WORKERS
+    if workers > 1 and torch.cuda.is_available():
+        logger.warning("CUDA cannot be shared across forked workers; running a single model server process")
+        workers = 1
+    if workers <= 1:
+        from backend.model_server import app
+        uvicorn.run(app, host=MODEL_SERVER_HOST, port=MODEL_SERVER_PORT)
+        return
+
+    threads = SERVE_THREADS_PER_WORKER or max(1, (CPU_INFERENCE_THREADS or os.cpu_count() or 1) // workers)
+    shared = _preload()
+    logger.info(f"Forking {workers} workers ({threads} threads each) sharing {shared or 'no models'}")
+
+    roles = {}
+    for index in range(workers):
+        roles[_fork(_run_worker, index, threads)] = ('worker', index)
+    roles[_fork(_run_router, workers, shared)] = ('router', None)
+
+    stopping = []
+
+    def _stop(signum, frame):
+        stopping.append(signum)
+        for pid in list(roles):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    while roles:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        except InterruptedError:
+            continue
+        role, index = roles.pop(pid, (None, None))
+        if role is None or stopping:
+            continue
+        logger.warning(f"{role} {index if index is not None else ''} exited with status {status}; restarting")
+        time.sleep(1)
+        if role == 'worker':
+            roles[_fork(_run_worker, index, threads)] = (role, index)
+        else:
+            roles[_fork(_run_router, workers, shared)] = (role, index)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+"""Speculative Decoding Module
+
+Assisted generation for requests that opt in with ``speculative``: a small
+draft model (DRAFT_MODEL) proposes several tokens and the requested model
+checks them all in one forward pass, keeping the longest prefix it agrees with.
+
+Speculative requests always decode greedily. Greedy verification returns
+exactly the tokens the target model would have produced on its own, so only the
+speed changes. It also keeps the draft model untouched: transformers' sampled
+variant for drafters with a different tokenizer prunes the draft model's output
+layer in place, and the draft model is also served to other requests.
+
+Acceptance is measured by counting forward passes on the calling thread:
+every draft pass proposes one token, and every target pass is one verification
+round that keeps the accepted tokens plus one token of its own.
+"""
+
+import os
+import time
+import weakref
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+import torch
+
+from .model_loader import get_model
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Speculative decoding configuration (Load from env in production)
+# Model that drafts tokens for the others; empty disables speculative decoding
+DRAFT_MODEL = os.environ.get("DRAFT_MODEL", "deepseek")
+
+# Forward passes counted on this thread, keyed by id(model)
+_local = threading.local()
+_hooked = weakref.WeakSet()
+_hook_lock = threading.Lock()
+
+
+def _count_forward(module, args):
+    counts = getattr(_local, 'counts', None)
+    if counts is not None and id(module) in counts:
+        counts[id(module)] += 1
+
+
+def _ensure_hooks(*models) -> None:
+    with _hook_lock:
+        for model in models:
+            if model not in _hooked:
+                model.register_forward_pre_hook(_count_forward)
+                _hooked.add(model)
+
+
+class SpeculativeStats:
+    """Acceptance counters per (target model, draft model) pair."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self._pairs: Dict[str, Dict[str, float]] = {}
+
+    def record(self, pair: str, proposed: int, rounds: int, new_tokens: int, seconds: float) -> None:
+        accepted = max(0, new_tokens - rounds)
+        with self.lock:
+            totals = self._pairs.setdefault(pair, {'requests': 0, 'proposed': 0, 'accepted': 0,
+                                                   'rounds': 0, 'new_tokens': 0, 'seconds': 0.0})
+            totals['requests'] += 1
+            totals['proposed'] += proposed
+            totals['accepted'] += accepted
+            totals['rounds'] += rounds
+            totals['new_tokens'] += new_tokens
+            totals['seconds'] += seconds
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'draft_model': DRAFT_MODEL or None,
+                'pairs': {
+                    pair: {
+                        'requests': t['requests'],
+                        'draft_tokens': t['proposed'],
+                        'accepted_tokens': t['accepted'],
+                        # Draft and target tokens differ when the tokenizers do, hence the cap
+                        'acceptance_rate': round(min(1.0, t['accepted'] / t['proposed']), 4) if t['proposed'] else 0.0,
+                        'tokens_per_target_pass': round(t['new_tokens'] / t['rounds'], 3) if t['rounds'] else 0.0,
+                        'tokens_per_s': round(t['new_tokens'] / t['seconds'], 2) if t['seconds'] else 0.0
+                    }
+                    for pair, t in self._pairs.items()
+                }
+            }
+
+
+speculative_stats = SpeculativeStats()
+
+
+def get_draft(model_name: str) -> Optional[Dict[str, Any]]:
+    """
+    Return the draft model for target ``model_name``, or None when there is none.
+
+    Returns:
+        dict: {'name', 'target', 'model', 'tokenizer'}
+    """
+    if not DRAFT_MODEL or model_name == DRAFT_MODEL:
+        return None
+    model, tokenizer = get_model(DRAFT_MODEL)
+    if not model or not tokenizer:
+        logger.warning(f"Draft model {DRAFT_MODEL} unavailable; decoding {model_name} without it")
+        return None
+    return {'name': DRAFT_MODEL, 'target': model_name, 'model': model, 'tokenizer': tokenizer}
+
+
+def assisted_generate(model, tokenizer, draft: Dict[str, Any], input_ids: torch.Tensor, **generate_kwargs) -> torch.Tensor:
+    """
+    Run ``model.generate`` for one prompt with ``draft`` proposing tokens.
+
+    Decoding is forced to be greedy (see the module docstring). Must be called
+    on the thread that runs the generation, since passes are counted per thread.
+    """
+    draft_model, draft_tokenizer = draft['model'], draft['tokenizer']
+    generate_kwargs = {k: v for k, v in generate_kwargs.items() if k not in ('temperature', 'top_p', 'top_k')}
+    generate_kwargs['do_sample'] = False
+    if model.config.get_text_config().vocab_size != draft_model.config.get_text_config().vocab_size:
+        # Different tokenizers (transformers' test): universal assisted decoding
+        # re-tokenizes the draft's text for the target
+        generate_kwargs.update(tokenizer=tokenizer, assistant_tokenizer=draft_tokenizer)
+
+    _ensure_hooks(model, draft_model)
+    counts = {id(model): 0, id(draft_model): 0}
+    _local.counts = counts
+    start = time.perf_counter()
+    try:
+        output = model.generate(input_ids=input_ids, assistant_model=draft_model, **generate_kwargs)
+    finally:
+        _local.counts = None
+    new_tokens = output.shape[1] - input_ids.shape[1]
+    speculative_stats.record(f"{draft['target']}<-{draft['name']}", counts[id(draft_model)], counts[id(model)],
+                             new_tokens, time.perf_counter() - start)
+    return output
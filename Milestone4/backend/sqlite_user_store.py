@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+"""SQLite User Store Module
+
+Indexed user storage backing user_management_module.
+
+Each user is one row keyed by user_id. Lookup columns (lower-cased username and
+email, role) are indexed, and the full user record is kept as JSON so the public
+dict shape stays the same as the old users.json entries.
+"""
+
+import os
+import json
+import queue
+import sqlite3
+import logging
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from .pagination import clamp_limit, decode_cursor, encode_cursor
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Connection pool size (Load from env in production)
+SQLITE_POOL_SIZE = int(os.environ.get("SQLITE_POOL_SIZE", 4))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id     TEXT PRIMARY KEY,
+    username_lc TEXT NOT NULL DEFAULT '',
+    email_lc    TEXT NOT NULL DEFAULT '',
+    role        TEXT NOT NULL DEFAULT 'user',
+    data        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_users_username_lc ON users (username_lc);
+CREATE INDEX IF NOT EXISTS idx_users_email_lc ON users (email_lc);
+CREATE INDEX IF NOT EXISTS idx_users_role ON users (role);
+"""
+
+# Sort keys accepted by SqliteUserStore.page and the column each one orders by
+USER_SORT_COLUMNS = {
+    'created': 'rowid',
+    'username': 'username_lc',
+    'user_id': 'user_id'
+}
+
+
+def _normalize(value: Any) -> str:
+    return str(value or '').strip().lower()
+
+
+class SqliteConnectionPool:
+    """A small fixed-size pool of WAL-mode SQLite connections."""
+
+    def __init__(self, db_path: str, size: int = SQLITE_POOL_SIZE):
+        self.db_path = db_path
+        self._pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+        for _ in range(max(1, size)):
+            self._pool.put(self._connect())
+
+    def _connect(self) -> sqlite3.Connection:
+        # isolation_level=None: transactions are opened explicitly with BEGIN
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=30000")
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        conn = self._pool.get()
+        try:
+            yield conn
+        finally:
+            self._pool.put(conn)
+
+    def close(self) -> None:
+        while not self._pool.empty():
+            self._pool.get_nowait().close()
+
+
+class UserTransaction:
+    """User operations bound to one open write transaction."""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute("SELECT data FROM users WHERE user_id = ?", (user_id,)).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def put(self, user: Dict[str, Any]) -> None:
+        """Insert or replace a user record."""
+        self.conn.execute(
+            "INSERT INTO users (user_id, username_lc, email_lc, role, data) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET username_lc = excluded.username_lc, "
+            "email_lc = excluded.email_lc, role = excluded.role, data = excluded.data",
+            (user['user_id'], _normalize(user.get('username')), _normalize(user.get('email')),
+             user.get('role', 'user'), json.dumps(user))
+        )
+
+    def rename(self, old_user_id: str, user: Dict[str, Any]) -> bool:
+        """Replace the record of old_user_id with user (which may have a new user_id) in place."""
+        return self.conn.execute(
+            "UPDATE users SET user_id = ?, username_lc = ?, email_lc = ?, role = ?, data = ? WHERE user_id = ?",
+            (user['user_id'], _normalize(user.get('username')), _normalize(user.get('email')),
+             user.get('role', 'user'), json.dumps(user), old_user_id)
+        ).rowcount > 0
+
+    def delete(self, user_id: str) -> bool:
+        return self.conn.execute("DELETE FROM users WHERE user_id = ?", (user_id,)).rowcount > 0
+
+    def count_by_role(self, role: str) -> int:
+        return self.conn.execute("SELECT COUNT(*) FROM users WHERE role = ?", (role,)).fetchone()[0]
+
+
+class SqliteUserStore:
+    """Indexed user store with the same record shape as the legacy users.json."""
+
+    def __init__(self, db_path: str, legacy_json_path: Optional[str] = None, pool_size: int = SQLITE_POOL_SIZE):
+        self.db_path = db_path
+        self.pool = SqliteConnectionPool(db_path, pool_size)
+        with self.pool.connection() as conn:
+            conn.executescript(_SCHEMA)
+        if legacy_json_path:
+            self._migrate_json(legacy_json_path)
+
+    def _migrate_json(self, json_path: str) -> None:
+        """Import a legacy users.json once, then rename it to users.json.migrated."""
+        if not os.path.exists(json_path) or self.count() > 0:
+            return
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                users = json.load(f)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Could not migrate {json_path}: {e}")
+            return
+        users = [u for u in users if isinstance(u, dict) and u.get('user_id')] if isinstance(users, list) else []
+        with self.transaction() as txn:
+            for user in users:
+                txn.put(user)
+        os.replace(json_path, json_path + '.migrated')
+        logger.info(f"Migrated {len(users)} users from {json_path} to {self.db_path}")
+
+    @contextmanager
+    def transaction(self) -> Iterator[UserTransaction]:
+        """Open a write transaction; commits on success, rolls back on error."""
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield UserTransaction(conn)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _fetch_one(self, sql: str, params: tuple) -> Optional[Dict[str, Any]]:
+        with self.pool.connection() as conn:
+            row = conn.execute(sql, params).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def get_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return self._fetch_one("SELECT data FROM users WHERE user_id = ?", (user_id,))
+
+    def get_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        """Case-insensitive username lookup."""
+        return self._fetch_one("SELECT data FROM users WHERE username_lc = ? ORDER BY rowid LIMIT 1",
+                               (_normalize(username),))
+
+    def get_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        """Case-insensitive email lookup."""
+        if not _normalize(email):
+            return None
+        return self._fetch_one("SELECT data FROM users WHERE email_lc = ? ORDER BY rowid LIMIT 1",
+                               (_normalize(email),))
+
+    def search(self, text: str, limit: int = 20, offset: int = 0) -> Tuple[List[Dict[str, Any]], int]:
+        """Users whose username or user_id contains text (case-insensitive); returns (page, total)."""
+        pattern = '%' + _normalize(text).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        where = "WHERE username_lc LIKE ? ESCAPE '\\' OR lower(user_id) LIKE ? ESCAPE '\\'"
+        with self.pool.connection() as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM users {where}", (pattern, pattern)).fetchone()[0]
+            rows = conn.execute(f"SELECT data FROM users {where} ORDER BY rowid LIMIT ? OFFSET ?",
+                                (pattern, pattern, limit, offset)).fetchall()
+        return [json.loads(row['data']) for row in rows], total
+
+    def page(self, limit: int = 50, cursor: Optional[str] = None, sort: str = 'created',
+             descending: bool = False) -> Dict[str, Any]:
+        """
+        One page of users ordered by sort ('created', 'username' or 'user_id').
+
+        Uses keyset pagination on (sort column, rowid), so every page is an index
+        range scan regardless of how deep it is.
+        """
+        if sort not in USER_SORT_COLUMNS:
+            raise ValueError(f"Unknown sort key: {sort}")
+        limit = clamp_limit(limit)
+        column = USER_SORT_COLUMNS[sort]
+        direction = 'DESC' if descending else 'ASC'
+        comparison = '<' if descending else '>'
+        where, params = '', ()
+        if cursor:
+            data = decode_cursor(cursor)
+            if data.get('s') != sort or data.get('d') != descending or not isinstance(data.get('k'), list):
+                raise ValueError("Cursor does not match this listing")
+            if column == 'rowid':
+                where, params = f"WHERE rowid {comparison} ?", (data['k'][-1],)
+            else:
+                where, params = f"WHERE ({column}, rowid) {comparison} (?, ?)", tuple(data['k'])
+        order = f"rowid {direction}" if column == 'rowid' else f"{column} {direction}, rowid {direction}"
+        with self.pool.connection() as conn:
+            rows = conn.execute(f"SELECT rowid AS rid, {column} AS sort_key, data FROM users {where} "
+                                f"ORDER BY {order} LIMIT ?", params + (limit + 1,)).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            last = rows[limit - 1]
+            key = [last['rid']] if column == 'rowid' else [last['sort_key'], last['rid']]
+            next_cursor = encode_cursor({'s': sort, 'd': descending, 'k': key})
+        return {'items': [json.loads(row['data']) for row in rows[:limit]], 'next_cursor': next_cursor}
+
+    def all(self) -> List[Dict[str, Any]]:
+        with self.pool.connection() as conn:
+            rows = conn.execute("SELECT data FROM users ORDER BY rowid").fetchall()
+        return [json.loads(row['data']) for row in rows]
+
+    def count(self) -> int:
+        with self.pool.connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
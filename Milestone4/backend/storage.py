@@ -0,0 +1,596 @@
+# -*- coding: utf-8 -*-
+"""Storage Module
+
+One storage layer for every backend module. It defines three kinds of store:
+
+* event logs: append-only entries such as history, feedback and activity;
+* the user store: keyed user records;
+* blob stores: binary files such as avatars.
+
+Each kind has interchangeable implementations (JSON, JSONL, SQLite, files). The
+implementation is picked by environment variables, so modules never hard-code
+file paths, locks or load/dump logic. Locking and durability live in one place:
+``path_lock`` and ``atomic_write_bytes``.
+"""
+
+import os
+import abc
+import json
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from .jsonl_store import JsonlLog, Position, bump_generation, migrate_json_array, open_log, read_generation
+from .sqlite_user_store import SqliteConnectionPool, SqliteUserStore, SQLITE_POOL_SIZE, USER_SORT_COLUMNS
+from .pagination import clamp_limit, decode_cursor, encode_cursor
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+CURRENT_FILE_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_FILE_DIR, '..'))
+STREAMLIT_APP_DIR = os.path.join(PROJECT_ROOT, 'streamlit_app')
+
+# Storage configuration (Load from env in production)
+DATA_DIR = os.path.abspath(os.environ.get("CODEGENIE_DATA_DIR", STREAMLIT_APP_DIR))
+# Event logs (history, feedback, activity): jsonl | sqlite | json
+EVENT_LOG_BACKEND = os.environ.get("EVENT_LOG_BACKEND", "jsonl").lower()
+# User records: sqlite | json
+USER_STORE_BACKEND = os.environ.get("USER_STORE_BACKEND", "sqlite").lower()
+
+# Rows fetched per query when streaming a SQLite event log
+_SQLITE_PAGE = 500
+
+Listener = Callable[[Optional[List[Tuple[Position, Dict[str, Any]]]]], None]
+
+
+def data_path(filename: str) -> str:
+    """Absolute path of filename inside the data directory."""
+    return os.path.join(DATA_DIR, filename)
+
+
+# --- Shared locking and durability ---
+
+_path_locks: Dict[str, threading.RLock] = {}
+_path_locks_guard = threading.Lock()
+
+
+def path_lock(path: str) -> threading.RLock:
+    """Return the process-wide lock guarding path."""
+    key = os.path.normpath(os.path.abspath(path))
+    with _path_locks_guard:
+        if key not in _path_locks:
+            _path_locks[key] = threading.RLock()
+        return _path_locks[key]
+
+
+def atomic_write_bytes(path: str, data: bytes) -> None:
+    """Write data to path so readers see either the old or the new file, never a partial one."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.tmp.{os.getpid()}.{threading.get_ident()}"
+    try:
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _read_json_array(path: str) -> List[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.error(f"Could not read {path}: {e}")
+        return []
+    return [entry for entry in data if isinstance(entry, dict)] if isinstance(data, list) else []
+
+
+def _write_json_array(path: str, entries: List[Dict[str, Any]]) -> None:
+    atomic_write_bytes(path, json.dumps(entries, indent=4, ensure_ascii=False).encode('utf-8'))
+
+
+# --- Interfaces ---
+
+class EventLog(abc.ABC):
+    """
+    Append-only log of dict entries.
+
+    Every entry has an opaque, orderable position that ``read_at`` resolves and
+    ``iter_with_positions(before=...)`` uses as a cursor.
+    """
+
+    base_path: str
+
+    @abc.abstractmethod
+    def append_many(self, entries: Iterable[Dict[str, Any]]) -> List[Position]:
+        """Append entries in one batch and return their positions."""
+
+    def append(self, entry: Dict[str, Any]) -> Position:
+        return self.append_many([entry])[0]
+
+    @abc.abstractmethod
+    def iter_with_positions(self, reverse: bool = False, before: Optional[Position] = None,
+                            after: Optional[Position] = None) -> Iterator[Tuple[Position, Dict[str, Any]]]:
+        """Stream (position, entry) pairs, optionally only those between two positions (exclusive)."""
+
+    def iter_entries(self, reverse: bool = False) -> Iterator[Dict[str, Any]]:
+        for _, entry in self.iter_with_positions(reverse=reverse):
+            yield entry
+
+    @abc.abstractmethod
+    def read_at(self, position: Position) -> Optional[Dict[str, Any]]:
+        """Read the entry stored at position."""
+
+    @abc.abstractmethod
+    def rewrite(self, transform: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]) -> int:
+        """Rewrite every entry through transform (None drops it); invalidates positions."""
+
+    @abc.abstractmethod
+    def generation(self) -> int:
+        """Number of rewrites so far, shared by every process using the log."""
+
+    @abc.abstractmethod
+    def add_listener(self, listener: Listener) -> None:
+        """Register a callback notified of new entries (or None after a rewrite)."""
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class UserStore(abc.ABC):
+    """
+    Keyed user records.
+
+    Writes go through ``transaction()``, which yields an object with ``get``, ``put``,
+    ``rename``, ``delete`` and ``count_by_role``. It commits when the block exits
+    normally and discards the changes when it raises.
+    """
+
+    @abc.abstractmethod
+    def transaction(self):
+        """Context manager yielding a user transaction."""
+
+    @abc.abstractmethod
+    def get_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
+        pass
+
+    @abc.abstractmethod
+    def get_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        """Case-insensitive username lookup."""
+
+    @abc.abstractmethod
+    def get_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        """Case-insensitive email lookup."""
+
+    @abc.abstractmethod
+    def search(self, text: str, limit: int = 20, offset: int = 0) -> Tuple[List[Dict[str, Any]], int]:
+        """Users whose username or user_id contains text (case-insensitive); returns (page, total)."""
+
+    @abc.abstractmethod
+    def page(self, limit: int = 50, cursor: Optional[str] = None, sort: str = 'created',
+             descending: bool = False) -> Dict[str, Any]:
+        """One page of users as {'items', 'next_cursor'}; sort is 'created', 'username' or 'user_id'."""
+
+    @abc.abstractmethod
+    def all(self) -> List[Dict[str, Any]]:
+        pass
+
+    @abc.abstractmethod
+    def count(self) -> int:
+        pass
+
+
+class BlobStore(abc.ABC):
+    """Named binary objects (e.g. avatar images)."""
+
+    @abc.abstractmethod
+    def put(self, key: str, data: bytes) -> None:
+        pass
+
+    @abc.abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        pass
+
+    @abc.abstractmethod
+    def delete(self, key: str) -> bool:
+        pass
+
+
+# The JSONL log and the SQLite user store already provide these interfaces
+EventLog.register(JsonlLog)
+UserStore.register(SqliteUserStore)
+
+
+class _Listeners:
+    """Listener bookkeeping shared by the event log implementations below."""
+
+    def _init_listeners(self) -> None:
+        self._listeners: List[Listener] = []
+
+    def add_listener(self, listener: Listener) -> None:
+        self._listeners.append(listener)
+
+    def _notify(self, written: Optional[List[Tuple[Position, Dict[str, Any]]]]) -> None:
+        for listener in self._listeners:
+            try:
+                listener(written)
+            except Exception as e:
+                logger.error(f"Log listener failed for {self.base_path}: {e}")
+
+
+# --- Event log implementations ---
+
+class JsonArrayLog(_Listeners, EventLog):
+    """
+    Event log kept as one JSON array file (the original on-disk format).
+
+    Every append rewrites the whole file, so this backend is only meant for small
+    deployments or for staying compatible with tools that read the array directly.
+    Positions are ``(0, index)``.
+    """
+
+    def __init__(self, path: str):
+        self.base_path = path
+        self.lock = path_lock(path)
+        self._init_listeners()
+
+    def append_many(self, entries: Iterable[Dict[str, Any]]) -> List[Position]:
+        entries = list(entries)
+        if not entries:
+            return []
+        with self.lock:
+            data = _read_json_array(self.base_path)
+            positions = [(0, len(data) + i) for i in range(len(entries))]
+            _write_json_array(self.base_path, data + entries)
+        self._notify(list(zip(positions, entries)))
+        return positions
+
+    def iter_with_positions(self, reverse: bool = False, before: Optional[Position] = None,
+                            after: Optional[Position] = None) -> Iterator[Tuple[Position, Dict[str, Any]]]:
+        with self.lock:
+            data = _read_json_array(self.base_path)
+        end = len(data) if before is None else min(before[1], len(data))
+        start = 0 if after is None else max(after[1] + 1, 0)
+        indexes = range(end - 1, start - 1, -1) if reverse else range(start, end)
+        for i in indexes:
+            yield (0, i), data[i]
+
+    def read_at(self, position: Position) -> Optional[Dict[str, Any]]:
+        with self.lock:
+            data = _read_json_array(self.base_path)
+        index = position[1]
+        return data[index] if 0 <= index < len(data) else None
+
+    def generation(self) -> int:
+        return read_generation(self.base_path)
+
+    def rewrite(self, transform: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]) -> int:
+        with self.lock:
+            data = _read_json_array(self.base_path)
+            changed = 0
+            kept = []
+            for entry in data:
+                new_entry = transform(dict(entry))
+                if new_entry != entry:
+                    changed += 1
+                if new_entry is not None:
+                    kept.append(new_entry)
+            bump_generation(self.base_path)
+            _write_json_array(self.base_path, kept)
+            bump_generation(self.base_path)
+        self._notify(None)
+        return changed
+
+
+class SqliteEventLog(_Listeners, EventLog):
+    """
+    Event log stored in a SQLite table (WAL mode, pooled connections).
+
+    Positions are ``(0, rowid)``; rowids only grow, so they keep insertion order.
+    """
+
+    def __init__(self, db_path: str, legacy_json_path: Optional[str] = None, pool_size: int = SQLITE_POOL_SIZE):
+        self.base_path = db_path
+        self.pool = SqliteConnectionPool(db_path, pool_size)
+        self._init_listeners()
+        with self.pool.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, data TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            empty = conn.execute("SELECT 1 FROM events LIMIT 1").fetchone() is None
+        if legacy_json_path and empty:
+            migrate_json_array(legacy_json_path, self)
+
+    def append_many(self, entries: Iterable[Dict[str, Any]]) -> List[Position]:
+        entries = list(entries)
+        if not entries:
+            return []
+        positions = []
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for entry in entries:
+                    cursor = conn.execute("INSERT INTO events (data) VALUES (?)", (json.dumps(entry, ensure_ascii=False),))
+                    positions.append((0, cursor.lastrowid))
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        self._notify(list(zip(positions, entries)))
+        return positions
+
+    def iter_with_positions(self, reverse: bool = False, before: Optional[Position] = None,
+                            after: Optional[Position] = None) -> Iterator[Tuple[Position, Dict[str, Any]]]:
+        # Page with keyset queries so no connection is held while the caller consumes rows
+        low = after[1] if after is not None else 0
+        high = before[1] if before is not None else None
+        while True:
+            where = "id > ?" + (" AND id < ?" if high is not None else "")
+            params = (low,) + ((high,) if high is not None else ())
+            order = "DESC" if reverse else "ASC"
+            with self.pool.connection() as conn:
+                rows = conn.execute(f"SELECT id, data FROM events WHERE {where} ORDER BY id {order} LIMIT ?",
+                                    params + (_SQLITE_PAGE,)).fetchall()
+            for row in rows:
+                yield (0, row['id']), json.loads(row['data'])
+            if len(rows) < _SQLITE_PAGE:
+                return
+            if reverse:
+                high = rows[-1]['id']
+            else:
+                low = rows[-1]['id']
+
+    def read_at(self, position: Position) -> Optional[Dict[str, Any]]:
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT data FROM events WHERE id = ?", (position[1],)).fetchone()
+        return json.loads(row['data']) if row else None
+
+    def generation(self) -> int:
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return row['value'] if row else 0
+
+    def rewrite(self, transform: Callable[[Dict[str, Any]], Optional[Dict[str, Any]]]) -> int:
+        changed = 0
+        with self.pool.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for row in conn.execute("SELECT id, data FROM events ORDER BY id").fetchall():
+                    entry = json.loads(row['data'])
+                    new_entry = transform(dict(entry))
+                    if new_entry == entry:
+                        continue
+                    changed += 1
+                    if new_entry is None:
+                        conn.execute("DELETE FROM events WHERE id = ?", (row['id'],))
+                    else:
+                        conn.execute("UPDATE events SET data = ? WHERE id = ?",
+                                     (json.dumps(new_entry, ensure_ascii=False), row['id']))
+                # Committed with the rewrite itself
+                conn.execute("INSERT INTO meta (key, value) VALUES ('generation', 1) "
+                             "ON CONFLICT(key) DO UPDATE SET value = value + 1")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        self._notify(None)
+        return changed
+
+    def close(self) -> None:
+        self.pool.close()
+
+
+# --- User store implementation ---
+
+class _JsonUserTransaction:
+    """User operations on an in-memory copy of users.json."""
+
+    def __init__(self, users: List[Dict[str, Any]]):
+        self.users = users
+
+    def _index(self, user_id: str) -> Optional[int]:
+        return next((i for i, u in enumerate(self.users) if u.get('user_id') == user_id), None)
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        index = self._index(user_id)
+        return dict(self.users[index]) if index is not None else None
+
+    def put(self, user: Dict[str, Any]) -> None:
+        index = self._index(user['user_id'])
+        if index is None:
+            self.users.append(dict(user))
+        else:
+            self.users[index] = dict(user)
+
+    def rename(self, old_user_id: str, user: Dict[str, Any]) -> bool:
+        index = self._index(old_user_id)
+        if index is None:
+            return False
+        self.users[index] = dict(user)
+        return True
+
+    def delete(self, user_id: str) -> bool:
+        index = self._index(user_id)
+        if index is None:
+            return False
+        del self.users[index]
+        return True
+
+    def count_by_role(self, role: str) -> int:
+        return sum(1 for u in self.users if u.get('role') == role)
+
+
+class JsonUserStore(UserStore):
+    """User store kept as the original users.json array (linear scans, whole-file writes)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = path_lock(path)
+
+    @contextmanager
+    def transaction(self) -> Iterator[_JsonUserTransaction]:
+        with self.lock:
+            txn = _JsonUserTransaction(_read_json_array(self.path))
+            yield txn
+            _write_json_array(self.path, txn.users)
+
+    def _find(self, field: str, value: str) -> Optional[Dict[str, Any]]:
+        value = str(value or '').strip().lower()
+        if not value:
+            return None
+        return next((u for u in self.all() if str(u.get(field) or '').strip().lower() == value), None)
+
+    def get_by_id(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return next((u for u in self.all() if u.get('user_id') == user_id), None)
+
+    def get_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        return self._find('username', username)
+
+    def get_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        return self._find('email', email)
+
+    def search(self, text: str, limit: int = 20, offset: int = 0) -> Tuple[List[Dict[str, Any]], int]:
+        text = str(text or '').strip().lower()
+        matches = [u for u in self.all()
+                   if text in str(u.get('username', '')).lower() or text in str(u.get('user_id', '')).lower()]
+        return matches[offset:offset + limit], len(matches)
+
+    def page(self, limit: int = 50, cursor: Optional[str] = None, sort: str = 'created',
+             descending: bool = False) -> Dict[str, Any]:
+        if sort not in USER_SORT_COLUMNS:
+            raise ValueError(f"Unknown sort key: {sort}")
+        limit = clamp_limit(limit)
+
+        def key(item):
+            rowid, user = item
+            if sort == 'username':
+                return [str(user.get('username') or '').strip().lower(), rowid]
+            if sort == 'user_id':
+                return [str(user.get('user_id')), rowid]
+            return [rowid]
+
+        # The JSON file has no indexes: sort in memory, then apply the same keyset rule
+        keyed = sorted(((key(item), item[1]) for item in enumerate(self.all(), 1)), key=lambda x: x[0], reverse=descending)
+        if cursor:
+            data = decode_cursor(cursor)
+            if data.get('s') != sort or data.get('d') != descending or not isinstance(data.get('k'), list):
+                raise ValueError("Cursor does not match this listing")
+            after = data['k']
+            keyed = [(k, u) for k, u in keyed if (k < after if descending else k > after)]
+        next_cursor = encode_cursor({'s': sort, 'd': descending, 'k': keyed[limit - 1][0]}) if len(keyed) > limit else None
+        return {'items': [u for _, u in keyed[:limit]], 'next_cursor': next_cursor}
+
+    def all(self) -> List[Dict[str, Any]]:
+        with self.lock:
+            return _read_json_array(self.path)
+
+    def count(self) -> int:
+        return len(self.all())
+
+
+# --- Blob store implementation ---
+
+class FileBlobStore(BlobStore):
+    """One file per key inside a directory, written atomically."""
+
+    def __init__(self, directory: str, suffix: str = ''):
+        self.directory = directory
+        self.suffix = suffix
+
+    def _path(self, key: str) -> str:
+        # Keys are user-supplied ids; keep them inside the directory
+        safe_key = os.path.basename(str(key))
+        if not safe_key or safe_key in ('.', '..'):
+            raise ValueError(f"Invalid blob key: {key!r}")
+        return os.path.join(self.directory, safe_key + self.suffix)
+
+    def put(self, key: str, data: bytes) -> None:
+        path = self._path(key)
+        with path_lock(path):
+            atomic_write_bytes(path, data)
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key: str) -> bool:
+        path = self._path(key)
+        with path_lock(path):
+            try:
+                os.remove(path)
+                return True
+            except FileNotFoundError:
+                return False
+
+
+# --- Factories ---
+
+# One shared instance per store so every module goes through the same locks
+_stores: Dict[Tuple[str, str], Any] = {}
+_stores_lock = threading.Lock()
+
+
+def _shared(kind: str, name: str, factory: Callable[[], Any]) -> Any:
+    with _stores_lock:
+        if (kind, name) not in _stores:
+            _stores[(kind, name)] = factory()
+        return _stores[(kind, name)]
+
+
+def open_event_log(name: str, backend: Optional[str] = None) -> EventLog:
+    """
+    Return the shared event log called name (e.g. 'user_history').
+
+    A legacy ``<name>.json`` array in the data directory is imported once by the
+    JSONL and SQLite backends; the JSON backend uses that file directly.
+    """
+    backend = (backend or EVENT_LOG_BACKEND).lower()
+    legacy_json_path = data_path(f"{name}.json")
+    if backend == 'jsonl':
+        return _shared('event_log', name, lambda: open_log(data_path(name), legacy_json_path=legacy_json_path))
+    if backend == 'sqlite':
+        return _shared('event_log', name, lambda: SqliteEventLog(data_path(f"{name}.db"), legacy_json_path=legacy_json_path))
+    if backend == 'json':
+        return _shared('event_log', name, lambda: JsonArrayLog(legacy_json_path))
+    raise ValueError(f"Unknown event log backend: {backend}")
+
+
+def open_user_store(backend: Optional[str] = None) -> UserStore:
+    """Return the shared user store."""
+    backend = (backend or USER_STORE_BACKEND).lower()
+    if backend == 'sqlite':
+        return _shared('users', backend, lambda: SqliteUserStore(data_path('users.db'), legacy_json_path=data_path('users.json')))
+    if backend == 'json':
+        return _shared('users', backend, lambda: JsonUserStore(data_path('users.json')))
+    raise ValueError(f"Unknown user store backend: {backend}")
+
+
+def open_blob_store(name: str, suffix: str = '') -> BlobStore:
+    """Return the shared blob store kept in the data directory's name/ folder."""
+    return _shared('blobs', name, lambda: FileBlobStore(data_path(name), suffix))
+
+
+def flush_all() -> None:
+    """Flush every open event log."""
+    with _stores_lock:
+        stores = list(_stores.values())
+    for store in stores:
+        if isinstance(store, EventLog):
+            try:
+                store.flush()
+            except Exception as e:
+                logger.error(f"Failed to flush {getattr(store, 'base_path', store)}: {e}")
@@ -1,25 +1,45 @@
 # -*- coding: utf-8 -*-
 """User History Module"""
 
-import json
-import os
 import logging
-import threading
 from datetime import datetime
+from typing import Any, Dict, Iterator, Optional
+
+from .storage import EventLog, open_event_log
+from .write_behind import log_event
+from .pagination import page_event_log
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-CURRENT_FILE_DIR = os.path.dirname(os.path.abspath(__file__))
-PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_FILE_DIR, '..'))
-STREAMLIT_APP_DIR = os.path.join(PROJECT_ROOT, 'streamlit_app')
-HISTORY_FILE = os.path.join(STREAMLIT_APP_DIR, 'user_history.json')
-file_lock = threading.Lock()
+HISTORY_LOG_NAME = 'user_history'
+
+def get_history_log() -> EventLog:
+    """Return the append-only history log."""
+    return open_event_log(HISTORY_LOG_NAME)
+
+def iter_history(reverse: bool = False) -> Iterator[Dict[str, Any]]:
+    """Stream history entries oldest first (or newest first)."""
+    try:
+        yield from get_history_log().iter_entries(reverse=reverse)
+    except Exception as e:
+        logger.error(f"Failed to read history: {e}")
+
+def list_history(limit: int = 50, cursor: Optional[str] = None, newest_first: bool = True) -> Dict[str, Any]:
+    """One page of history as {'items', 'next_cursor'}."""
+    try:
+        return page_event_log(get_history_log(), limit=limit, cursor=cursor, newest_first=newest_first)
+    except Exception as e:
+        logger.error(f"Failed to list history: {e}")
+        return {'items': [], 'next_cursor': None, 'error': str(e)}
 
 def log_user_query(user_id: str, query: str, language: str, generated_code: str, explanation: str, model_name: str) -> None:
     """
     Logs user query and generated response to history.
+
+    The entries are queued for the background writer, so this returns without
+    touching the disk.
     """
     entry = {
         'timestamp': datetime.now().isoformat(),
@@ -31,34 +51,15 @@ def log_user_query(user_id: str, query: str, language: str, generated_code: str,
         'model': model_name
     }
 
-    with file_lock:
-        try:
-            if os.path.exists(HISTORY_FILE):
-                with open(HISTORY_FILE, 'r', encoding='utf-8') as f:
-                    try:
-                        data = json.load(f)
-                        if not isinstance(data, list):
-                            data = []
-                    except json.JSONDecodeError:
-                        data = []
-            else:
-                data = []
-
-            data.append(entry)
-
-            os.makedirs(os.path.dirname(HISTORY_FILE), exist_ok=True)
-            with open(HISTORY_FILE, 'w', encoding='utf-8') as f:
-                json.dump(data, f, indent=4)
-            
-            # Also log to activity
-            try:
-                import sys
-                if PROJECT_ROOT not in sys.path:
-                    sys.path.append(PROJECT_ROOT)
-                from backend.user_management_module import log_user_activity
-                log_user_activity(user_id, 'query', query, language, 0, "", model_name)
-            except Exception as e:
-                logger.warning(f"Could not log to user activity: {e}")
+    try:
+        log_event(HISTORY_LOG_NAME, entry)
+    except Exception as e:
+        logger.error(f"Failed to log history: {e}")
+        return
 
-        except Exception as e:
-            logger.error(f"Failed to log history: {e}")
+    # Also log to activity
+    try:
+        from .user_management_module import log_user_activity
+        log_user_activity(user_id, 'query', query, language, 0, "", model_name)
+    except Exception as e:
+        logger.warning(f"Could not log to user activity: {e}")
@@ -5,29 +5,28 @@ Handles user registration, login tracking, member replacement, and activity hist
 Now supports RBAC (Admin/User), Security Questions, and SMTP-based OTP.
 """
 
-import json
 import os
+import time
+import atexit
 import logging
 import threading
 import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterator, List, Optional, Any
+
+from .storage import EventLog, UserStore, open_event_log, open_user_store
+from .write_behind import flush_events, log_event
+from .materialized_views import get_user_activity_index
+from .pagination import page_event_log
+from .password_hasher import HasherBusy, LoginThrottled, get_password_hasher
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Resolve to the project's streamlit_app folder
-CURRENT_FILE_DIR = os.path.dirname(os.path.abspath(__file__))
-PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_FILE_DIR, '..'))
-STREAMLIT_APP_DIR = os.path.join(PROJECT_ROOT, 'streamlit_app')
-USERS_FILE = os.path.join(STREAMLIT_APP_DIR, 'users.json')
-USER_ACTIVITY_FILE = os.path.join(STREAMLIT_APP_DIR, 'user_activity.json')
-
-# Use a lock for thread-safe file operations
-file_lock = threading.Lock()
+USER_ACTIVITY_LOG_NAME = 'user_activity'
 
 # SMTP Configuration (Load from env in production)
 SMTP_EMAIL = os.environ.get("SMTP_EMAIL", "")
@@ -35,18 +34,122 @@ SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD", "")
 SMTP_SERVER = os.environ.get("SMTP_SERVER", "smtp.gmail.com")
 SMTP_PORT = int(os.environ.get("SMTP_PORT", 587))
 
+# How often buffered last_login/total_logins updates are written to the user store
+LOGIN_STATS_FLUSH_INTERVAL_S = float(os.environ.get("LOGIN_STATS_FLUSH_INTERVAL_S", 5))
 
-def _ensure_files_exist():
-    """Ensure JSON files exist with proper structure."""
-    os.makedirs(os.path.dirname(USERS_FILE), exist_ok=True)
-    
-    if not os.path.exists(USERS_FILE):
-        with open(USERS_FILE, 'w', encoding='utf-8') as f:
-            json.dump([], f, indent=4)
-    
-    if not os.path.exists(USER_ACTIVITY_FILE):
-        with open(USER_ACTIVITY_FILE, 'w', encoding='utf-8') as f:
-            json.dump([], f, indent=4)
+
+def _get_user_store() -> UserStore:
+    """Return the configured user store."""
+    return open_user_store()
+
+
+def get_activity_log() -> EventLog:
+    """Return the append-only user activity log."""
+    return open_event_log(USER_ACTIVITY_LOG_NAME)
+
+
+class LoginCounterBuffer:
+    """
+    Buffers last_login/total_logins updates and writes them in one transaction.
+
+    A login only bumps an in-memory counter. A background thread writes every
+    pending user in a single store transaction each flush interval, and once more
+    at exit. Readers merge pending counts through ``overlay``.
+    """
+
+    def __init__(self, interval_s: float = LOGIN_STATS_FLUSH_INTERVAL_S):
+        self.interval = max(0.1, interval_s)
+        self._lock = threading.Lock()
+        # user_id -> (logins since last flush, latest login time)
+        self._pending: Dict[str, tuple] = {}
+        self._wake = threading.Event()
+        self.flushes = 0
+        self.logins_written = 0
+        self._thread = threading.Thread(target=self._run, name="login-counters", daemon=True)
+        self._thread.start()
+
+    def record(self, user_id: str) -> None:
+        with self._lock:
+            count, _ = self._pending.get(user_id, (0, None))
+            self._pending[user_id] = (count + 1, datetime.now().isoformat())
+
+    def overlay(self, user: Dict[str, Any]) -> Dict[str, Any]:
+        """Return user with any unflushed logins applied."""
+        with self._lock:
+            pending = self._pending.get(user.get('user_id'))
+        if not pending:
+            return user
+        return {**user, 'total_logins': user.get('total_logins', 0) + pending[0], 'last_login': pending[1]}
+
+    def flush(self) -> int:
+        """Write pending counters now; returns the number of users updated."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        try:
+            with _get_user_store().transaction() as txn:
+                for user_id, (count, last_login) in pending.items():
+                    user = txn.get(user_id)
+                    if user is None:
+                        continue
+                    user['total_logins'] = user.get('total_logins', 0) + count
+                    user['last_login'] = last_login
+                    txn.put(user)
+        except Exception as e:
+            # Put the counts back so the next flush retries them
+            with self._lock:
+                for user_id, (count, last_login) in pending.items():
+                    newer, newest = self._pending.get(user_id, (0, last_login))
+                    self._pending[user_id] = (count + newer, newest)
+            logger.error(f"Failed to flush login counters: {e}")
+            return 0
+        self.flushes += 1
+        self.logins_written += sum(count for count, _ in pending.values())
+        return len(pending)
+
+    def _run(self) -> None:
+        while not self._wake.wait(self.interval):
+            self.flush()
+
+    def close(self) -> None:
+        self._wake.set()
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = sum(count for count, _ in self._pending.values())
+        return {'pending_logins': pending, 'flushes': self.flushes, 'logins_written': self.logins_written}
+
+
+_login_counters: Optional[LoginCounterBuffer] = None
+_login_counters_lock = threading.Lock()
+
+
+def get_login_counters() -> LoginCounterBuffer:
+    """Return the process-wide login counter buffer."""
+    global _login_counters
+    if _login_counters is None:
+        with _login_counters_lock:
+            if _login_counters is None:
+                _login_counters = LoginCounterBuffer()
+    return _login_counters
+
+
+def flush_login_counters() -> int:
+    """Write buffered login counters to the user store now."""
+    return _login_counters.flush() if _login_counters is not None else 0
+
+
+def auth_stats() -> Dict[str, Any]:
+    """Password hashing pool and login counter statistics for the dashboard."""
+    return {**get_password_hasher().stats(), **(_login_counters.stats() if _login_counters is not None else {})}
+
+
+@atexit.register
+def _close_login_counters() -> None:
+    if _login_counters is not None:
+        _login_counters.close()
 
 
 def register_user(user_id: str, username: str, email: str = "", 
@@ -64,68 +167,52 @@ def register_user(user_id: str, username: str, email: str = "",
     Returns:
         Dictionary with user info and success status
     """
-    _ensure_files_exist()
-    
-    with file_lock:
-        try:
-            # Read existing users
-            with open(USERS_FILE, 'r', encoding='utf-8') as f:
-                try:
-                    users = json.load(f)
-                    if not isinstance(users, list):
-                        users = []
-                except json.JSONDecodeError:
-                    users = []
-            
+    try:
+        # Hash security answer if provided
+        sec_answer_hash = None
+        if security_answer:
+            import hashlib
+            sec_answer_hash = hashlib.sha256(security_answer.lower().strip().encode()).hexdigest()
+
+        with _get_user_store().transaction() as txn:
             # Check if user already exists
-            user_idx = next((i for i, u in enumerate(users) if u['user_id'] == user_id), None)
-            
-            # Hash security answer if provided
-            sec_answer_hash = None
-            if security_answer:
-                import hashlib
-                sec_answer_hash = hashlib.sha256(security_answer.lower().strip().encode()).hexdigest()
-
-            user_entry = {
-                'user_id': user_id,
-                'username': username,
-                'email': email,
-                'role': 'user',  # Default role
-                'security_question': security_question,
-                'security_answer_hash': sec_answer_hash,
-                'created_at': datetime.now().isoformat(),
-                'last_login': datetime.now().isoformat(),
-                'total_logins': 1,
-                'total_queries': 0,
-                'average_rating': 0.0,
-                'total_feedback_entries': 0
-            }
+            user = txn.get(user_id)
             
-            if user_idx is not None:
+            if user is not None:
                 # Update existing user
-                users[user_idx]['last_login'] = datetime.now().isoformat()
-                users[user_idx]['total_logins'] = users[user_idx].get('total_logins', 0) + 1
-                users[user_idx]['username'] = username
+                user['last_login'] = datetime.now().isoformat()
+                user['total_logins'] = user.get('total_logins', 0) + 1
+                user['username'] = username
                 if email:
-                    users[user_idx]['email'] = email
+                    user['email'] = email
                 if security_question:
-                    users[user_idx]['security_question'] = security_question
+                    user['security_question'] = security_question
                 if sec_answer_hash:
-                    users[user_idx]['security_answer_hash'] = sec_answer_hash
+                    user['security_answer_hash'] = sec_answer_hash
             else:
                 # Add new user
-                users.append(user_entry)
-            
-            # Write back
-            with open(USERS_FILE, 'w', encoding='utf-8') as f:
-                json.dump(users, f, indent=4)
-            
-            logger.info(f"Successfully registered/updated user {user_id}")
-            return {'success': True, 'user_id': user_id, 'message': 'User registered successfully'}
-            
-        except Exception as e:
-            logger.error(f"Failed to register user: {e}")
-            return {'success': False, 'error': str(e)}
+                user = {
+                    'user_id': user_id,
+                    'username': username,
+                    'email': email,
+                    'role': 'user',  # Default role
+                    'security_question': security_question,
+                    'security_answer_hash': sec_answer_hash,
+                    'created_at': datetime.now().isoformat(),
+                    'last_login': datetime.now().isoformat(),
+                    'total_logins': 1,
+                    'total_queries': 0,
+                    'average_rating': 0.0,
+                    'total_feedback_entries': 0
+                }
+            txn.put(user)
+        
+        logger.info(f"Successfully registered/updated user {user_id}")
+        return {'success': True, 'user_id': user_id, 'message': 'User registered successfully'}
+        
+    except Exception as e:
+        logger.error(f"Failed to register user: {e}")
+        return {'success': False, 'error': str(e)}
 
 
 def log_user_activity(user_id: str, activity_type: str, query: str = "", 
@@ -133,8 +220,6 @@ def log_user_activity(user_id: str, activity_type: str, query: str = "",
     """
     Log user activity (query, feedback, etc).
     """
-    _ensure_files_exist()
-    
     activity_entry = {
         'timestamp': datetime.now().isoformat(),
         'user_id': user_id,
@@ -146,107 +231,92 @@ def log_user_activity(user_id: str, activity_type: str, query: str = "",
         'model': model_name
     }
     
-    with file_lock:
-        try:
-            # Read existing activities
-            if os.path.exists(USER_ACTIVITY_FILE):
-                with open(USER_ACTIVITY_FILE, 'r', encoding='utf-8') as f:
-                    try:
-                        activities = json.load(f)
-                        if not isinstance(activities, list):
-                            activities = []
-                    except json.JSONDecodeError:
-                        activities = []
-            else:
-                activities = []
-            
-            # Append new activity
-            activities.append(activity_entry)
-            
-            # Write back
-            with open(USER_ACTIVITY_FILE, 'w', encoding='utf-8') as f:
-                json.dump(activities, f, indent=4)
-            
-            logger.info(f"Successfully logged activity for user {user_id}")
-            return True
-            
-        except Exception as e:
-            logger.error(f"Failed to log activity: {e}")
-            return False
+    try:
+        return log_event(USER_ACTIVITY_LOG_NAME, activity_entry)
+    except Exception as e:
+        logger.error(f"Failed to log activity: {e}")
+        return False
 
 
-def get_all_users() -> List[Dict[str, Any]]:
-    """Get all registered users."""
-    _ensure_files_exist()
-    
+def list_users(limit: int = 50, cursor: Optional[str] = None, sort: str = 'created',
+               descending: bool = False) -> Dict[str, Any]:
+    """
+    One page of users.
+
+    Args:
+        limit: Page size.
+        cursor: ``next_cursor`` from the previous page.
+        sort: 'created', 'username' or 'user_id'.
+        descending: Reverse the sort order.
+
+    Returns:
+        {'items': [...], 'next_cursor': str or None}, plus 'error' on a bad cursor or sort key.
+    """
     try:
-        with open(USERS_FILE, 'r', encoding='utf-8') as f:
-            try:
-                users = json.load(f)
-                if isinstance(users, list):
-                    return users
-            except json.JSONDecodeError:
-                pass
+        return _get_user_store().page(limit=limit, cursor=cursor, sort=sort, descending=descending)
     except Exception as e:
-        logger.error(f"Failed to read users: {e}")
-    
-    return []
+        logger.error(f"Failed to list users: {e}")
+        return {'items': [], 'next_cursor': None, 'error': str(e)}
+
+
+def get_all_users() -> List[Dict[str, Any]]:
+    """Get all registered users (prefer list_users for anything user-facing)."""
+    users = []
+    cursor = None
+    while True:
+        page = list_users(limit=500, cursor=cursor)
+        users.extend(page['items'])
+        cursor = page['next_cursor']
+        if not cursor:
+            return users
+
+
+def count_users() -> int:
+    """Number of registered users."""
+    return _get_user_store().count()
+
+
+def search_users(text: str, limit: int = 20, offset: int = 0):
+    """Users whose username or user_id contains text; returns (page of users, total matches)."""
+    return _get_user_store().search(text, limit=limit, offset=offset)
 
 
 def get_user_by_username(username: str) -> Optional[Dict[str, Any]]:
     """Get user by username (case-insensitive)."""
-    users = get_all_users()
-    username = (username or '').strip().lower()
-    return next((u for u in users if str(u.get('username','')).strip().lower() == username), None)
+    return _get_user_store().get_by_username(username)
 
 
-def _save_users(users: List[Dict[str, Any]]) -> bool:
-    """Save users list to USERS_FILE atomically."""
-    try:
-        with open(USERS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(users, f, indent=4)
-        return True
-    except Exception as e:
-        logger.error(f"Failed to save users: {e}")
-        return False
+def get_user_by_email(email: str) -> Optional[Dict[str, Any]]:
+    """Get user by email (case-insensitive)."""
+    return _get_user_store().get_by_email(email)
+
+
+def _hash_password(password: str, salt: Optional[bytes] = None) -> Dict[str, Any]:
+    """Return dict with hex salt, password hash and iteration count (pbkdf2_hmac on the hasher pool)."""
+    return get_password_hasher().hash_password(password, salt)
 
 
-def _hash_password(password: str, salt: Optional[bytes] = None) -> Dict[str, str]:
-    """Return dict with hex salt and password hash using pbkdf2_hmac."""
-    import hashlib, binascii, os
-    if salt is None:
-        salt = os.urandom(16)
-    dk = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, 100_000)
-    return {'salt': binascii.hexlify(salt).decode('ascii'), 'hash': binascii.hexlify(dk).decode('ascii')}
+def _store_password(user: Dict[str, Any], ph: Dict[str, Any]) -> None:
+    user['password_salt'] = ph['salt']
+    user['password_hash'] = ph['hash']
+    user['password_iterations'] = ph['iterations']
 
 
 def set_password_for_user(user_id: str, password: str) -> Dict[str, Any]:
     """Set or replace a user's password (stores hash+salt)."""
-    _ensure_files_exist()
-    with file_lock:
-        try:
-            with open(USERS_FILE, 'r', encoding='utf-8') as f:
-                try:
-                    users = json.load(f)
-                    if not isinstance(users, list):
-                        users = []
-                except json.JSONDecodeError:
-                    users = []
-
-            idx = next((i for i, u in enumerate(users) if u['user_id'] == user_id), None)
-            if idx is None:
+    try:
+        ph = _hash_password(password)
+        with _get_user_store().transaction() as txn:
+            user = txn.get(user_id)
+            if user is None:
                 return {'success': False, 'error': 'User not found'}
-
-            ph = _hash_password(password)
-            users[idx]['password_salt'] = ph['salt']
-            users[idx]['password_hash'] = ph['hash']
-
-            _save_users(users)
-            logger.info(f"Password set for user {user_id}")
-            return {'success': True}
-        except Exception as e:
-            logger.error(f"Failed to set password: {e}")
-            return {'success': False, 'error': str(e)}
+            _store_password(user, ph)
+            txn.put(user)
+        logger.info(f"Password set for user {user_id}")
+        return {'success': True}
+    except Exception as e:
+        logger.error(f"Failed to set password: {e}")
+        return {'success': False, 'error': str(e)}
 
 
 def register_user_with_password(user_id: str, username: str, password: str, email: str = "", 
@@ -262,6 +332,9 @@ def verify_user_password(user_identifier: str, password: str) -> Dict[str, Any]:
     """
     Verify a user's password. user_identifier may be user_id or username.
     Returns {'success': True, 'user_id': ..., 'role': ...} on success.
+
+    Hashing runs on the bounded hasher pool; throttled or busy attempts fail with
+    a 'retry_after' hint. The login is counted through the batched login counters.
     """
     try:
         # Try user_id first
@@ -276,26 +349,25 @@ def verify_user_password(user_identifier: str, password: str) -> Dict[str, Any]:
         if not salt_hex or not hash_hex:
             return {'success': False, 'error': 'Password not set for user'}
 
-        import binascii, hashlib
-        salt = binascii.unhexlify(salt_hex.encode('ascii'))
-        attempt = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, 100_000)
-        if binascii.hexlify(attempt).decode('ascii') == hash_hex:
-            # update last_login and total_logins
-            with file_lock:
-                with open(USERS_FILE, 'r', encoding='utf-8') as f:
-                    try:
-                        users = json.load(f)
-                    except json.JSONDecodeError:
-                        users = []
-                for u in users:
-                    if u.get('user_id') == user.get('user_id'):
-                        u['last_login'] = datetime.now().isoformat()
-                        u['total_logins'] = u.get('total_logins', 0) + 1
-                        break
-                _save_users(users)
-
-            return {'success': True, 'user_id': user.get('user_id'), 'role': user.get('role', 'user')}
-        return {'success': False, 'error': 'Invalid password'}
+        hasher = get_password_hasher()
+        iterations = user.get('password_iterations')
+        if not hasher.verify(user['user_id'], password, salt_hex, hash_hex, iterations):
+            return {'success': False, 'error': 'Invalid password'}
+
+        get_login_counters().record(user['user_id'])
+        if iterations != hasher.iterations:
+            # Re-hash with the configured iteration count while the password is at hand
+            ph = hasher.hash_password(password)
+            with _get_user_store().transaction() as txn:
+                current = txn.get(user['user_id'])
+                if current is not None and current.get('password_hash') == hash_hex:
+                    _store_password(current, ph)
+                    txn.put(current)
+        return {'success': True, 'user_id': user.get('user_id'), 'role': user.get('role', 'user')}
+    except LoginThrottled as e:
+        return {'success': False, 'error': str(e), 'retry_after': round(e.retry_after, 1)}
+    except HasherBusy as e:
+        return {'success': False, 'error': str(e), 'retry_after': 1.0}
     except Exception as e:
         logger.error(f"Error verifying password: {e}")
         return {'success': False, 'error': str(e)}
@@ -340,18 +412,12 @@ def generate_password_reset_otp(user_identifier: str, valid_minutes: int = 10) -
         otp = str(random.randint(100000, 999999))
         expiry = (datetime.now() + timedelta(minutes=valid_minutes)).isoformat()
 
-        with file_lock:
-            with open(USERS_FILE, 'r', encoding='utf-8') as f:
-                try:
-                    users = json.load(f)
-                except json.JSONDecodeError:
-                    users = []
-            for u in users:
-                if u.get('user_id') == user.get('user_id'):
-                    u['password_reset_otp'] = otp
-                    u['password_reset_otp_expiry'] = expiry
-                    break
-            _save_users(users)
+        with _get_user_store().transaction() as txn:
+            current = txn.get(user['user_id'])
+            if current is not None:
+                current['password_reset_otp'] = otp
+                current['password_reset_otp_expiry'] = expiry
+                txn.put(current)
 
         # Try to send email
         email_sent = False
@@ -372,18 +438,8 @@ def reset_password_with_otp(user_identifier: str, otp: str, new_password: str) -
         if not user:
             return {'success': False, 'error': 'User not found'}
 
-        with file_lock:
-            with open(USERS_FILE, 'r', encoding='utf-8') as f:
-                try:
-                    users = json.load(f)
-                except json.JSONDecodeError:
-                    users = []
-
-            target = None
-            for u in users:
-                if u.get('user_id') == user.get('user_id'):
-                    target = u
-                    break
+        with _get_user_store().transaction() as txn:
+            target = txn.get(user['user_id'])
 
             if not target:
                 return {'success': False, 'error': 'User not found during reset'}
@@ -398,15 +454,15 @@ def reset_password_with_otp(user_identifier: str, otp: str, new_password: str) -
 
             # Set new password
             ph = _hash_password(new_password)
-            target['password_salt'] = ph['salt']
-            target['password_hash'] = ph['hash']
+            _store_password(target, ph)
             # Clear OTP
             target.pop('password_reset_otp', None)
             target.pop('password_reset_otp_expiry', None)
 
-            _save_users(users)
-            logger.info(f"Password reset for user {user.get('user_id')}")
-            return {'success': True}
+            txn.put(target)
+        get_password_hasher().forget(user['user_id'])
+        logger.info(f"Password reset for user {user.get('user_id')}")
+        return {'success': True}
     except Exception as e:
         logger.error(f"Failed to reset password: {e}")
         return {'success': False, 'error': str(e)}
@@ -438,65 +494,76 @@ def reset_password_with_security_question(user_identifier: str, answer: str, new
 
 def promote_user_to_admin(user_id: str) -> Dict[str, Any]:
     """Promote a user to admin role (max 2 admins)."""
-    _ensure_files_exist()
-    with file_lock:
-        try:
-            with open(USERS_FILE, 'r', encoding='utf-8') as f:
-                users = json.load(f)
-            
+    try:
+        with _get_user_store().transaction() as txn:
             # Count existing admins
-            admin_count = sum(1 for u in users if u.get('role') == 'admin')
+            admin_count = txn.count_by_role('admin')
             if admin_count >= 2:
                 return {'success': False, 'error': 'Maximum number of admins (2) reached.'}
             
-            target = next((u for u in users if u['user_id'] == user_id), None)
+            target = txn.get(user_id)
             if not target:
                 return {'success': False, 'error': 'User not found'}
             
             target['role'] = 'admin'
-            _save_users(users)
-            return {'success': True, 'message': f"User {user_id} promoted to admin."}
-        except Exception as e:
-            return {'success': False, 'error': str(e)}
+            txn.put(target)
+        return {'success': True, 'message': f"User {user_id} promoted to admin."}
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
 
 
 def get_user_by_id(user_id: str) -> Optional[Dict[str, Any]]:
     """Get specific user information."""
-    users = get_all_users()
-    return next((u for u in users if u['user_id'] == user_id), None)
+    return _get_user_store().get_by_id(user_id)
 
 
-def get_user_activity(user_id: str = None) -> List[Dict[str, Any]]:
-    """Get activity history for a specific user or all users."""
-    _ensure_files_exist()
+def iter_user_activity(user_id: str = None, reverse: bool = False) -> Iterator[Dict[str, Any]]:
+    """Stream activity entries for a specific user or all users."""
     try:
-        with open(USER_ACTIVITY_FILE, 'r', encoding='utf-8') as f:
-            try:
-                activities = json.load(f)
-                if isinstance(activities, list):
-                    if user_id:
-                        return [a for a in activities if a['user_id'] == user_id]
-                    return activities
-            except json.JSONDecodeError:
-                pass
+        for activity in get_activity_log().iter_entries(reverse=reverse):
+            if not user_id or activity.get('user_id') == user_id:
+                yield activity
     except Exception as e:
         logger.error(f"Failed to read activities: {e}")
-    return []
+
+
+def list_user_activity(user_id: str = None, limit: int = 50, cursor: Optional[str] = None,
+                       newest_first: bool = True) -> Dict[str, Any]:
+    """One page of activity for a user (via the per-user index) or for everyone."""
+    try:
+        if user_id:
+            return get_user_activity_index().page(user_id, limit=limit, cursor=cursor, newest_first=newest_first)
+        return page_event_log(get_activity_log(), limit=limit, cursor=cursor, newest_first=newest_first)
+    except Exception as e:
+        logger.error(f"Failed to list activities: {e}")
+        return {'items': [], 'next_cursor': None, 'error': str(e)}
+
+
+def get_user_activity(user_id: str = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Get activity history (oldest first) for a specific user or all users.
+
+    A single user's entries are read through the per-user activity index, so only
+    that user's entries are touched; ``limit`` keeps just the newest ones.
+    """
+    if user_id:
+        try:
+            return get_user_activity_index().entries(user_id, limit)
+        except Exception as e:
+            logger.error(f"Failed to read activities: {e}")
+            return []
+    activities = list(iter_user_activity())
+    return activities[-limit:] if limit else activities
 
 
 def replace_user(old_user_id: str, new_user_id: str, new_username: str, new_email: str = "") -> Dict[str, Any]:
     """Replace an old user with a new user (transfer/reassign)."""
-    _ensure_files_exist()
-    with file_lock:
-        try:
-            with open(USERS_FILE, 'r', encoding='utf-8') as f:
-                users = json.load(f)
-            
-            user_idx = next((i for i, u in enumerate(users) if u['user_id'] == old_user_id), None)
-            if user_idx is None:
+    try:
+        with _get_user_store().transaction() as txn:
+            old_user = txn.get(old_user_id)
+            if old_user is None:
                 return {'success': False, 'error': f'User {old_user_id} not found'}
             
-            old_user = users[user_idx]
             new_user = old_user.copy()
             new_user.update({
                 'user_id': new_user_id,
@@ -504,62 +571,49 @@ def replace_user(old_user_id: str, new_user_id: str, new_username: str, new_emai
                 'email': new_email,
                 'last_login': datetime.now().isoformat()
             })
-            
-            users[user_idx] = new_user
-            _save_users(users)
-            
-            # Update activities
-            with open(USER_ACTIVITY_FILE, 'r', encoding='utf-8') as f:
-                activities = json.load(f)
-                for activity in activities:
-                    if activity['user_id'] == old_user_id:
-                        activity['user_id'] = new_user_id
-            
-            with open(USER_ACTIVITY_FILE, 'w', encoding='utf-8') as f:
-                json.dump(activities, f, indent=4)
-            
-            return {'success': True, 'message': 'User replaced successfully'}
-        except Exception as e:
-            return {'success': False, 'error': str(e)}
+            txn.rename(old_user_id, new_user)
+        
+        # Update activities (including any still waiting in the write-behind queue)
+        flush_events()
+        def _reassign(activity):
+            if activity.get('user_id') == old_user_id:
+                activity['user_id'] = new_user_id
+            return activity
+        get_activity_log().rewrite(_reassign)
+        
+        return {'success': True, 'message': 'User replaced successfully'}
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
 
 
 def delete_user(user_id: str) -> Dict[str, Any]:
     """Delete a user from the system."""
-    _ensure_files_exist()
-    with file_lock:
-        try:
-            with open(USERS_FILE, 'r', encoding='utf-8') as f:
-                users = json.load(f)
-            
-            users = [u for u in users if u['user_id'] != user_id]
-            _save_users(users)
-            return {'success': True, 'message': 'User deleted successfully'}
-        except Exception as e:
-            return {'success': False, 'error': str(e)}
+    try:
+        with _get_user_store().transaction() as txn:
+            txn.delete(user_id)
+        return {'success': True, 'message': 'User deleted successfully'}
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
 
 
 def get_user_stats(user_id: str) -> Dict[str, Any]:
     """Get aggregated statistics for a specific user."""
     user = get_user_by_id(user_id)
-    activities = get_user_activity(user_id)
     
     if not user:
         return {}
+    user = get_login_counters().overlay(user)
     
-    queries = [a for a in activities if a['activity_type'] == 'query']
-    feedbacks = [a for a in activities if a['activity_type'] == 'feedback']
-    
-    ratings = [a['rating'] for a in feedbacks if a['rating'] > 0]
-    avg_rating = sum(ratings) / len(ratings) if ratings else 0.0
+    counters = get_user_activity_index().counters(user_id)
     
     return {
         **user,
-        'total_queries': len(queries),
-        'total_feedback': len(feedbacks),
-        'average_rating': round(avg_rating, 2),
+        'total_queries': counters['queries'],
+        'total_feedback': counters['feedbacks'],
+        'average_rating': counters['average_rating'],
         'activities': {
-            'queries': len(queries),
-            'feedbacks': len(feedbacks),
+            'queries': counters['queries'],
+            'feedbacks': counters['feedbacks'],
             'logins': user.get('total_logins', 0)
         }
     }
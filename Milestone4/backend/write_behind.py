@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""Write-Behind Module
+
+Takes history, activity and feedback writes off the request path. Callers only
+enqueue an event. A background thread drains the queue and writes each log's
+events with one ``append_many`` call. It flushes when a batch fills up or when the
+flush interval passes, and once more at shutdown.
+"""
+
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from .storage import open_event_log
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Write-behind knobs (Load from env in production)
+WRITE_BEHIND_ENABLED = os.environ.get("WRITE_BEHIND_ENABLED", "true").lower() in ("1", "true", "yes")
+WRITE_BEHIND_QUEUE_SIZE = int(os.environ.get("WRITE_BEHIND_QUEUE_SIZE", 10000))
+WRITE_BEHIND_BATCH_SIZE = int(os.environ.get("WRITE_BEHIND_BATCH_SIZE", 256))
+WRITE_BEHIND_FLUSH_INTERVAL_MS = float(os.environ.get("WRITE_BEHIND_FLUSH_INTERVAL_MS", 200))
+# How long a producer waits for room in a full queue before the event is dropped
+WRITE_BEHIND_BLOCK_TIMEOUT_MS = float(os.environ.get("WRITE_BEHIND_BLOCK_TIMEOUT_MS", 50))
+
+
+class WriteBehindQueue:
+    """Bounded queue of (log name, entry) events drained by one background writer."""
+
+    def __init__(self, max_size: int = WRITE_BEHIND_QUEUE_SIZE, batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+                 flush_interval_ms: float = WRITE_BEHIND_FLUSH_INTERVAL_MS,
+                 block_timeout_ms: float = WRITE_BEHIND_BLOCK_TIMEOUT_MS):
+        self.max_size = max(1, max_size)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.0, flush_interval_ms) / 1000.0
+        self.block_timeout = max(0.0, block_timeout_ms) / 1000.0
+        self._queue: "queue.Queue[Tuple[str, Dict[str, Any]]]" = queue.Queue(self.max_size)
+        self._stats_lock = threading.Lock()
+        # Signalled whenever the writer finishes a batch
+        self._drained = threading.Condition()
+        self._pending = 0
+        # submit() calls between their closed check and their enqueue
+        self._submitting = 0
+        self._closed = False
+        self.enqueued = 0
+        self.written = 0
+        self.batches = 0
+        self.dropped = 0
+        self.backpressure_waits = 0
+        self.write_errors = 0
+        self.max_depth = 0
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def submit(self, log_name: str, entry: Dict[str, Any]) -> bool:
+        """
+        Queue one event for log_name.
+
+        Returns immediately when there is room. When the queue is full the caller
+        waits up to the block timeout (backpressure), after which the event is
+        dropped and counted. Returns whether the event was accepted.
+
+        After close() the event is written synchronously instead.
+        """
+        with self._drained:
+            closed = self._closed
+            if not closed:
+                self._pending += 1
+                self._submitting += 1
+        if closed:
+            self._write([(log_name, entry)])
+            return True
+        try:
+            try:
+                self._queue.put_nowait((log_name, entry))
+            except queue.Full:
+                with self._stats_lock:
+                    self.backpressure_waits += 1
+                try:
+                    self._queue.put((log_name, entry), timeout=self.block_timeout)
+                except queue.Full:
+                    with self._drained:
+                        self._pending -= 1
+                        self._drained.notify_all()
+                    with self._stats_lock:
+                        self.dropped += 1
+                    logger.warning(f"Write-behind queue full, dropped a {log_name} event")
+                    return False
+        finally:
+            with self._drained:
+                self._submitting -= 1
+                self._drained.notify_all()
+        with self._stats_lock:
+            self.enqueued += 1
+            self.max_depth = max(self.max_depth, self._queue.qsize())
+        return True
+
+    def _collect(self) -> List[Tuple[str, Dict[str, Any]]]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: List[Tuple[str, Dict[str, Any]]]) -> None:
+        # Group by log, keeping arrival order within each log
+        by_log: Dict[str, List[Dict[str, Any]]] = {}
+        for log_name, entry in batch:
+            by_log.setdefault(log_name, []).append(entry)
+        for log_name, entries in by_log.items():
+            try:
+                open_event_log(log_name).append_many(entries)
+                with self._stats_lock:
+                    self.written += len(entries)
+            except Exception as e:
+                with self._stats_lock:
+                    self.write_errors += len(entries)
+                logger.error(f"Write-behind failed to write {len(entries)} {log_name} events: {e}")
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            events = [event for event in batch if event[0] is not None]
+            stop = len(events) < len(batch)
+            if events:
+                self._write(events)
+                with self._stats_lock:
+                    self.batches += 1
+            with self._drained:
+                self._pending -= len(events)
+                self._drained.notify_all()
+            if stop:
+                return
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until every accepted event has been written. Returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._drained:
+            while self._pending > 0:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._drained.wait(remaining)
+        return True
+
+    def close(self, timeout: Optional[float] = 10.0) -> None:
+        """Write everything still queued and stop the writer thread."""
+        with self._drained:
+            if self._closed:
+                return
+            self._closed = True
+            # Submits already past the closed check enqueue before the stop marker
+            while self._submitting > 0:
+                self._drained.wait()
+        self._queue.put((None, None))
+        self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                'queue_depth': self._queue.qsize(),
+                'max_queue_size': self.max_size,
+                'max_depth': self.max_depth,
+                'enqueued': self.enqueued,
+                'written': self.written,
+                'batches': self.batches,
+                'avg_batch_size': round(self.written / self.batches, 2) if self.batches else 0.0,
+                'dropped': self.dropped,
+                'backpressure_waits': self.backpressure_waits,
+                'write_errors': self.write_errors
+            }
+
+
+_writer: Optional[WriteBehindQueue] = None
+_writer_lock = threading.Lock()
+
+
+def get_write_behind() -> WriteBehindQueue:
+    """Return the process-wide write-behind queue, starting its writer on first use."""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = WriteBehindQueue()
+    return _writer
+
+
+def log_event(log_name: str, entry: Dict[str, Any]) -> bool:
+    """
+    Record entry in the named event log without waiting for the disk.
+
+    With WRITE_BEHIND_ENABLED=false the entry is written synchronously instead.
+    """
+    if not WRITE_BEHIND_ENABLED:
+        open_event_log(log_name).append(entry)
+        return True
+    return get_write_behind().submit(log_name, entry)
+
+
+def flush_events(timeout: Optional[float] = None) -> bool:
+    """Wait until queued events are on disk (e.g. before reading a log back in full)."""
+    if _writer is None:
+        return True
+    return _writer.flush(timeout)
+
+
+def write_behind_stats() -> Dict[str, Any]:
+    stats = _writer.stats() if _writer is not None else {}
+    return {'enabled': WRITE_BEHIND_ENABLED, **stats}
+
+
+@atexit.register
+def _close_writer() -> None:
+    # Registered after the storage modules, so it runs before their logs are closed
+    if _writer is not None:
+        _writer.close()
@@ -0,0 +1,441 @@
+# -*- coding: utf-8 -*-
+"""Inference Benchmark
+
+Drives the model server API with a configurable request mix and concurrency and
+reports latency, time to first token, tokens/sec and requests/sec.
+
+By default the FastAPI app is started in this process on a free local port,
+with every entry of MODELS_CONFIG pointing at a tiny offline model
+(benchmarks/tiny_model.py). The run needs no GPU, no network and no tokens, and
+decoding is greedy, so runs on the same machine can be compared. With --url an
+already running server (e.g. ``python -m backend.serve``) is benchmarked
+instead.
+
+Results are written as JSON with the commit they were measured on. Compare two
+runs with --compare:
+
+    python -m benchmarks.inference_benchmark --mix mixed --concurrency 8 --output before.json
+    python -m benchmarks.inference_benchmark --mix mixed --concurrency 8 --compare before.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.append(PROJECT_ROOT)
+
+# Generation requests: (prompt, language)
+PROMPTS = [
+    ("reverse a linked list in place", "Python"),
+    ("parse a CSV file and sum the second column", "Python"),
+    ("debounce a function", "JavaScript"),
+    ("binary search over a sorted vector", "C++"),
+    ("a thread-safe singleton", "Java"),
+    ("top 5 customers by total order value", "SQL"),
+    ("an HTTP handler that returns JSON", "Go"),
+    ("memoize a recursive fibonacci function", "Python"),
+]
+
+# Explanation requests: (code, style)
+CODE_SNIPPETS = [
+    ("def fib(n):\n    return n if n < 2 else fib(n - 1) + fib(n - 2)", "Beginner-Friendly"),
+    ("const sum = xs => xs.reduce((a, b) => a + b, 0);", "Technical Deep-Dive"),
+    ("SELECT name, COUNT(*) FROM orders GROUP BY name HAVING COUNT(*) > 3;", "Step-by-Step Guide"),
+    ("for i in range(10):\n    if i % 2:\n        print(i)", "Beginner-Friendly"),
+]
+
+# Request kinds: (endpoint, streamed, build payload from rng)
+REQUEST_KINDS = {
+    'generate': ('/generate', False, lambda rng: _generate_payload(rng)),
+    'generate_stream': ('/generate/stream', True, lambda rng: _generate_payload(rng)),
+    'explain': ('/explain', False, lambda rng: _explain_payload(rng)),
+    'explain_stream': ('/explain/stream', True, lambda rng: _explain_payload(rng)),
+    # Deterministic and drawn from two prompts, so most are answered from the response cache
+    'generate_cached': ('/generate', False, lambda rng: {**_generate_payload(rng, PROMPTS[:2]), 'deterministic': True}),
+    'generate_speculative': ('/generate/stream', True, lambda rng: {**_generate_payload(rng), 'speculative': True}),
+}
+
+# Prompt mixes: kind -> relative weight
+MIXES = {
+    'generate': {'generate_stream': 1},
+    'explain': {'explain_stream': 1},
+    'mixed': {'generate_stream': 5, 'explain_stream': 3, 'generate': 1, 'explain': 1},
+    'batched': {'generate': 1},
+    'cached': {'generate_cached': 1},
+    'speculative': {'generate_speculative': 1},
+}
+
+
+def _generate_payload(rng: random.Random, prompts=PROMPTS) -> Dict[str, Any]:
+    prompt, language = rng.choice(prompts)
+    return {'prompt': prompt, 'language': language, 'model': 'gemma', 'bypass_cache': False}
+
+
+def _explain_payload(rng: random.Random) -> Dict[str, Any]:
+    code, style = rng.choice(CODE_SNIPPETS)
+    return {'code': code, 'style': style, 'model': 'deepseek'}
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """
+    p50/p95/p99 (nearest rank), mean and max of values in seconds, as milliseconds.
+
+    The q-th percentile is the smallest value with at least q of the values at or
+    below it:
+
+    >>> stats = percentiles([i / 1000 for i in range(1, 101)])
+    >>> stats['p50'], stats['p95'], stats['p99'], stats['max']
+    (50.0, 95.0, 99.0, 100.0)
+    >>> percentiles([0.001, 0.002, 0.003])['p50']
+    2.0
+    """
+    # Same percentile definition as the server's /metrics. Imported here, not at the
+    # top: backend modules read their env knobs on import, before InProcessServer sets them
+    from backend.batch_scheduler import nearest_rank
+
+    if not values:
+        return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'mean': 0.0, 'max': 0.0}
+    ordered = sorted(values)
+    return {
+        'p50': round(nearest_rank(ordered, 0.50) * 1000, 2),
+        'p95': round(nearest_rank(ordered, 0.95) * 1000, 2),
+        'p99': round(nearest_rank(ordered, 0.99) * 1000, 2),
+        'mean': round(sum(ordered) / len(ordered) * 1000, 2),
+        'max': round(ordered[-1] * 1000, 2)
+    }
+
+
+class TokenCounter:
+    """Counts output tokens with the model's tokenizer, or stream chunks / words without one."""
+
+    def __init__(self, tokenizer=None):
+        self.tokenizer = tokenizer
+        self.unit = 'tokens' if tokenizer is not None else 'chunks'
+
+    def count(self, text: str, chunks: int) -> int:
+        if self.tokenizer is not None:
+            return len(self.tokenizer(text, add_special_tokens=False).input_ids)
+        return chunks or len(text.split())
+
+
+async def _send(client: httpx.AsyncClient, kind: str, payload: Dict[str, Any], counter: TokenCounter) -> Dict[str, Any]:
+    endpoint, streamed, _ = REQUEST_KINDS[kind]
+    result = {'kind': kind, 'ok': False, 'status': None, 'latency_s': 0.0, 'ttft_s': None, 'tokens': 0, 'cached': False}
+    start = time.perf_counter()
+    text, chunks = "", 0
+    try:
+        if streamed:
+            async with client.stream('POST', endpoint, json=payload) as response:
+                result['status'] = response.status_code
+                if response.status_code == 200:
+                    event = "message"
+                    async for line in response.aiter_lines():
+                        if not line:
+                            event = "message"
+                        elif line.startswith("event:"):
+                            event = line[len("event:"):].strip()
+                        elif line.startswith("data:"):
+                            if event == "error":
+                                result['error'] = json.loads(line[len("data:"):]).get('error')
+                                break
+                            if event == "done":
+                                result['ok'] = True
+                                break
+                            token = json.loads(line[len("data:"):]).get('token', '')
+                            if token and result['ttft_s'] is None:
+                                result['ttft_s'] = time.perf_counter() - start
+                            text += token
+                            chunks += 1
+                else:
+                    result['error'] = (await response.aread()).decode('utf-8', 'replace')[:200]
+        else:
+            response = await client.post(endpoint, json=payload)
+            result['status'] = response.status_code
+            if response.status_code == 200:
+                body = response.json()
+                text = body.get('code') or body.get('explanation') or ""
+                result['cached'] = bool(body.get('cached'))
+                result['ok'] = not text.startswith("Error")
+                result['ttft_s'] = time.perf_counter() - start
+            else:
+                result['error'] = response.text[:200]
+    except httpx.HTTPError as e:
+        result['error'] = str(e)
+    result['latency_s'] = time.perf_counter() - start
+    result['tokens'] = counter.count(text, chunks) if result['ok'] else 0
+    return result
+
+
+def summarize(results: List[Dict[str, Any]], duration_s: float, unit: str) -> Dict[str, Any]:
+    """Aggregate per-request results into the reported metrics."""
+    ok = [r for r in results if r['ok']]
+    tokens = sum(r['tokens'] for r in ok)
+    statuses: Dict[str, int] = {}
+    for r in results:
+        statuses[str(r['status'])] = statuses.get(str(r['status']), 0) + 1
+    return {
+        'requests': len(results),
+        'errors': len(results) - len(ok),
+        'status_codes': dict(sorted(statuses.items())),
+        'cached_responses': sum(1 for r in ok if r['cached']),
+        'duration_s': round(duration_s, 3),
+        'requests_per_s': round(len(ok) / duration_s, 3) if duration_s else 0.0,
+        'token_unit': unit,
+        'output_tokens': tokens,
+        'tokens_per_s': round(tokens / duration_s, 2) if duration_s else 0.0,
+        'latency_ms': percentiles([r['latency_s'] for r in ok]),
+        'ttft_ms': percentiles([r['ttft_s'] for r in ok if r['ttft_s'] is not None]),
+        # Decode speed seen by one client: tokens after the first one over the time they took
+        'per_request_tokens_per_s': percentiles([
+            (r['tokens'] - 1) / (r['latency_s'] - r['ttft_s']) / 1000
+            for r in ok if r['tokens'] > 1 and r['ttft_s'] is not None and r['latency_s'] > r['ttft_s']
+        ])
+    }
+
+
+async def run_load(base_url: str, headers: Dict[str, str], mix: Dict[str, int], concurrency: int, total: int,
+                   warmup: int, seed: int, counter: TokenCounter, ready_timeout_s: float) -> Dict[str, Any]:
+    """Wait for /readyz, send the warmup requests, then run ``total`` requests from ``concurrency`` clients."""
+    rng = random.Random(seed)
+    kinds = list(mix)
+    plan = [(kind, REQUEST_KINDS[kind][2](rng)) for kind in rng.choices(kinds, weights=[mix[k] for k in kinds], k=warmup + total)]
+    limits = httpx.Limits(max_connections=concurrency + 2, max_keepalive_connections=concurrency + 2)
+    async with httpx.AsyncClient(base_url=base_url, headers=headers, timeout=httpx.Timeout(None, connect=10.0),
+                                 limits=limits) as client:
+        deadline = time.monotonic() + ready_timeout_s
+        while True:
+            try:
+                if (await client.get('/readyz')).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{base_url} was not ready after {ready_timeout_s}s")
+            await asyncio.sleep(0.5)
+
+        for kind, payload in plan[:warmup]:
+            await _send(client, kind, payload, counter)
+
+        queue = list(reversed(plan[warmup:]))
+        results: List[Dict[str, Any]] = []
+
+        async def _client():
+            while queue:
+                kind, payload = queue.pop()
+                results.append(await _send(client, kind, payload, counter))
+
+        start = time.perf_counter()
+        await asyncio.gather(*[_client() for _ in range(concurrency)])
+        duration = time.perf_counter() - start
+
+        # /metrics needs an admin token; without one the run just has no server metrics
+        try:
+            response = await client.get('/metrics')
+            server_metrics = response.json() if response.status_code == 200 else None
+        except (httpx.HTTPError, ValueError):
+            server_metrics = None
+
+    summary = summarize(results, duration, counter.unit)
+    summary['by_kind'] = {kind: summarize([r for r in results if r['kind'] == kind], duration, counter.unit)
+                          for kind in sorted({r['kind'] for r in results})}
+    errors = [r.get('error') for r in results if not r['ok'] and r.get('error')]
+    if errors:
+        summary['sample_errors'] = errors[:5]
+    return {'summary': summary, 'server_metrics': server_metrics}
+
+
+class InProcessServer:
+    """The model server app served by uvicorn on a background thread, backed by the tiny model."""
+
+    def __init__(self, model_path: str, max_new_tokens: int):
+        self.model_path = model_path
+        self.max_new_tokens = max_new_tokens
+        self.server = None
+        self.thread = None
+        self.port = None
+
+    def __enter__(self):
+        # Settings for a self-contained run; anything already exported wins
+        for key, value in {
+            'API_AUTH_ENABLED': 'false',
+            'USER_RATE_LIMIT_RPS': '0',
+            # Every benchmark client shares one address, so lift the per-user caps
+            'USER_MAX_STREAMS': '0',
+            'FAIR_QUEUE_MAX_PER_USER': '1000',
+            'SEMANTIC_CACHE_ENABLED': 'false',
+            'MODEL_ARTIFACT_DIR': '',
+            'QUANTIZED_MODEL_DIR': '',
+            'CPU_INFERENCE_DTYPE': 'fp32',
+            'WARMUP_MODELS': 'gemma,deepseek',
+            'CODEGENIE_DATA_DIR': tempfile.mkdtemp(prefix="codegenie-bench-"),
+        }.items():
+            os.environ.setdefault(key, value)
+
+        import uvicorn
+        from backend import model_loader
+        for name in model_loader.MODELS_CONFIG:
+            model_loader.MODELS_CONFIG[name] = self.model_path
+        from backend.code_generator_module import GENERATION_PARAMS
+        from backend.code_explainer_module import EXPLANATION_PARAMS
+        GENERATION_PARAMS['max_new_tokens'] = self.max_new_tokens
+        EXPLANATION_PARAMS['max_new_tokens'] = self.max_new_tokens
+        from backend.model_server import app
+
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.thread.start()
+        while not self.server.started:
+            if not self.thread.is_alive():
+                raise RuntimeError("Model server failed to start")
+            time.sleep(0.05)
+        return self
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=30)
+
+
+def _environment() -> Dict[str, Any]:
+    def _git(*args):
+        try:
+            return subprocess.run(['git', *args], cwd=PROJECT_ROOT, capture_output=True, text=True, timeout=10).stdout.strip()
+        except (OSError, subprocess.SubprocessError):
+            return ""
+    info = {
+        'commit': _git('rev-parse', 'HEAD') or None,
+        'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+    try:
+        import torch
+        import transformers
+        info.update(torch=torch.__version__, transformers=transformers.__version__,
+                    torch_threads=torch.get_num_threads(), cuda=torch.cuda.is_available())
+    except ImportError:
+        pass
+    return info
+
+
+COMPARED_METRICS = [
+    ('requests_per_s', True), ('tokens_per_s', True),
+    ('latency_ms.p50', False), ('latency_ms.p95', False), ('latency_ms.p99', False),
+    ('ttft_ms.p50', False), ('ttft_ms.p95', False), ('ttft_ms.p99', False),
+]
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any]) -> str:
+    """Table of the headline metrics of two result files, with the relative change."""
+    def _get(summary, path):
+        for key in path.split('.'):
+            summary = (summary or {}).get(key)
+        return summary
+
+    lines = [f"{'metric':<18}{'baseline':>12}{'current':>12}  change"]
+    for path, higher_is_better in COMPARED_METRICS:
+        old, new = _get(baseline['summary'], path), _get(current['summary'], path)
+        if not old or new is None:
+            change = "n/a"
+        else:
+            delta = (new - old) / old * 100
+            better = delta > 0 if higher_is_better else delta < 0
+            change = f"{delta:+.1f}%{'' if abs(delta) < 1 else (' (better)' if better else ' (worse)')}"
+        lines.append(f"{path:<18}{old if old is not None else '-':>12}{new if new is not None else '-':>12}  {change}")
+    return "\n".join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Benchmark the CodeGenie model server.")
+    parser.add_argument('--url', help="Benchmark a running server instead of an in-process one with the tiny model")
+    parser.add_argument('--token', default=os.environ.get("BENCHMARK_TOKEN"), help="Bearer token for --url")
+    parser.add_argument('--tokenizer', help="Tokenizer (path or hub id) used to count output tokens for --url")
+    parser.add_argument('--mix', choices=sorted(MIXES), default='mixed')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=40)
+    parser.add_argument('--warmup-requests', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-new-tokens', type=int, default=64, help="Decode length of the tiny model")
+    parser.add_argument('--hidden-size', type=int, default=64, help="Hidden size of the tiny model")
+    parser.add_argument('--layers', type=int, default=2, help="Layers of the tiny model")
+    parser.add_argument('--model-dir', default=os.path.join(tempfile.gettempdir(), "codegenie-bench-models"))
+    parser.add_argument('--ready-timeout', type=float, default=600)
+    parser.add_argument('--output', help="Result file (default: benchmarks/results/<time>-<commit>.json)")
+    parser.add_argument('--compare', help="Earlier result file to compare against")
+    args = parser.parse_args(argv)
+
+    mix = MIXES[args.mix]
+    headers = {"Authorization": f"Bearer {args.token}"} if args.token else {}
+    if args.url:
+        tokenizer = None
+        if args.tokenizer:
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+        run = asyncio.run(run_load(args.url.rstrip('/'), headers, mix, args.concurrency, args.requests,
+                                   args.warmup_requests, args.seed, TokenCounter(tokenizer), args.ready_timeout))
+        backend = {'type': 'url', 'url': args.url}
+    else:
+        from transformers import AutoTokenizer
+        from benchmarks.tiny_model import build_tiny_model
+        model_path = build_tiny_model(args.model_dir, hidden_size=args.hidden_size, layers=args.layers, seed=args.seed)
+        with InProcessServer(model_path, args.max_new_tokens) as server:
+            run = asyncio.run(run_load(server.url, headers, mix, args.concurrency, args.requests, args.warmup_requests,
+                                       args.seed, TokenCounter(AutoTokenizer.from_pretrained(model_path)),
+                                       args.ready_timeout))
+        backend = {'type': 'tiny', 'hidden_size': args.hidden_size, 'layers': args.layers,
+                   'max_new_tokens': args.max_new_tokens}
+
+    environment = _environment()
+    result = {
+        'benchmark': 'inference',
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'environment': environment,
+        'config': {'mix': args.mix, 'weights': mix, 'concurrency': args.concurrency, 'requests': args.requests,
+                   'warmup_requests': args.warmup_requests, 'seed': args.seed, 'backend': backend},
+        **run
+    }
+
+    output = args.output or os.path.join(
+        PROJECT_ROOT, "benchmarks", "results",
+        f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{(environment['commit'] or 'nogit')[:8]}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2, sort_keys=True)
+
+    summary = result['summary']
+    print(f"{args.mix}: {summary['requests']} requests ({summary['errors']} errors) at concurrency {args.concurrency} "
+          f"in {summary['duration_s']}s")
+    print(f"  {summary['requests_per_s']} req/s, {summary['tokens_per_s']} {summary['token_unit']}/s")
+    for name in ('latency_ms', 'ttft_ms'):
+        values = summary[name]
+        print(f"  {name:<11} p50 {values['p50']:>9}  p95 {values['p95']:>9}  p99 {values['p99']:>9}")
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            print(compare(json.load(f), result))
+    print(f"Results written to {output}")
+    return result
+
+
+if __name__ == "__main__":
+    main()
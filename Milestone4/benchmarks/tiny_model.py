@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Tiny Offline Model
+
+Builds a small randomly initialised Llama model with a character-level tokenizer
+for benchmarks. It needs no network, no GPU and no Hugging Face token, and
+runs the same code path as the real models: tokenizer, chat template,
+model.generate, the prefix cache and the streamer.
+
+The weights come from a fixed seed and decoding in the benchmark is greedy, so
+every run does the same amount of work. One character is one token, so output
+length in characters is the token count. The layer sizes can be raised to make
+per-token compute closer to a real model.
+"""
+
+import os
+import json
+import string
+import hashlib
+
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+CHAT_TEMPLATE = (
+    "{% for message in messages %}<|{{ message['role'] }}|>{{ message['content'] }}\n{% endfor %}"
+    "{% if add_generation_prompt %}<|assistant|>{% endif %}"
+)
+
+
+def build_tiny_model(directory: str, hidden_size: int = 64, layers: int = 2, heads: int = 4, seed: int = 0) -> str:
+    """
+    Write the tiny model and tokenizer to ``directory`` (once per configuration).
+
+    Returns:
+        str: The model directory, usable as a MODELS_CONFIG entry.
+    """
+    settings = {'hidden_size': hidden_size, 'layers': layers, 'heads': heads, 'seed': seed}
+    path = os.path.join(directory, "tiny-" + hashlib.sha256(json.dumps(settings, sort_keys=True).encode()).hexdigest()[:12])
+    if os.path.exists(os.path.join(path, "config.json")):
+        return path
+
+    vocab = {"<pad>": 0, "<eos>": 1, "<bos>": 2, "<unk>": 3}
+    for char in string.printable:
+        vocab.setdefault(char, len(vocab))
+    backend = Tokenizer(models.WordLevel(vocab=vocab, unk_token="<unk>"))
+    backend.pre_tokenizer = pre_tokenizers.Split("", "isolated")
+    backend.decoder = decoders.Fuse()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, bos_token="<bos>", eos_token="<eos>",
+                                        unk_token="<unk>", pad_token="<pad>")
+    tokenizer.chat_template = CHAT_TEMPLATE
+
+    torch.manual_seed(seed)
+    config = LlamaConfig(
+        vocab_size=len(vocab),
+        hidden_size=hidden_size,
+        intermediate_size=hidden_size * 2,
+        num_hidden_layers=layers,
+        num_attention_heads=heads,
+        num_key_value_heads=heads,
+        max_position_embeddings=4096,
+        bos_token_id=vocab["<bos>"],
+        eos_token_id=vocab["<eos>"],
+        pad_token_id=vocab["<pad>"]
+    )
+    model = LlamaForCausalLM(config)
+    # Never emit end-of-sequence, so every request decodes its full max_new_tokens
+    model.generation_config.suppress_tokens = [vocab["<eos>"], vocab["<pad>"]]
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    tokenizer.save_pretrained(tmp_path)
+    model.save_pretrained(tmp_path)
+    os.replace(tmp_path, path)
+    return path
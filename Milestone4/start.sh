@@ -1,12 +1,29 @@
 #!/bin/bash
 set -e
 
+# Tokens must be signed with a fixed secret, or every restart logs everyone out
+if [ -z "$JWT_SECRET_KEY" ] && [ "${API_AUTH_ENABLED:-true}" != "false" ]; then
+    echo "WARNING: JWT_SECRET_KEY is not set; the model server will sign tokens with a random per-start key."
+    echo "         Set it (e.g. docker run -e JWT_SECRET_KEY=\$(openssl rand -hex 32) ...) to keep sessions across restarts."
+fi
+
 # Start the FastAPI backend in the background
+# (MODEL_SERVER_WORKERS>1 forks workers that share the loaded weights, behind a router on port 8000)
 echo "Starting FastAPI Backend..."
-uvicorn backend.model_server:app --host 0.0.0.0 --port 8000 &
+python -m backend.serve &
 
-# Wait a few seconds for the backend to initialize
-sleep 5
+# Wait until the backend has loaded and warmed up its models (/readyz returns 200)
+READY_TIMEOUT_S=${READY_TIMEOUT_S:-900}
+echo "Waiting for the model server to become ready (up to ${READY_TIMEOUT_S}s)..."
+waited=0
+until python -c "import urllib.request; urllib.request.urlopen('http://localhost:8000/readyz', timeout=5)" 2>/dev/null; do
+    if [ "$waited" -ge "$READY_TIMEOUT_S" ]; then
+        echo "Model server not ready after ${READY_TIMEOUT_S}s; starting the UI anyway"
+        break
+    fi
+    sleep 2
+    waited=$((waited + 2))
+done
 
 # Start the Streamlit frontend
 echo "Starting Streamlit App..."
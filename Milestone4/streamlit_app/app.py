@@ -10,13 +10,13 @@ from PIL import Image
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from backend.user_management_module import (
-    register_user_with_password, verify_user_password, generate_password_reset_otp,
+    register_user_with_password, generate_password_reset_otp,
     reset_password_with_otp, reset_password_with_security_question,
     get_user_by_id, get_user_stats, get_user_activity, replace_user, delete_user,
-    promote_user_to_admin, get_all_users
+    promote_user_to_admin, list_users, list_user_activity
 )
-from backend.feedback_logger_module import log_feedback
-from backend.user_history_module import log_user_query
+from backend.feedback_logger_module import log_feedback, list_feedback
+from backend.user_history_module import log_user_query, list_history
 from backend.feedback_analysis_module import (
     generate_avatar_image, save_user_avatar, load_user_avatar,
     pil_image_to_bytes, generate_wordcloud_image, analyze_sentiments
@@ -43,22 +43,44 @@ local_css("streamlit_app/style.css")
 # --- Session State Initialization ---
 if 'token' not in st.session_state:
     st.session_state.token = None
+if 'refresh_token' not in st.session_state:
+    st.session_state.refresh_token = None
 if 'user' not in st.session_state:
     st.session_state.user = None
 if 'messages' not in st.session_state:
     st.session_state.messages = []
 if 'page' not in st.session_state:
     st.session_state.page = "Login"
+if 'backend_ready' not in st.session_state:
+    st.session_state.backend_ready = False
 
 # --- Backend API URL ---
 API_URL = "http://localhost:8000"
+# Seconds between readiness checks while the backend warms up
+READY_POLL_S = 3
 
 # --- Helper Functions ---
 
+def request_tokens(username, password):
+    """Log in against the backend, which verifies the password and issues access/refresh tokens."""
+    try:
+        response = requests.post(f"{API_URL}/auth/token", json={"username": username, "password": password}, timeout=30)
+    except requests.ConnectionError:
+        # Only the backend issues tokens; the UI never holds the signing key
+        return {'success': False, 'error': "The backend is not reachable. Please try again in a moment."}
+    if response.status_code == 200:
+        return {'success': True, **response.json()}
+    try:
+        error = response.json().get('detail', 'Login failed')
+    except ValueError:
+        error = response.text or 'Login failed'
+    return {'success': False, 'error': error}
+
 def login_user(username, password):
-    res = verify_user_password(username, password)
+    res = request_tokens(username, password)
     if res['success']:
-        st.session_state.token = "dummy_token" # In real app, use JWT from backend
+        st.session_state.token = res['access_token']
+        st.session_state.refresh_token = res['refresh_token']
         st.session_state.user = {'user_id': res['user_id'], 'role': res['role']}
         st.session_state.page = "CodeGenie"
         st.success("Logged in successfully!")
@@ -66,8 +88,105 @@ def login_user(username, password):
     else:
         st.error(res.get('error', 'Login failed'))
 
+def auth_headers():
+    return {"Authorization": f"Bearer {st.session_state.token}"} if st.session_state.token else {}
+
+def refresh_access_token():
+    """Swap the refresh token for a new token pair; returns False when the session has expired."""
+    if not st.session_state.refresh_token:
+        return False
+    try:
+        response = requests.post(f"{API_URL}/auth/refresh", json={"refresh_token": st.session_state.refresh_token}, timeout=10)
+    except requests.RequestException:
+        return False
+    if response.status_code != 200:
+        return False
+    tokens = response.json()
+    st.session_state.token = tokens['access_token']
+    st.session_state.refresh_token = tokens['refresh_token']
+    return True
+
+def post_to_api(endpoint, payload, **kwargs):
+    """POST with the session's access token, refreshing it once if the backend rejects it."""
+    response = requests.post(f"{API_URL}{endpoint}", json=payload, headers=auth_headers(), **kwargs)
+    if response.status_code == 401 and refresh_access_token():
+        response.close()
+        response = requests.post(f"{API_URL}{endpoint}", json=payload, headers=auth_headers(), **kwargs)
+    return response
+
+def stream_from_api(endpoint, payload):
+    """Yield text chunks from one of the backend's server-sent event endpoints."""
+    with post_to_api(endpoint, payload, stream=True) as response:
+        if response.status_code == 401:
+            raise RuntimeError("Your session has expired, please log in again.")
+        if response.status_code != 200:
+            raise RuntimeError(response.text)
+        event = "message"
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                event = "message"
+                continue
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:"):
+                data = json.loads(line[len("data:"):].strip())
+                if event == "done":
+                    return
+                if event == "error":
+                    raise RuntimeError(data.get("error", "Streaming failed"))
+                yield data.get("token", "")
+        # Without a 'done' event the output is incomplete
+        raise RuntimeError("The stream ended before generation finished.")
+
+def backend_readiness():
+    """Return the backend's /readyz report, or None while it is not accepting connections."""
+    try:
+        return requests.get(f"{API_URL}/readyz", timeout=5).json()
+    except (requests.RequestException, ValueError):
+        return None
+
+def wait_for_backend():
+    """Hold a model page until the backend has warmed up, showing its progress."""
+    if st.session_state.backend_ready:
+        return
+    report = backend_readiness()
+    if report and report.get('ready'):
+        st.session_state.backend_ready = True
+        return
+    st.info("The model server is still starting up. This page continues automatically once the models are warm.")
+    if report:
+        # Behind the multi-worker router the first worker's report is representative
+        report = next(iter(report['workers'].values()), report) if 'workers' in report else report
+        for name, state in report.get('models', {}).items():
+            if state.get('required'):
+                st.write(f"**{name}**: {state['state']}")
+    else:
+        st.caption("Waiting for the model server to accept connections...")
+    time.sleep(READY_POLL_S)
+    st.rerun()
+
+def cursor_pager(key, fetch, reset_on=None):
+    """Render one page from fetch(cursor) with Previous/Next buttons; the cursor stack lives in session state."""
+    state_key = f"{key}_pager"
+    pager = st.session_state.get(state_key)
+    if pager is None or pager['reset_on'] != reset_on:
+        pager = st.session_state[state_key] = {'cursors': [None], 'reset_on': reset_on}
+    page = fetch(pager['cursors'][-1])
+    if page.get('error'):
+        st.error(page['error'])
+    prev_col, info_col, next_col = st.columns([1, 2, 1])
+    if prev_col.button("◀ Previous", key=f"{key}_prev", disabled=len(pager['cursors']) == 1):
+        pager['cursors'].pop()
+        st.rerun()
+    info_col.caption(f"Page {len(pager['cursors'])}")
+    if next_col.button("Next ▶", key=f"{key}_next", disabled=not page['next_cursor']):
+        pager['cursors'].append(page['next_cursor'])
+        st.rerun()
+    return page
+
 def logout_user():
     st.session_state.token = None
+    st.session_state.refresh_token = None
     st.session_state.user = None
     st.session_state.messages = []
     st.session_state.page = "Login"
@@ -147,10 +266,14 @@ def show_login_page():
 
 def show_codegenie_page():
     st.header("🧞‍♂️ CodeGenie Workspace")
+    wait_for_backend()
     
     # Model Selection
     model_choice = st.selectbox("Select Model", ["gemma", "deepseek", "phi-2"])
     language = st.selectbox("Language", ["Python", "JavaScript", "C++", "Java", "SQL", "Go"])
+    deterministic = st.checkbox("Deterministic output (repeat requests are served from cache)", key="gen_deterministic")
+    bypass_cache = st.checkbox("Always run the model (skip cached answers)", key="gen_bypass_cache")
+    speculative = st.checkbox("Speculative decoding (faster, deterministic output)", key="gen_speculative")
     
     # Chat Interface
     for msg in st.session_state.messages:
@@ -164,22 +287,29 @@ def show_codegenie_page():
             st.markdown(prompt)
             
         with st.chat_message("assistant"):
-            with st.spinner("Generating code..."):
-                try:
-                    # Call Backend API
-                    payload = {"prompt": prompt, "language": language, "model": model_choice}
-                    response = requests.post(f"{API_URL}/generate", json=payload)
-                    if response.status_code == 200:
-                        code = response.json().get("code", "")
-                        st.code(code, language=language.lower())
-                        st.session_state.messages.append({"role": "assistant", "content": f"```\n{code}\n```"})
-                        
-                        # Log history
-                        log_user_query(st.session_state.user['user_id'], prompt, language, code, "", model_choice)
-                    else:
-                        st.error(f"Error: {response.text}")
-                except Exception as e:
-                    st.error(f"Connection Error: {e}")
+            placeholder = st.empty()
+            try:
+                # Stream tokens from the backend as they are decoded
+                payload = {"prompt": prompt, "language": language, "model": model_choice,
+                           "deterministic": deterministic, "bypass_cache": bypass_cache, "speculative": speculative}
+                code = ""
+                with st.spinner("Generating code..."):
+                    chunks = stream_from_api("/generate/stream", payload)
+                    first = next(chunks, None)
+                if first is not None:
+                    code = first
+                    placeholder.code(code, language=language.lower())
+                    for chunk in chunks:
+                        code += chunk
+                        placeholder.code(code, language=language.lower())
+                code = code.strip()
+                placeholder.code(code, language=language.lower())
+                st.session_state.messages.append({"role": "assistant", "content": f"```\n{code}\n```"})
+
+                # Log history
+                log_user_query(st.session_state.user['user_id'], prompt, language, code, "", model_choice)
+            except Exception as e:
+                st.error(f"Error: {e}")
 
     # Feedback
     with st.expander("Give Feedback"):
@@ -192,26 +322,36 @@ def show_codegenie_page():
 
 def show_explainer_page():
     st.header("🧠 Code Explainer")
+    wait_for_backend()
     
     code_input = st.text_area("Paste code here", height=200)
     style = st.selectbox("Explanation Style", ["Beginner-Friendly", "Technical Deep-Dive", "Step-by-Step Guide"])
     model_choice = st.selectbox("Model", ["deepseek", "gemma", "phi-2"])
+    deterministic = st.checkbox("Deterministic output (repeat requests are served from cache)", key="exp_deterministic")
+    speculative = st.checkbox("Speculative decoding (faster, deterministic output)", key="exp_speculative")
     
     if st.button("Explain"):
         if code_input:
-            with st.spinner("Analyzing..."):
-                try:
-                    payload = {"code": code_input, "style": style, "model": model_choice}
-                    response = requests.post(f"{API_URL}/explain", json=payload)
-                    if response.status_code == 200:
-                        explanation = response.json().get("explanation", "")
-                        st.markdown(explanation)
-                        # Log
-                        log_user_query(st.session_state.user['user_id'], "Explain Code", "N/A", code_input, explanation, model_choice)
-                    else:
-                        st.error(f"Error: {response.text}")
-                except Exception as e:
-                    st.error(f"Connection Error: {e}")
+            placeholder = st.empty()
+            try:
+                payload = {"code": code_input, "style": style, "model": model_choice, "deterministic": deterministic,
+                           "speculative": speculative}
+                explanation = ""
+                with st.spinner("Analyzing..."):
+                    chunks = stream_from_api("/explain/stream", payload)
+                    first = next(chunks, None)
+                if first is not None:
+                    explanation = first
+                    placeholder.markdown(explanation)
+                    for chunk in chunks:
+                        explanation += chunk
+                        placeholder.markdown(explanation)
+                explanation = explanation.strip()
+                placeholder.markdown(explanation)
+                # Log
+                log_user_query(st.session_state.user['user_id'], "Explain Code", "N/A", code_input, explanation, model_choice)
+            except Exception as e:
+                st.error(f"Error: {e}")
         else:
             st.warning("Please paste some code first.")
 
@@ -247,9 +387,9 @@ def show_profile_page():
         st.metric("Avg Rating Given", user_stats.get('average_rating', 0.0))
 
     st.subheader("Activity History")
-    history = get_user_activity(user_id)
+    history = get_user_activity(user_id, limit=5)
     if history:
-        for item in history[-5:]: # Last 5
+        for item in history: # Last 5
             st.text(f"{item['timestamp']} - {item['activity_type']}")
     else:
         st.info("No activity yet.")
@@ -273,7 +413,7 @@ def show_admin_dashboard():
     c4.metric("Active Users", stats['active_users'])
     
     # Tabs
-    tab1, tab2, tab3 = st.tabs(["Analytics", "User Management", "Global Search"])
+    tab1, tab2, tab3, tab4 = st.tabs(["Analytics", "User Management", "Global Search", "Logs"])
     
     with tab1:
         st.subheader("Feedback Word Cloud")
@@ -287,10 +427,23 @@ def show_admin_dashboard():
         st.subheader("Top Languages")
         st.bar_chart(stats['top_languages'])
 
+        with st.expander("Logging queue"):
+            st.json(stats['write_behind'])
+        with st.expander("Login hashing"):
+            st.json(stats['auth'])
+
     with tab2:
         st.subheader("Manage Users")
-        users = get_all_users()
-        for u in users:
+        sort_col, order_col, size_col = st.columns(3)
+        sort = sort_col.selectbox("Sort by", ["created", "username", "user_id"], key="users_sort")
+        descending = order_col.checkbox("Descending", key="users_desc")
+        page_size = size_col.selectbox("Per page", [10, 25, 50], index=1, key="users_page_size")
+        users_page = cursor_pager(
+            "users",
+            lambda cursor: list_users(limit=page_size, cursor=cursor, sort=sort, descending=descending),
+            reset_on=(sort, descending, page_size)
+        )
+        for u in users_page['items']:
             with st.expander(f"{u['username']} ({u['user_id']}) - {u['role']}"):
                 st.write(u)
                 if u['role'] != 'admin':
@@ -313,9 +466,31 @@ def show_admin_dashboard():
     with tab3:
         st.subheader("Global Search")
         q = st.text_input("Search Users, History, Feedback")
+        st.caption('Tip: use "quotes" for exact phrases and word* for prefixes.')
         if q:
-            results = search_global(q)
-            st.write(results)
+            page = st.number_input("Page", min_value=1, value=1, step=1, key="search_page")
+            results = search_global(q, page=int(page))
+            for kind in ('users', 'history', 'feedback'):
+                st.markdown(f"**{kind.title()}** ({results['totals'][kind]} matches)")
+                if results[kind]:
+                    st.write(results[kind])
+            if not any(results['has_more'].values()) and page > 1 and not any(results[k] for k in ('users', 'history', 'feedback')):
+                st.info("No more results.")
+
+    with tab4:
+        st.subheader("Logs")
+        log_kind = st.radio("Log", ["History", "Feedback", "Activity"], horizontal=True, key="log_kind")
+        log_user = st.text_input("User ID (activity only)", key="log_user") if log_kind == "Activity" else ""
+        fetchers = {
+            "History": lambda cursor: list_history(limit=25, cursor=cursor),
+            "Feedback": lambda cursor: list_feedback(limit=25, cursor=cursor),
+            "Activity": lambda cursor: list_user_activity(log_user or None, limit=25, cursor=cursor)
+        }
+        log_page = cursor_pager("logs", fetchers[log_kind], reset_on=(log_kind, log_user))
+        if log_page['items']:
+            st.dataframe(log_page['items'])
+        else:
+            st.info("No entries.")
 
 
 # --- Main Navigation ---